@@ -0,0 +1,113 @@
+"""
+Load test: dashboard latency during bursts of /api/lookup
+
+Measures /api/stats latency while idle, then again while a burst of
+concurrent /api/lookup requests is in flight. VirusTotal is replaced by a
+local stub that answers after --vt-delay seconds, so no quota is spent;
+start the server under test against it:
+
+    VIRUSTOTAL_API_KEY=stub VIRUSTOTAL_BASE_URL=http://127.0.0.1:8099 \\
+        gunicorn --config gunicorn_config.py web.app:app
+
+then run: python benchmarks/load_lookup.py [--url http://127.0.0.1:5000]
+
+With sync workers the stats latency rises to the stub delay once the
+burst outnumbers the workers; with gthread or gevent it stays flat.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+
+def start_vt_stub(port, delay):
+    """Serve slow, fixed VirusTotal-shaped answers in a background thread"""
+    body = json.dumps({'data': {'attributes': {'last_analysis_stats': {
+        'malicious': 3, 'suspicious': 0, 'harmless': 60, 'undetected': 10
+    }}}}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed_get(url):
+    start = time.perf_counter()
+    requests.get(url, timeout=60)
+    return time.perf_counter() - start
+
+
+def stats_latencies(base_url, samples, interval):
+    """Sequential /api/stats latencies, one request every interval seconds"""
+    latencies = []
+    for _ in range(samples):
+        latencies.append(timed_get(f'{base_url}/api/stats'))
+        time.sleep(interval)
+    return latencies
+
+
+def lookup_burst(base_url, count):
+    """Fire count concurrent lookups; returns (latencies, busy responses)"""
+    def lookup(i):
+        start = time.perf_counter()
+        response = requests.post(f'{base_url}/api/lookup', json={'query': f'10.0.{i // 256}.{i % 256}'}, timeout=60)
+        busy = response.ok and response.json().get('virustotal', {}).get('busy', False)
+        return time.perf_counter() - start, busy
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        results = list(pool.map(lookup, range(count)))
+    return [latency for latency, _ in results], sum(busy for _, busy in results)
+
+
+def summary(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50 {statistics.median(ordered) * 1000:7.1f} ms   p95 {p95 * 1000:7.1f} ms   max {ordered[-1] * 1000:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Server under test')
+    parser.add_argument('--burst', type=int, default=32, help='Concurrent lookups per burst')
+    parser.add_argument('--samples', type=int, default=20, help='/api/stats requests per phase')
+    parser.add_argument('--vt-port', type=int, default=8099, help='Port of the VirusTotal stub (0 = no stub)')
+    parser.add_argument('--vt-delay', type=float, default=2.0, help='Seconds the stub takes to answer')
+    args = parser.parse_args()
+
+    if args.vt_port:
+        start_vt_stub(args.vt_port, args.vt_delay)
+    timed_get(f'{args.url}/api/stats')
+
+    idle = stats_latencies(args.url, args.samples, 0.05)
+
+    burst_result = {}
+    burst = threading.Thread(target=lambda: burst_result.update(zip(('latencies', 'busy'), lookup_burst(args.url, args.burst))))
+    burst.start()
+    time.sleep(0.1)
+    loaded = stats_latencies(args.url, args.samples, 0.05)
+    burst.join()
+
+    print(f"/api/stats idle:         {summary(idle)}")
+    print(f"/api/stats during burst: {summary(loaded)}")
+    print(f"/api/lookup x{args.burst}:        {summary(burst_result['latencies'])}")
+    print(f"Lookups turned away by the VirusTotal limit: {burst_result['busy']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,10 @@ class Config:
     DEBUG = False
     TESTING = False
     
+    # Storage backend: 'mongo' or 'sqlite' (embedded, see db/store.py)
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongo')
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/cti_dashboard.db')
+    
     # MongoDB
     MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
     MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'cti_dashboard')
@@ -39,9 +43,17 @@ class Config:
     RATELIMIT_DEFAULT = os.getenv('RATELIMIT_DEFAULT', '100 per hour')
     RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
     
-    # Caching
-    CACHE_TYPE = os.getenv('CACHE_TYPE', 'SimpleCache')
+    # Caching: SharedCache is one file-backed cache for all workers on the host (web/shared_cache.py)
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'web.shared_cache.SharedCache')
     CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 300))
+    CACHE_DIR = os.getenv('CACHE_DIR', 'data/cache')
+    CACHE_THRESHOLD = int(os.getenv('CACHE_THRESHOLD', 500))
+    # Seconds an expired entry is still served while one worker refreshes it
+    CACHE_STALE_SECONDS = int(os.getenv('CACHE_STALE_SECONDS', 300))
+    CACHE_LOCK_TIMEOUT = int(os.getenv('CACHE_LOCK_TIMEOUT', 30))
+    CACHE_WAIT_TIMEOUT = float(os.getenv('CACHE_WAIT_TIMEOUT', 5))
+    # Responses keyed by ingest generation only need to outlive the gap between ingests
+    GENERATION_CACHE_TIMEOUT = int(os.getenv('GENERATION_CACHE_TIMEOUT', 3600))
     
     # Logging
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -56,6 +68,7 @@ class Config:
     ENABLE_EXPORT = os.getenv('ENABLE_EXPORT', 'true').lower() == 'true'
     ENABLE_API_DOCS = os.getenv('ENABLE_API_DOCS', 'true').lower() == 'true'
     MAX_EXPORT_RECORDS = int(os.getenv('MAX_EXPORT_RECORDS', 10000))
+    MAX_BULK_LOOKUP = int(os.getenv('MAX_BULK_LOOKUP', 50000))
     
     # Pagination
     DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
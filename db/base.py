@@ -0,0 +1,366 @@
+"""
+Storage interface for CTI Dashboard
+
+Web apps, ingestors, the scanner and manage.py only talk to the
+`db_manager` returned by db.store, so any backend implementing IOCStore
+can serve them. The MongoDB backend lives in db/mongo.py and the
+embedded SQLite backend in db/sqlite_store.py.
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from db.normalize import canonicalize
+from db.ranges import RangeIndex
+from db.snapshot import ioc_snapshot, write_snapshot, SNAPSHOT_PATH
+
+# Seconds a process reuses the ingest generation before re-reading it
+GENERATION_CHECK_SECONDS = float(os.getenv('GENERATION_CHECK_SECONDS', 2))
+
+# New IOCs carried in each change event; counts and deltas cover all of them
+EVENT_MAX_IOCS = int(os.getenv('EVENT_MAX_IOCS', 100))
+
+# IOC fields carried in change events
+EVENT_IOC_FIELDS = ('value', 'type', 'source', 'threat_level', 'timestamp')
+
+
+class IOCStore(ABC):
+    """Operations every IOC storage backend provides"""
+
+    # Backend name reported by health checks
+    backend = None
+
+    def __init__(self):
+        self.ranges = RangeIndex()
+        self._generation = None
+
+    # Connection
+
+    @abstractmethod
+    def connect(self):
+        """Open the backend and ensure its schema/indexes; returns True on success"""
+
+    @abstractmethod
+    def is_connected(self):
+        """Whether connect() has succeeded"""
+
+    @abstractmethod
+    def ping(self):
+        """Round trip to the backend; raises if it is unreachable"""
+
+    @abstractmethod
+    def close(self):
+        """Release the backend connection"""
+
+    def reset_after_fork(self):
+        """Forget connections inherited from a parent process (called in each forked worker)"""
+
+    def pool_stats(self):
+        """Connection pool usage for this process, or None if the backend has no pool"""
+        return None
+
+    # Ingest generation
+
+    @abstractmethod
+    def _load_generation(self):
+        """Stored (generation, modified_at); (0, None) before the first write"""
+
+    @abstractmethod
+    def _increment_generation(self):
+        """Atomically increment the stored ingest generation; returns the new (generation, modified_at)"""
+
+    def ingest_version(self):
+        """
+        (generation, modified_at) of the stored IOCs.
+
+        generation is a monotonic counter bumped whenever ingest, retention
+        or tagging changes the stored IOCs, and modified_at the naive UTC
+        time of that change. Cache keys and ETags include the generation,
+        so cached responses stay valid until the data changes. Re-read at
+        most every GENERATION_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        cached = self._generation
+        if cached and cached[0] > now:
+            return cached[1]
+        try:
+            version = self._load_generation()
+        except Exception as e:
+            print(f"Error reading ingest generation: {e}")
+            return cached[1] if cached else (0, None)
+        self._generation = (now + GENERATION_CHECK_SECONDS, version)
+        return version
+
+    def ingest_generation(self):
+        """Current ingest generation; see ingest_version"""
+        return self.ingest_version()[0]
+
+    def _next_generation(self):
+        """Increment the generation without publishing; the caller publishes the change event"""
+        try:
+            version = self._increment_generation()
+        except Exception as e:
+            print(f"Error bumping ingest generation: {e}")
+            return None
+        self._generation = (time.monotonic() + GENERATION_CHECK_SECONDS, version)
+        return version[0]
+
+    def bump_generation(self, reason='changed'):
+        """
+        Record a change that adds or removes no IOCs (tags, repaired stats,
+        rebuilt trends); returns the new generation.
+
+        An empty-delta event is published for it so event ids stay
+        contiguous and streaming clients do not mistake it for a gap.
+        """
+        generation = self._next_generation()
+        self._publish_change(generation, [], 0, reason=reason)
+        return generation
+
+    # Change events
+
+    @abstractmethod
+    def publish_event(self, event):
+        """Append an event, keyed by its 'generation', to the change feed"""
+
+    @abstractmethod
+    def iter_events(self, after=0, timeout=30):
+        """
+        Yield change events with generation > after, oldest first, for up
+        to timeout seconds. Yields None whenever nothing arrived for a
+        while, so streaming callers can send keep-alives.
+        """
+
+    def _publish_change(self, generation, iocs, indicators, sign=1, reason=None):
+        """
+        Publish the IOCs added (sign=1) or removed (sign=-1) by one write as
+        stat deltas; indicators is how many consolidated indicators the
+        write created or removed.
+
+        Every generation gets an event: a write that added or removed no
+        IOCs publishes a 'changed' event with an empty delta, and reason
+        says what changed instead.
+        """
+        if generation is None:
+            return
+        if iocs:
+            event_type = 'iocs' if sign > 0 else 'removed'
+        else:
+            event_type = 'changed'
+        event = {
+            'generation': generation,
+            'type': event_type,
+            'count': len(iocs),
+            'delta': {
+                'total': sign * indicators,
+                'listings': sign * len(iocs),
+                'by_type': {k: sign * v for k, v in Counter(ioc.get('type') for ioc in iocs).items() if k},
+                'by_source': {k: sign * v for k, v in Counter(ioc.get('source') for ioc in iocs).items() if k}
+            }
+        }
+        if reason:
+            event['reason'] = reason
+        if event_type == 'iocs':
+            event['iocs'] = [
+                {field: ioc[field] for field in EVENT_IOC_FIELDS if field in ioc}
+                for ioc in iocs[:EVENT_MAX_IOCS]
+            ]
+        try:
+            self.publish_event(event)
+        except Exception as e:
+            print(f"Error publishing change event: {e}")
+
+    # Ingest
+
+    @abstractmethod
+    def insert_ioc(self, ioc_data):
+        """Insert a single IOC; returns True if it was new"""
+
+    @abstractmethod
+    def bulk_upsert_iocs(self, ioc_list, batch_size=None):
+        """Insert IOCs keyed on (canonical, source), advancing last_seen on matches; returns inserted/matched/failed/batches"""
+
+    def insert_many_iocs(self, ioc_list):
+        """Insert multiple IOCs, returning the number of new IOCs"""
+        if not ioc_list:
+            return 0
+
+        return self.bulk_upsert_iocs(ioc_list)['inserted']
+
+    # Listing
+
+    @abstractmethod
+    def get_all_iocs(self, limit=100, fields=None):
+        """Newest IOCs, up to limit"""
+
+    @abstractmethod
+    def get_iocs_page(self, filter_query=None, limit=100, cursor=None, skip=0, fields=None):
+        """One keyset page of IOCs; returns (iocs, next_cursor)"""
+
+    @abstractmethod
+    def iter_iocs(self, filter_query=None, limit=0, fields=None):
+        """Lazily iterate IOCs, newest first"""
+
+    @abstractmethod
+    def count_iocs(self, filter_query=None):
+        """Number of IOCs matching a type/source/tags filter"""
+
+    @abstractmethod
+    def distinct_values(self, field):
+        """Distinct values of an IOC field (e.g. source, type)"""
+
+    # Lookup and search
+
+    @abstractmethod
+    def search_iocs(self, query, limit=50, fields=None):
+        """Exact, prefix and substring search on IOC values"""
+
+    @abstractmethod
+    def find_indicator(self, value, ioc_type=None):
+        """Consolidated indicator (one document, a sighting per source) for value, or None"""
+
+    @abstractmethod
+    def bulk_lookup(self, canonicals, batch_size=None):
+        """Map each canonical key to its matching IOC documents"""
+
+    @abstractmethod
+    def _load_ip_ranges(self, last_id):
+        """ip_range IOCs with an _id greater than last_id (all if None), sorted by _id"""
+
+    def _refresh_ranges(self):
+        """Pick up new ip_range IOCs; on failure lookups keep the ranges already loaded"""
+        try:
+            self.ranges.refresh(self._load_ip_ranges)
+        except Exception as e:
+            print(f"Error refreshing IP ranges: {e}")
+
+    def find_ip_ranges(self, ip):
+        """ip_range IOCs whose network contains the given IP"""
+        self._refresh_ranges()
+        return self.ranges.lookup(canonicalize(ip, 'ip'))
+
+    def find_ip_ranges_many(self, ips):
+        """Map each IP to the ip_range IOCs whose network contains it"""
+        self._refresh_ranges()
+        return self.ranges.lookup_many(ips)
+
+    # Lookup verdict cache
+
+    @abstractmethod
+    def get_verdict(self, key):
+        """Cached {'verdict', 'cached_at', 'expires_at'} for key, or None if absent or expired"""
+
+    @abstractmethod
+    def save_verdict(self, key, verdict, expires_at):
+        """Cache a lookup verdict under key until expires_at (naive UTC)"""
+
+    # Snapshot
+
+    @abstractmethod
+    def iter_canonical_sources(self):
+        """Yield (canonical, source) for every stored IOC"""
+
+    def _snapshot_documents(self, canonical, sources):
+        """Minimal IOC documents for a snapshot hit"""
+        return [
+            {'value': canonical, 'canonical': canonical, 'source': source,
+             'snapshot_version': ioc_snapshot.version}
+            for source in sources
+        ]
+
+    def _snapshot_indicator(self, canonical, sources):
+        """Minimal consolidated indicator for a snapshot hit, or None"""
+        if not sources:
+            return None
+        return {
+            '_id': canonical, 'canonical': canonical, 'value': canonical,
+            'sources': sources, 'sighting_count': len(sources),
+            'sightings': [{'source': source} for source in sources],
+            'snapshot_version': ioc_snapshot.version
+        }
+
+    def publish_snapshot(self, path=SNAPSHOT_PATH):
+        """
+        Publish all canonical IOC keys as a memory-mapped snapshot.
+
+        Returns (version, key_count), or None on failure.
+        """
+        try:
+            entries = {}
+            for canonical, source in self.iter_canonical_sources():
+                entries.setdefault(canonical, set()).add(source or 'Unknown')
+            version = write_snapshot(path, entries)
+            return version, len(entries)
+        except Exception as e:
+            print(f"Error publishing IOC snapshot: {e}")
+            return None
+
+    # Retention
+
+    @abstractmethod
+    def iter_expired(self, filter_query, before, limit=0):
+        """IOCs matching filter_query that no feed has listed (last_seen) since before"""
+
+    @abstractmethod
+    def delete_iocs(self, iocs, batch_size=None):
+        """Delete IOC documents by _id, keeping statistics in step; returns the number deleted"""
+
+    # Maintenance
+
+    def backfill_search_fields(self, batch_size=None):
+        """Populate derived search fields on old IOCs; returns the number updated"""
+        return 0
+
+    def backfill_canonical(self, batch_size=None):
+        """Populate canonical on old IOCs; returns (updated, duplicates)"""
+        return 0, 0
+
+    def consolidate_indicators(self, batch_size=None):
+        """Rebuild stored consolidated indicators; returns (indicators, skipped)"""
+        return 0, 0
+
+    # Indexes
+
+    def migrate_indexes(self):
+        """Apply pending index migrations; returns (version, errors)"""
+        return 0, []
+
+    def check_query_plans(self):
+        """Query plan of each hot repository query, flagging full scans"""
+        return []
+
+    # Statistics
+
+    @abstractmethod
+    def get_stats(self):
+        """Totals by type and source"""
+
+    @abstractmethod
+    def get_threat_level_stats(self):
+        """Counts by threat level"""
+
+    @abstractmethod
+    def get_trends(self, days=7):
+        """Per-day counts by type for the last days"""
+
+    @abstractmethod
+    def reconcile_stats(self):
+        """Rebuild any precomputed statistics from the stored IOCs"""
+
+    @abstractmethod
+    def rebuild_trend_buckets(self):
+        """Rebuild any precomputed trend data; returns the number of days"""
+
+    # Tags
+
+    @abstractmethod
+    def add_tag_to_ioc(self, ioc_id, tag):
+        """Add a tag to an IOC"""
+
+    @abstractmethod
+    def remove_tag_from_ioc(self, ioc_id, tag):
+        """Remove a tag from an IOC"""
+
+    @abstractmethod
+    def get_iocs_by_tag(self, tag, fields=None):
+        """IOCs carrying a tag, newest first"""
@@ -0,0 +1,284 @@
+"""
+Versioned MongoDB index migrations for CTI Dashboard
+
+Indexes are declared here as numbered migrations instead of being
+re-created on every connect. The applied version lives in the
+`schema_migrations` collection; connect() only reads it and, when
+migrations are pending, builds them once in a background thread under a
+lease so concurrent workers do not race.
+
+Indexes build independently: one that fails (e.g. a unique index over
+existing duplicates) is recorded in the migration state and the rest of
+the chain still applies. `python manage.py migrate-indexes` retries the
+recorded failures once the cause is fixed.
+
+QUERY_PROBES lists the hot query of each repository method.
+check_query_plans() runs explain() on every probe and reports any that
+fall back to a collection scan; `python manage.py check-indexes` exits
+non-zero when one does.
+"""
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, HASHED
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Document in schema_migrations holding the applied index version and lease
+MIGRATIONS_ID = 'indexes'
+
+# How long a worker may hold the migration lease before another takes over
+MIGRATION_LEASE_MINUTES = 30
+
+KEYSET = [('timestamp', DESCENDING), ('_id', DESCENDING)]
+
+
+def _index(keys, **options):
+    return {'keys': keys, 'options': options}
+
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Baseline: dedup, canonical lookup, keyset pagination and search indexes',
+        'create': {
+            'iocs': [
+                _index([('canonical', HASHED)]),
+                _index([('canonical', ASCENDING), ('source', ASCENDING)], unique=True,
+                       partialFilterExpression={'canonical': {'$exists': True}}, name='canonical_source_unique'),
+                _index(KEYSET),
+                _index([('type', ASCENDING)] + KEYSET),
+                _index([('source', ASCENDING)] + KEYSET),
+                _index([('type', ASCENDING), ('source', ASCENDING)] + KEYSET),
+                _index([('search_key', ASCENDING)]),
+                _index([('search_grams', ASCENDING)])
+            ]
+        }
+    },
+    {
+        'version': 2,
+        'description': 'Tag listings, threat level aggregation; drop single-field indexes made redundant by compounds',
+        'create': {
+            'iocs': [
+                _index([('tags', ASCENDING)] + KEYSET),
+                _index([('threat_level', ASCENDING)], name='threat_level_partial',
+                       partialFilterExpression={'threat_level': {'$exists': True}})
+            ]
+        },
+        # Each is a prefix of a compound index above
+        'drop': {
+            'iocs': ['value_1', 'type_1', 'source_1', 'timestamp_-1', 'tags_1']
+        }
+    },
+    {
+        'version': 3,
+        'description': 'Expire cached VirusTotal verdicts',
+        'create': {
+            'verdicts': [
+                _index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+            ]
+        }
+    },
+    {
+        'version': 4,
+        'description': 'Retention scans on last_seen',
+        'create': {
+            'iocs': [
+                _index([('type', ASCENDING), ('source', ASCENDING), ('last_seen', ASCENDING)])
+            ]
+        }
+    },
+    {
+        'version': 5,
+        'description': 'Drop value_source_unique, duplicated by canonical_source_unique',
+        'drop': {
+            'iocs': ['value_source_unique']
+        }
+    }
+]
+
+LATEST_VERSION = MIGRATIONS[-1]['version']
+
+# Hot query of each repository method: (name, collection, filter, sort)
+QUERY_PROBES = [
+    ('get_iocs_page', 'iocs', {}, KEYSET),
+    ('get_iocs_page(type)', 'iocs', {'type': 'ip'}, KEYSET),
+    ('get_iocs_page(source)', 'iocs', {'source': 'ThreatFox'}, KEYSET),
+    ('get_iocs_page(type, source)', 'iocs', {'type': 'ip', 'source': 'ThreatFox'}, KEYSET),
+    ('get_iocs_by_tag', 'iocs', {'tags': 'botnet'}, KEYSET),
+    ('count_iocs(type, source)', 'iocs', {'type': 'ip', 'source': 'ThreatFox'}, None),
+    ('search_iocs(exact)', 'iocs', {'canonical': 'evil.com'}, None),
+    ('search_iocs(prefix)', 'iocs', {'search_key': {'$gte': 'evil', '$lt': 'evim'}}, None),
+    ('search_iocs(substring)', 'iocs', {'search_grams': {'$all': ['evi', 'vil']}}, None),
+    ('find_ip_ranges', 'iocs', {'type': 'ip_range'}, [('_id', ASCENDING)]),
+    ('iter_expired', 'iocs', {'type': 'ip', 'source': 'ThreatFox', 'last_seen': {'$lt': datetime(2000, 1, 1)}}, None),
+    ('reconcile_stats(threat_level)', 'iocs', {'threat_level': {'$exists': True}}, None),
+    ('consolidate_indicators', 'iocs', {'canonical': {'$exists': True}},
+     [('canonical', ASCENDING), ('source', ASCENDING)]),
+    ('find_indicator', 'indicators', {'_id': 'evil.com'}, None),
+    ('bulk_lookup', 'indicators', {'_id': {'$in': ['evil.com', '1.2.3.4']}}, None)
+]
+
+
+def _state(db):
+    return db['schema_migrations'].find_one({'_id': MIGRATIONS_ID}) or {}
+
+
+def applied_version(db):
+    """Index version recorded in schema_migrations (0 if none)"""
+    return _state(db).get('version', 0)
+
+
+def failed_indexes(db):
+    """Index changes that failed in applied migrations: [{'version', 'error'}]"""
+    return _state(db).get('failed', [])
+
+
+def _acquire_lease(db):
+    """Claim the migration lease; False if another process holds it"""
+    now = datetime.utcnow()
+    try:
+        db['schema_migrations'].update_one(
+            {'_id': MIGRATIONS_ID, 'lease_until': {'$not': {'$gt': now}}},
+            {'$set': {
+                'lease_until': now + timedelta(minutes=MIGRATION_LEASE_MINUTES),
+                'lease_owner': f"{socket.gethostname()}:{os.getpid()}"
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _release_lease(db, version, failed):
+    db['schema_migrations'].update_one(
+        {'_id': MIGRATIONS_ID},
+        {'$set': {'version': version, 'failed': failed, 'updated_at': datetime.utcnow()},
+         '$unset': {'lease_until': '', 'lease_owner': ''}}
+    )
+
+
+def _apply(db, migration):
+    """
+    Run one migration; returns a list of error strings.
+
+    Each index is created independently. Drops are skipped while any
+    create failed, since they may rely on the new indexes for coverage;
+    retrying the migration runs them.
+    """
+    errors = []
+    for collection, indexes in migration.get('create', {}).items():
+        for index in indexes:
+            try:
+                db[collection].create_index(index['keys'], background=True, **index['options'])
+            except OperationFailure as e:
+                errors.append(f"{collection} {index['keys']}: {e}")
+    if errors:
+        return errors
+    for collection, names in migration.get('drop', {}).items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                db[collection].drop_index(name)
+            except OperationFailure as e:
+                errors.append(f"{collection} drop {name}: {e}")
+    return errors
+
+
+def apply_migrations(db, retry_failed=False):
+    """
+    Apply pending index migrations in order.
+
+    Returns (version, errors). A migration with errors does not stop the
+    ones after it: its failures are recorded (see failed_indexes) and,
+    with retry_failed, the migration is run again. Returns the current
+    version unchanged if another process holds the lease.
+    """
+    state = _state(db)
+    version = state.get('version', 0)
+    if (version >= LATEST_VERSION and not (retry_failed and state.get('failed'))) or not _acquire_lease(db):
+        return version, []
+
+    # Another process may have finished migrating before we took the lease
+    state = _state(db)
+    version = state.get('version', 0)
+    retry = {failure['version'] for failure in state.get('failed', [])} if retry_failed else set()
+    failed = [failure for failure in state.get('failed', []) if failure['version'] not in retry]
+    errors = []
+    try:
+        for migration in MIGRATIONS:
+            if migration['version'] <= version and migration['version'] not in retry:
+                continue
+            print(f"🔧 Applying index migration {migration['version']}: {migration['description']}")
+            migration_errors = _apply(db, migration)
+            failed += [{'version': migration['version'], 'error': error} for error in migration_errors]
+            errors += migration_errors
+            version = max(version, migration['version'])
+    finally:
+        _release_lease(db, version, failed)
+    return version, errors
+
+
+def ensure_indexes(db):
+    """
+    Start pending index migrations in a background thread.
+
+    Connecting only costs one read of schema_migrations; returns the
+    thread when migrations were started, otherwise None.
+    """
+    state = _state(db)
+    if state.get('version', 0) >= LATEST_VERSION:
+        if state.get('failed'):
+            print(f"⚠️  {len(state['failed'])} index changes failed; fix the cause and run "
+                  "`python manage.py migrate-indexes`")
+        return None
+
+    def run():
+        try:
+            version, errors = apply_migrations(db)
+            for error in errors:
+                print(f"⚠️  Index migration error: {error}")
+            if not errors:
+                print(f"✅ Indexes at version {version}")
+        except Exception as e:
+            print(f"⚠️  Index migration failed: {e}")
+
+    thread = threading.Thread(target=run, name='index-migrations', daemon=True)
+    thread.start()
+    return thread
+
+
+def _plan_stages(plan):
+    """Every stage name in an explain() plan tree"""
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        stages += _plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+def check_query_plans(db):
+    """
+    Explain every probe in QUERY_PROBES.
+
+    Returns a list of {'name', 'collection', 'stages', 'collscan'} dicts.
+    """
+    results = []
+    for name, collection, filter_query, sort in QUERY_PROBES:
+        cursor = db[collection].find(filter_query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning = cursor.limit(1).explain().get('queryPlanner', {}).get('winningPlan', {})
+        stages = _plan_stages(winning)
+        results.append({
+            'name': name,
+            'collection': collection,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages
+        })
+    return results
@@ -0,0 +1,137 @@
+"""
+Consolidated indicators for CTI Dashboard
+
+The iocs collection stays a per-feed log: one document per
+(canonical, source). Lookups instead read one document per canonical
+indicator, with a `sightings` entry per source:
+
+  {
+    _id / canonical, value, type,
+    first_seen, last_seen,           across all sources
+    sources: [...], sighting_count,
+    sightings: [{source, value, type, confidence, threat_level,
+                 first_seen, last_seen, metadata}]
+  }
+
+upsert_pipeline() merges one feed IOC into its indicator with a single
+update-pipeline upsert, so ingest stays one round trip per batch.
+consolidate() builds the same document from existing per-feed IOCs.
+"""
+from datetime import datetime
+
+# Sighting fields copied as-is; other feed fields go in sighting.metadata
+SIGHTING_FIELDS = ('confidence', 'threat_level')
+
+# Per-feed fields never copied into metadata
+NON_METADATA_FIELDS = {
+    '_id', 'canonical', 'search_key', 'search_grams', 'timestamp', 'last_seen',
+    'value', 'type', 'source', 'confidence', 'threat_level'
+}
+
+
+def _seen_at(ioc):
+    timestamp = ioc.get('timestamp')
+    return timestamp if isinstance(timestamp, datetime) else datetime.utcnow()
+
+
+def sighting(ioc, seen_at=None):
+    """Sighting entry for a feed IOC"""
+    seen_at = seen_at or _seen_at(ioc)
+    entry = {'source': ioc.get('source'), 'value': ioc.get('value'), 'type': ioc.get('type')}
+    for field in SIGHTING_FIELDS:
+        if field in ioc:
+            entry[field] = ioc[field]
+    entry['first_seen'] = seen_at
+    entry['last_seen'] = seen_at
+    metadata = {key: value for key, value in ioc.items() if key not in NON_METADATA_FIELDS}
+    if metadata:
+        entry['metadata'] = metadata
+    return entry
+
+
+def upsert_pipeline(ioc):
+    """
+    Update pipeline merging a feed IOC into its indicator document.
+
+    Replaces the source's sighting with the latest feed data while keeping
+    its original first_seen, and widens the indicator's first/last seen.
+    Feed values are wrapped in $literal so strings starting with '$' are
+    never read as field paths.
+    """
+    seen_at = _seen_at(ioc)
+    entry = sighting(ioc, seen_at)
+    source = {'$literal': ioc.get('source')}
+    other_sightings = {'$filter': {
+        'input': {'$ifNull': ['$sightings', []]},
+        'cond': {'$ne': ['$$this.source', source]}
+    }}
+    previous = {'$arrayElemAt': [{'$filter': {
+        'input': {'$ifNull': ['$sightings', []]},
+        'cond': {'$eq': ['$$this.source', source]}
+    }}, 0]}
+    return [
+        {'$set': {'_previous': previous}},
+        {'$set': {
+            'canonical': {'$literal': ioc['canonical']},
+            'value': {'$ifNull': ['$value', {'$literal': ioc.get('value')}]},
+            'type': {'$ifNull': ['$type', {'$literal': ioc.get('type')}]},
+            'first_seen': {'$min': ['$first_seen', seen_at]},
+            'last_seen': {'$max': ['$last_seen', seen_at]},
+            'sightings': {'$concatArrays': [other_sightings, [{'$mergeObjects': [
+                {'$literal': entry},
+                {'first_seen': {'$min': ['$_previous.first_seen', seen_at]}}
+            ]}]]}
+        }},
+        {'$set': {'sources': '$sightings.source', 'sighting_count': {'$size': '$sightings'}}},
+        {'$unset': '_previous'}
+    ]
+
+
+def remove_source_pipeline(source):
+    """Update pipeline dropping one source's sighting from an indicator"""
+    return [
+        {'$set': {'sightings': {'$filter': {
+            'input': {'$ifNull': ['$sightings', []]},
+            'cond': {'$ne': ['$$this.source', {'$literal': source}]}
+        }}}},
+        {'$set': {
+            'sources': '$sightings.source',
+            'sighting_count': {'$size': '$sightings'},
+            'first_seen': {'$min': '$sightings.first_seen'},
+            'last_seen': {'$max': '$sightings.last_seen'}
+        }}
+    ]
+
+
+def consolidate(canonical, iocs):
+    """Indicator document for every per-feed IOC sharing a canonical value"""
+    sightings = {}
+    for ioc in sorted(iocs, key=_seen_at):
+        entry = sighting(ioc)
+        previous = sightings.get(entry['source'])
+        if previous:
+            entry['first_seen'] = min(previous['first_seen'], entry['first_seen'])
+        sightings[entry['source']] = entry
+
+    entries = list(sightings.values())
+    first = entries[0] if entries else {}
+    return {
+        '_id': canonical,
+        'canonical': canonical,
+        'value': first.get('value'),
+        'type': first.get('type'),
+        'first_seen': min((entry['first_seen'] for entry in entries), default=None),
+        'last_seen': max((entry['last_seen'] for entry in entries), default=None),
+        'sources': [entry['source'] for entry in entries],
+        'sighting_count': len(entries),
+        'sightings': entries
+    }
+
+
+def sighting_matches(indicator):
+    """Per-source match records for an indicator, as returned by bulk_lookup"""
+    return [
+        {'value': entry.get('value'), 'canonical': indicator['canonical'], 'type': entry.get('type'),
+         'source': entry.get('source'), 'confidence': entry.get('confidence'), 'timestamp': entry.get('last_seen')}
+        for entry in indicator.get('sightings', [])
+    ]
@@ -2,117 +2,892 @@
 MongoDB connection manager for CTI Dashboard
 """
 import os
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from pymongo.errors import ConnectionFailure
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne, ReplaceOne, ReturnDocument, CursorType
+from pymongo.errors import PyMongoError, BulkWriteError, CollectionInvalid
 from dotenv import load_dotenv
+from db.base import IOCStore
+from db.indicators import upsert_pipeline, remove_source_pipeline, consolidate, sighting_matches
+from db.search import search_fields, run_search, INTERNAL_FIELDS_PROJECTION
+from db.normalize import normalize_ioc, canonicalize, classify
+from db.ranges import RANGE_PROJECTION
+from db.snapshot import ioc_snapshot
+from db.pagination import KEYSET_SORT, keyset_filter, encode_cursor
+from db.pool_metrics import PoolMetrics
+from db.routing import read_routing_from_env, read_preference, MONGO_MAX_STALENESS_SECONDS
+from db.indexes import ensure_indexes, apply_migrations, applied_version, check_query_plans
+from config import get_config
 
 # Load environment variables
 load_dotenv()
 
-class MongoDBManager:
+# Connection pool settings; each worker process has its own pool
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 20))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+
+# Number of upserts sent per bulk_write round trip
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+
+# Server error code for duplicate key violations
+DUPLICATE_KEY_ERROR = 11000
+
+# Seconds a filtered count_documents result is reused
+COUNT_CACHE_SECONDS = int(os.getenv('COUNT_CACHE_SECONDS', 60))
+
+# _id of the single document holding the stats rollup
+STATS_ROLLUP_ID = 'global'
+
+# _id of the meta document holding the ingest generation counter
+GENERATION_ID = 'ingest_generation'
+
+# _id of the meta document recording that indicators cover every IOC
+INDICATORS_ID = 'indicators'
+
+# Size of the capped change-event collection tailed by /api/stream
+EVENTS_CAPPED_BYTES = int(os.getenv('EVENTS_CAPPED_BYTES', 16 * 1024 * 1024))
+
+# How long a tailable events cursor blocks on the server waiting for new events
+EVENTS_AWAIT_MS = 5000
+
+# Rollup dimensions: document field -> IOC field
+ROLLUP_DIMENSIONS = {
+    'by_type': 'type',
+    'by_source': 'source',
+    'by_threat_level': 'threat_level'
+}
+
+# Day format used for trend bucket _ids
+TREND_DATE_FORMAT = '%Y-%m-%d'
+
+def _projection(fields):
+    """Find projection for requested fields; None means every public field"""
+    if not fields:
+        return INTERNAL_FIELDS_PROJECTION
+    return {field: 1 for field in fields}
+
+def _rollup_key(value):
+    """Encode an IOC field value as a safe rollup sub-document key"""
+    if value is None:
+        return '__none__'
+    key = str(value).replace('.', '\uff0e')
+    if key.startswith('$'):
+        key = '\uff04' + key[1:]
+    return key
+
+def _rollup_value(key):
+    """Decode a rollup sub-document key back to the IOC field value"""
+    if key == '__none__':
+        return None
+    if key.startswith('\uff04'):
+        key = '$' + key[1:]
+    return key.replace('\uff0e', '.')
+
+def _rollup_to_list(counts):
+    """Convert a rollup counter map to the aggregation-style list"""
+    items = [{'_id': _rollup_value(k), 'count': v} for k, v in (counts or {}).items() if v > 0]
+    items.sort(key=lambda x: x['count'], reverse=True)
+    return items
+
+class MongoDBManager(IOCStore):
     """Manages MongoDB connection and operations"""
     
-    def __init__(self):
-        try:
-            mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-            # Add SSL parameters for MongoDB Atlas
-            self.client = MongoClient(
-                mongo_uri, 
-                serverSelectionTimeoutMS=5000,
-                tlsAllowInvalidCertificates=True,
-                retryWrites=True
-            )
-        except Exception as e:
-            print(f"Error initializing MongoDB client: {e}")
-            self.client = None
-        self.db = None
-        self.collection = None
+    backend = 'mongo'
+    
+    def __init__(self, db_name=None):
+        super().__init__()
+        # MONGO_DB_NAME from the active config unless given
+        self.db_name = db_name or get_config().MONGO_DB_NAME
+        self.pool_metrics = PoolMetrics()
+        self._client = None
+        self._collections = {}
+        self._pid = None
+        self._connected = False
+        self._client_lock = threading.Lock()
+        self._count_cache = {}
+        self._index_thread = None
+        self._indicators_ready = False
+        self.read_routing = read_routing_from_env()
+    
+    def _create_client(self):
+        """New MongoClient with the configured pool and pool instrumentation"""
+        mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+        # Add SSL parameters for MongoDB Atlas
+        return MongoClient(
+            mongo_uri,
+            serverSelectionTimeoutMS=5000,
+            tlsAllowInvalidCertificates=True,
+            retryWrites=True,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[self.pool_metrics]
+        )
+    
+    def reset_after_fork(self):
+        """
+        Drop a client inherited from the parent process.
         
+        PyMongo clients are not fork-safe, so a forked worker must never
+        use (or close) its parent's client; the next access creates one.
+        """
+        self._client = None
+        self._collections = {}
+        self._pid = None
+        self._connected = False
+        self._client_lock = threading.Lock()
+        self._count_cache = {}
+        self._index_thread = None
+        self.pool_metrics.reset()
+    
+    @property
+    def client(self):
+        """This process's MongoClient, created lazily on first use"""
+        if self._pid != os.getpid():
+            if self._pid is not None:
+                self.reset_after_fork()
+            with self._client_lock:
+                if self._client is None:
+                    client = self._create_client()
+                    db = client[self.db_name]
+                    self._collections = {
+                        'iocs': db['iocs'],
+                        'stats': db['stats'],
+                        'trend_buckets': db['trend_buckets'],
+                        'indicators': db['indicators'],
+                        'meta': db['meta'],
+                        'events': db['events'],
+                        'verdicts': db['verdicts']
+                    }
+                    self._client = client
+                    self._pid = os.getpid()
+        return self._client
+    
+    def _collection(self, name):
+        if self._pid != os.getpid():
+            self.client
+        return self._collections[name]
+    
+    def _reader(self, name, method):
+        """Collection handle using the read preference routed for a repository method"""
+        collection = self._collection(name)
+        mode = self.read_routing.get(method, 'primary')
+        if mode == 'primary':
+            return collection
+        key = (name, mode)
+        if key not in self._collections:
+            self._collections[key] = collection.with_options(read_preference=read_preference(mode))
+        return self._collections[key]
+    
+    def read_routes(self):
+        """Configured read routing: method -> mode, plus the staleness bound"""
+        return {'max_staleness_seconds': MONGO_MAX_STALENESS_SECONDS, 'methods': dict(self.read_routing)}
+    
+    @property
+    def db(self):
+        return self.client[self.db_name]
+    
+    @property
+    def collection(self):
+        return self._collection('iocs')
+    
+    @property
+    def stats_collection(self):
+        return self._collection('stats')
+    
+    @property
+    def trends_collection(self):
+        return self._collection('trend_buckets')
+    
+    @property
+    def indicators_collection(self):
+        return self._collection('indicators')
+    
     def connect(self):
         """Establish connection to MongoDB"""
         try:
             # Test connection
             self.client.admin.command('ping')
-            self.db = self.client['cti_dashboard']
-            self.collection = self.db['iocs']
             
-            # Create indexes for better performance
-            self.collection.create_index([('value', ASCENDING)])
-            self.collection.create_index([('type', ASCENDING)])
-            self.collection.create_index([('source', ASCENDING)])
-            self.collection.create_index([('timestamp', DESCENDING)])
-            self.collection.create_index([('tags', ASCENDING)])
+            # Indexes are versioned migrations; pending ones build in the background
+            self._index_thread = ensure_indexes(self.db)
+            self._ensure_events_collection()
+            
+            if not self._indicators_consolidated():
+                if self.collection.estimated_document_count():
+                    print("⚠️  No consolidated indicators yet - run `python manage.py consolidate-indicators`")
+                else:
+                    # Empty deployment: ingest keeps indicators complete from the start
+                    self._mark_indicators_consolidated()
             
+            self._connected = True
             print("✅ Connected to MongoDB successfully")
             return True
-        except ConnectionFailure as e:
+        except PyMongoError as e:
             print(f"❌ Failed to connect to MongoDB: {e}")
             return False
     
+    def is_connected(self):
+        """Whether connect() has succeeded in this process"""
+        return self._connected and self._pid == os.getpid()
+    
+    def ping(self):
+        """Round trip to the server; raises if it is unreachable"""
+        self.client.admin.command('ping')
+    
+    def _load_generation(self):
+        state = self._reader('meta', 'ingest_generation').find_one({'_id': GENERATION_ID}) or {}
+        return state.get('generation', 0), state.get('updated_at')
+    
+    def _increment_generation(self):
+        state = self._collection('meta').find_one_and_update(
+            {'_id': GENERATION_ID},
+            {'$inc': {'generation': 1}, '$currentDate': {'updated_at': True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return state['generation'], state.get('updated_at')
+    
+    def _ensure_events_collection(self):
+        """Create the capped collection backing the change feed"""
+        try:
+            self.db.create_collection('events', capped=True, size=EVENTS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass
+        except PyMongoError as e:
+            print(f"⚠️  Could not create events collection, /api/stream disabled: {e}")
+    
+    def publish_event(self, event):
+        self._collection('events').insert_one(dict(event))
+    
+    def iter_events(self, after=0, timeout=30):
+        """Tail the capped events collection; see IOCStore.iter_events"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            cursor = (self._collection('events')
+                      .find({'generation': {'$gt': after}}, {'_id': 0}, cursor_type=CursorType.TAILABLE_AWAIT)
+                      .max_await_time_ms(EVENTS_AWAIT_MS))
+            try:
+                while cursor.alive and time.monotonic() < deadline:
+                    received = False
+                    for event in cursor:
+                        received = True
+                        after = max(after, event['generation'])
+                        yield event
+                        if time.monotonic() >= deadline:
+                            break
+                    if not received:
+                        yield None
+            finally:
+                cursor.close()
+            if time.monotonic() < deadline:
+                # A tailable cursor on an empty collection dies at once; retry shortly
+                time.sleep(1)
+                yield None
+    
+    def _prepare_ioc(self, ioc, seen_at):
+        """
+        Build the dedup filter, upsert update and insert document for an IOC.
+
+        timestamp is kept from the first insert; last_seen advances every
+        time a feed lists the IOC again, and is what retention expires on.
+        """
+        if 'canonical' not in ioc:
+            normalize_ioc(ioc)
+        document = {**ioc, **search_fields(ioc['value'])}
+        document.pop('last_seen', None)
+        update = {'$setOnInsert': document, '$set': {'last_seen': seen_at}}
+        return {'canonical': ioc['canonical'], 'source': ioc['source']}, update, {**document, 'last_seen': seen_at}
+    
     def insert_ioc(self, ioc_data):
         """Insert a single IOC"""
         try:
-            # Check if IOC already exists
-            existing = self.collection.find_one({'value': ioc_data['value'], 'source': ioc_data['source']})
-            if not existing:
-                self.collection.insert_one(ioc_data)
-                return True
-            return False
+            # Upsert on (canonical, source) so dedup costs a single round trip
+            filter_query, update, document = self._prepare_ioc(ioc_data, datetime.utcnow())
+            result = self.collection.update_one(filter_query, update, upsert=True)
+            created = self._record_sightings([ioc_data])
+            generation = self._next_generation()
+            if result.upserted_id is None:
+                self._publish_change(generation, [], created, reason='sightings')
+                return False
+            self._record_counts([ioc_data])
+            self._publish_change(generation, [document], created)
+            return True
         except Exception as e:
             print(f"Error inserting IOC: {e}")
             return False
     
-    def insert_many_iocs(self, ioc_list):
-        """Insert multiple IOCs"""
-        if not ioc_list:
+    def bulk_upsert_iocs(self, ioc_list, batch_size=None):
+        """
+        Insert IOCs in chunked, unordered bulk upserts keyed on (canonical, source).
+        
+        Returns a summary with overall inserted/matched/failed counts and a
+        per-batch breakdown. Existing IOCs are matched; only their last_seen
+        is updated.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        summary = {'inserted': 0, 'matched': 0, 'failed': 0, 'batches': []}
+        inserted = []
+        created = 0
+        seen_at = datetime.utcnow()
+        
+        for start in range(0, len(ioc_list), batch_size):
+            batch = ioc_list[start:start + batch_size]
+            counts = {'inserted': 0, 'matched': 0, 'failed': 0}
+            
+            operations = []
+            pending = []
+            for ioc in batch:
+                if not ioc.get('value') or not ioc.get('source'):
+                    counts['failed'] += 1
+                    continue
+                filter_query, update, _ = self._prepare_ioc(ioc, seen_at)
+                operations.append(UpdateOne(filter_query, update, upsert=True))
+                pending.append(ioc)
+            
+            if operations:
+                upserted_indexes = []
+                failed_indexes = set()
+                try:
+                    result = self.collection.bulk_write(operations, ordered=False)
+                    counts['inserted'] += result.upserted_count
+                    counts['matched'] += result.matched_count
+                    upserted_indexes = list(result.upserted_ids.keys())
+                except BulkWriteError as e:
+                    details = e.details
+                    counts['inserted'] += details.get('nUpserted', 0)
+                    counts['matched'] += details.get('nMatched', 0)
+                    upserted_indexes = [u['index'] for u in details.get('upserted', [])]
+                    for error in details.get('writeErrors', []):
+                        # A concurrent upsert already created the IOC
+                        if error.get('code') == DUPLICATE_KEY_ERROR:
+                            counts['matched'] += 1
+                        else:
+                            counts['failed'] += 1
+                            failed_indexes.add(error['index'])
+                except Exception as e:
+                    print(f"Error in bulk upsert batch: {e}")
+                    counts['failed'] += len(operations)
+                    failed_indexes = set(range(len(pending)))
+                
+                if upserted_indexes:
+                    self._record_counts([pending[i] for i in upserted_indexes])
+                    inserted.extend(pending[i] for i in upserted_indexes)
+                # Sightings only for IOCs now in iocs; re-listed ones still advance last_seen
+                created += self._record_sightings(
+                    [ioc for i, ioc in enumerate(pending) if i not in failed_indexes]
+                )
+            
+            summary['batches'].append(counts)
+            for key, value in counts.items():
+                summary[key] += value
+        
+        # Re-listed IOCs change sightings too, so any successful write starts a new generation
+        if summary['inserted'] or summary['matched']:
+            self._publish_change(self._next_generation(), inserted, created, reason='sightings')
+        return summary
+    
+    def _record_sightings(self, iocs):
+        """
+        Merge feed IOCs into their consolidated indicators in one bulk round
+        trip; returns the number of indicators created.
+        """
+        operations = [UpdateOne({'_id': ioc['canonical']}, upsert_pipeline(ioc), upsert=True) for ioc in iocs]
+        if not operations:
             return 0
+        try:
+            return self.indicators_collection.bulk_write(operations, ordered=False).upserted_count
+        except BulkWriteError as e:
+            created = e.details.get('nUpserted', 0)
+            # Two sources of one new indicator in the same batch race on the upsert
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != DUPLICATE_KEY_ERROR:
+                    print(f"Error updating indicator: {error.get('errmsg')}")
+                    continue
+                operation = operations[error['index']]
+                try:
+                    created += self.indicators_collection.bulk_write([operation]).upserted_count
+                except Exception as retry_error:
+                    print(f"Error updating indicator: {retry_error}")
+            return created
+        except Exception as e:
+            print(f"Error updating indicators: {e}")
+            return 0
+    
+    def _record_counts(self, iocs, sign=1):
+        """Atomically add (sign=1) or remove (sign=-1) IOCs in the stats rollup and trend buckets"""
+        now = datetime.utcnow()
+        increments = {'total': sign * len(iocs)}
+        bucket_increments = {}
+        for ioc in iocs:
+            for dimension, field in ROLLUP_DIMENSIONS.items():
+                if field == 'threat_level' and 'threat_level' not in ioc:
+                    continue
+                path = f"{dimension}.{_rollup_key(ioc.get(field))}"
+                increments[path] = increments.get(path, 0) + sign
+            
+            timestamp = ioc.get('timestamp')
+            day = (timestamp if isinstance(timestamp, datetime) else now).strftime(TREND_DATE_FORMAT)
+            bucket = bucket_increments.setdefault(day, {'total': 0})
+            bucket['total'] += sign
+            path = f"counts.{_rollup_key(ioc.get('type'))}.{_rollup_key(ioc.get('source'))}"
+            bucket[path] = bucket.get(path, 0) + sign
+        
+        # Drift in either structure is corrected by reconcile_stats / rebuild_trend_buckets
+        try:
+            self.stats_collection.update_one(
+                {'_id': STATS_ROLLUP_ID},
+                {'$inc': increments, '$set': {'updated_at': now}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error updating stats rollup: {e}")
         
-        inserted = 0
-        for ioc in ioc_list:
-            if self.insert_ioc(ioc):
-                inserted += 1
-        return inserted
+        try:
+            self.trends_collection.bulk_write([
+                UpdateOne({'_id': day}, {'$inc': bucket}, upsert=True)
+                for day, bucket in bucket_increments.items()
+            ], ordered=False)
+        except Exception as e:
+            print(f"Error updating trend buckets: {e}")
     
-    def get_all_iocs(self, limit=100):
+    def reconcile_stats(self):
+        """
+        Rebuild the stats rollup from the iocs collection.
+        
+        Runs the full aggregations, so it is meant for the periodic
+        reconciliation job rather than the request path.
+        """
+        try:
+            rollup = {
+                '_id': STATS_ROLLUP_ID,
+                'total': self.collection.count_documents({})
+            }
+            for dimension, field in ROLLUP_DIMENSIONS.items():
+                pipeline = []
+                if field == 'threat_level':
+                    pipeline.append({'$match': {'threat_level': {'$exists': True}}})
+                pipeline.append({'$group': {'_id': f'${field}', 'count': {'$sum': 1}}})
+                rollup[dimension] = {
+                    _rollup_key(item['_id']): item['count']
+                    for item in self.collection.aggregate(pipeline)
+                }
+            
+            now = datetime.utcnow()
+            rollup['updated_at'] = now
+            rollup['reconciled_at'] = now
+            self.stats_collection.replace_one({'_id': STATS_ROLLUP_ID}, rollup, upsert=True)
+            self.bump_generation('stats')
+            return rollup
+        except Exception as e:
+            print(f"Error reconciling stats: {e}")
+            return None
+    
+    def _get_stats_rollup(self, method='count_iocs'):
+        """Read the stats rollup, routed for the calling method; built on first use"""
+        rollup = self._reader('stats', method).find_one({'_id': STATS_ROLLUP_ID})
+        if rollup is None:
+            rollup = self.reconcile_stats()
+        return rollup or {}
+    
+    def get_all_iocs(self, limit=100, fields=None):
         """Retrieve all IOCs with limit"""
         try:
-            return list(self.collection.find().sort('timestamp', DESCENDING).limit(limit))
+            collection = self._reader('iocs', 'get_all_iocs')
+            return list(collection.find({}, _projection(fields)).sort('timestamp', DESCENDING).limit(limit))
         except Exception as e:
             print(f"Error retrieving IOCs: {e}")
             return []
     
-    def search_iocs(self, query):
-        """Search IOCs by value"""
+    def get_iocs_page(self, filter_query=None, limit=100, cursor=None, skip=0, fields=None):
+        """
+        Get one page of IOCs ordered by (timestamp, _id) descending.
+        
+        With a cursor (from a previous page's next_cursor) the page is a
+        keyset range scan; skip is only honoured without a cursor. fields
+        limits the returned fields (_id is always included). Returns
+        (iocs, next_cursor), where next_cursor is None on the last page.
+        Raises ValueError for a malformed cursor.
+        """
+        # limit(0) would mean "no limit" to MongoDB
+        limit = max(1, limit)
+        query = dict(filter_query or {})
+        if cursor:
+            query = {'$and': [query, keyset_filter(cursor)]}
+        
+        # The cursor is built from timestamp, so fetch it even if not requested
+        strip_timestamp = bool(fields) and 'timestamp' not in fields
+        projection = _projection(list(fields) + ['timestamp'] if strip_timestamp else fields)
+        find = self._reader('iocs', 'get_iocs_page').find(query, projection).sort(KEYSET_SORT)
+        if skip > 0 and not cursor:
+            find = find.skip(skip)
+        iocs = list(find.limit(limit + 1))
+        
+        next_cursor = None
+        if len(iocs) > limit:
+            iocs = iocs[:limit]
+            next_cursor = encode_cursor(iocs[-1])
+        if strip_timestamp:
+            for ioc in iocs:
+                ioc.pop('timestamp', None)
+        return iocs, next_cursor
+    
+    def iter_iocs(self, filter_query=None, limit=0, fields=None):
+        """
+        Lazily iterate IOCs, newest first, for streaming consumers.
+        
+        fields limits the returned fields; documents are fetched from the
+        server in INGEST_BATCH_SIZE batches as the caller consumes them.
+        """
+        cursor = (self._reader('iocs', 'iter_iocs').find(filter_query or {}, _projection(fields))
+                  .sort(KEYSET_SORT)
+                  .batch_size(INGEST_BATCH_SIZE))
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+    
+    def count_iocs(self, filter_query=None):
+        """
+        Count IOCs matching a type/source filter without scanning per request.
+        
+        Unfiltered and single-field counts come from the stats rollup;
+        other filters use count_documents cached for COUNT_CACHE_SECONDS.
+        """
+        filter_query = filter_query or {}
+        try:
+            if not filter_query:
+                return self._get_stats_rollup().get('total', 0)
+            if len(filter_query) == 1:
+                field, value = next(iter(filter_query.items()))
+                dimension = {'type': 'by_type', 'source': 'by_source'}.get(field)
+                if dimension and isinstance(value, str):
+                    return self._get_stats_rollup().get(dimension, {}).get(_rollup_key(value), 0)
+            
+            key = repr(sorted(filter_query.items()))
+            cached = self._count_cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            count = self._reader('iocs', 'count_iocs').count_documents(filter_query)
+            self._count_cache[key] = (time.monotonic() + COUNT_CACHE_SECONDS, count)
+            return count
+        except Exception as e:
+            print(f"Error counting IOCs: {e}")
+            return 0
+    
+    def pool_stats(self):
+        """Connection pool settings and this worker's pool counters"""
+        return {
+            'max_pool_size': MONGO_MAX_POOL_SIZE,
+            'min_pool_size': MONGO_MIN_POOL_SIZE,
+            'max_idle_time_ms': MONGO_MAX_IDLE_TIME_MS,
+            'wait_queue_timeout_ms': MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            'read_routing': self.read_routes(),
+            **self.pool_metrics.snapshot()
+        }
+    
+    def distinct_values(self, field):
+        """Distinct values of an IOC field"""
+        return self._reader('iocs', 'distinct_values').distinct(field)
+    
+    def search_iocs(self, query, limit=50, fields=None):
+        """Search IOCs by value using the indexed search planner"""
         try:
-            regex_query = {'value': {'$regex': query, '$options': 'i'}}
-            return list(self.collection.find(regex_query).limit(50))
+            results = run_search(self._reader('iocs', 'search_iocs'), query, limit=limit, projection=_projection(fields))
+            if classify(query) == 'ip':
+                # Include listed netblocks containing the IP
+                seen_ids = {doc['_id'] for doc in results}
+                for doc in self.find_ip_ranges(query):
+                    if doc['_id'] not in seen_ids:
+                        if fields:
+                            doc = {key: value for key, value in doc.items() if key == '_id' or key in fields}
+                        results.append(doc)
+            return results
         except Exception as e:
             print(f"Error searching IOCs: {e}")
             return []
     
+    def _load_ip_ranges(self, last_id):
+        """ip_range IOCs added after last_id, in _id order"""
+        filter_query = {'type': 'ip_range'}
+        if last_id is not None:
+            filter_query['_id'] = {'$gt': last_id}
+        return self.collection.find(filter_query, RANGE_PROJECTION).sort('_id', ASCENDING)
+    
+    def backfill_search_fields(self, batch_size=None):
+        """
+        Populate search_key/search_grams on IOCs ingested before they existed.
+        
+        Returns the number of IOCs updated, or None on failure.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        updated = 0
+        try:
+            cursor = self.collection.find({'search_key': {'$exists': False}}, {'value': 1})
+            operations = []
+            for doc in cursor:
+                operations.append(UpdateOne({'_id': doc['_id']}, {'$set': search_fields(doc.get('value'))}))
+                if len(operations) >= batch_size:
+                    updated += self.collection.bulk_write(operations, ordered=False).modified_count
+                    operations = []
+            if operations:
+                updated += self.collection.bulk_write(operations, ordered=False).modified_count
+            return updated
+        except Exception as e:
+            print(f"Error backfilling search fields: {e}")
+            return None
+    
+    def find_indicator(self, value, ioc_type=None):
+        """
+        Consolidated indicator for value: one document with a sighting per source.
+        
+        Falls back to the published snapshot while MongoDB is unreachable;
+        those sightings carry only the source name.
+        """
+        canonical = canonicalize(value, ioc_type)
+        try:
+            return self._reader('indicators', 'find_indicator').find_one({'_id': canonical})
+        except Exception as e:
+            print(f"Error looking up indicator, using snapshot: {e}")
+            return self._snapshot_indicator(canonical, ioc_snapshot.lookup(canonical))
+    
+    def get_verdict(self, key):
+        """Cached verdict; expired documents may linger until the TTL monitor runs"""
+        try:
+            return self._collection('verdicts').find_one(
+                {'_id': key, 'expires_at': {'$gt': datetime.utcnow()}}, {'_id': 0}
+            )
+        except Exception as e:
+            print(f"Error reading cached verdict: {e}")
+            return None
+    
+    def save_verdict(self, key, verdict, expires_at):
+        try:
+            self._collection('verdicts').replace_one(
+                {'_id': key},
+                {'verdict': verdict, 'cached_at': datetime.utcnow(), 'expires_at': expires_at},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error caching verdict: {e}")
+    
+    def bulk_lookup(self, canonicals, batch_size=None):
+        """
+        Resolve many canonical keys with batched $in queries on indicators.
+        
+        Returns a dict of canonical -> one match per source listing it.
+        Falls back to the published snapshot while MongoDB is unreachable.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        canonicals = list(dict.fromkeys(canonicals))
+        matches = {canonical: [] for canonical in canonicals}
+        try:
+            for start in range(0, len(canonicals), batch_size):
+                batch = canonicals[start:start + batch_size]
+                for indicator in self._reader('indicators', 'bulk_lookup').find({'_id': {'$in': batch}}):
+                    matches[indicator['_id']] = sighting_matches(indicator)
+        except Exception as e:
+            print(f"Error in bulk lookup, using snapshot: {e}")
+            for canonical, sources in ioc_snapshot.lookup_many(canonicals).items():
+                matches[canonical] = self._snapshot_documents(canonical, sources)
+        return matches
+    
+    def iter_canonical_sources(self):
+        """Yield (canonical, source) for every IOC"""
+        cursor = self.collection.find({}, {'canonical': 1, 'value': 1, 'type': 1, 'source': 1, '_id': 0})
+        for doc in cursor.batch_size(INGEST_BATCH_SIZE):
+            yield doc.get('canonical') or canonicalize(doc.get('value'), doc.get('type')), doc.get('source')
+    
+    def backfill_canonical(self, batch_size=None):
+        """
+        Populate the canonical field on IOCs ingested before it existed.
+        
+        Returns (updated, duplicates); duplicates are IOCs whose canonical
+        form collides with another IOC from the same source and are left
+        untouched. Returns None on failure.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        counts = {'updated': 0, 'duplicates': 0}
+        
+        def flush(operations):
+            try:
+                counts['updated'] += self.collection.bulk_write(operations, ordered=False).modified_count
+            except BulkWriteError as e:
+                counts['updated'] += e.details.get('nModified', 0)
+                for error in e.details.get('writeErrors', []):
+                    if error.get('code') != DUPLICATE_KEY_ERROR:
+                        raise
+                    counts['duplicates'] += 1
+        
+        try:
+            cursor = self.collection.find({'canonical': {'$exists': False}}, {'value': 1, 'type': 1})
+            operations = []
+            for doc in cursor:
+                canonical = canonicalize(doc.get('value'), doc.get('type'))
+                operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'canonical': canonical}}))
+                if len(operations) >= batch_size:
+                    flush(operations)
+                    operations = []
+            if operations:
+                flush(operations)
+            return counts['updated'], counts['duplicates']
+        except Exception as e:
+            print(f"Error backfilling canonical values: {e}")
+            return None
+    
+    def iter_expired(self, filter_query, before, limit=0):
+        """
+        IOCs matching filter_query that no feed has listed since before.
+
+        IOCs ingested before last_seen was tracked fall back to their
+        timestamp until a feed lists them again.
+        """
+        query = {**(filter_query or {}), '$or': [
+            {'last_seen': {'$lt': before}},
+            {'last_seen': None, 'timestamp': {'$lt': before}}
+        ]}
+        cursor = self.collection.find(query, INTERNAL_FIELDS_PROJECTION).batch_size(INGEST_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+    
+    def delete_iocs(self, iocs, batch_size=None):
+        """
+        Delete IOC documents by _id and take them out of the stats rollup.
+        
+        Returns the number of IOCs deleted. If some were already gone the
+        rollup over-decrements until the next reconcile_stats.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        deleted = 0
+        removed = []
+        retired = 0
+        for start in range(0, len(iocs), batch_size):
+            batch = iocs[start:start + batch_size]
+            try:
+                result = self.collection.delete_many({'_id': {'$in': [ioc['_id'] for ioc in batch]}})
+            except Exception as e:
+                print(f"Error deleting IOCs: {e}")
+                continue
+            deleted += result.deleted_count
+            if result.deleted_count:
+                self._record_counts(batch, sign=-1)
+                retired += self._remove_sightings(batch)
+                removed.extend(batch)
+        self._count_cache.clear()
+        if deleted:
+            self._publish_change(self._next_generation(), removed, retired, sign=-1)
+        return deleted
+    
+    def _remove_sightings(self, iocs):
+        """Drop deleted IOCs' sightings, and indicators left with none; returns indicators removed"""
+        try:
+            self.indicators_collection.bulk_write([
+                UpdateOne({'_id': ioc['canonical']}, remove_source_pipeline(ioc.get('source')))
+                for ioc in iocs if ioc.get('canonical')
+            ], ordered=False)
+            return self.indicators_collection.delete_many({
+                '_id': {'$in': [ioc['canonical'] for ioc in iocs if ioc.get('canonical')]},
+                'sighting_count': 0
+            }).deleted_count
+        except Exception as e:
+            print(f"Error removing indicator sightings: {e}")
+            return 0
+    
+    def consolidate_indicators(self, batch_size=None):
+        """
+        Rebuild the indicators collection from the per-feed iocs collection.
+        
+        Walks iocs in canonical order through the (canonical, source) index
+        and replaces each indicator wholesale. Returns (indicators, skipped)
+        where skipped counts IOCs without a canonical value (run
+        backfill-canonical first), or None on failure.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        counts = {'indicators': 0, 'skipped': 0}
+        operations = []
+        
+        def add(canonical, group):
+            operations.append(ReplaceOne({'_id': canonical}, consolidate(canonical, group), upsert=True))
+            counts['indicators'] += 1
+            if len(operations) >= batch_size:
+                self.indicators_collection.bulk_write(operations, ordered=False)
+                operations.clear()
+        
+        try:
+            counts['skipped'] = self.collection.count_documents({'canonical': {'$exists': False}})
+            cursor = (self.collection.find({'canonical': {'$exists': True}}, INTERNAL_FIELDS_PROJECTION)
+                      .sort([('canonical', ASCENDING), ('source', ASCENDING)])
+                      .batch_size(INGEST_BATCH_SIZE))
+            canonical, group = None, []
+            for doc in cursor:
+                if doc['canonical'] != canonical and group:
+                    add(canonical, group)
+                    group = []
+                canonical = doc['canonical']
+                group.append(doc)
+            if group:
+                add(canonical, group)
+            if operations:
+                self.indicators_collection.bulk_write(operations, ordered=False)
+            self._mark_indicators_consolidated()
+            return counts['indicators'], counts['skipped']
+        except Exception as e:
+            print(f"Error consolidating indicators: {e}")
+            return None
+    
+    def _indicators_consolidated(self):
+        """Whether indicators cover every IOC (consolidate-indicators has run, or ingest built them all)"""
+        if not self._indicators_ready:
+            self._indicators_ready = self._collection('meta').find_one({'_id': INDICATORS_ID}) is not None
+        return self._indicators_ready
+    
+    def _mark_indicators_consolidated(self):
+        self._collection('meta').update_one(
+            {'_id': INDICATORS_ID}, {'$currentDate': {'consolidated_at': True}}, upsert=True
+        )
+        self._indicators_ready = True
+    
+    def migrate_indexes(self):
+        """Apply pending index migrations now, in the foreground, retrying failed ones"""
+        try:
+            # Let a build started by connect() finish rather than contend for the lease
+            if self._index_thread is not None:
+                self._index_thread.join()
+            return apply_migrations(self.db, retry_failed=True)
+        except PyMongoError as e:
+            print(f"Error migrating indexes: {e}")
+            return applied_version(self.db), [str(e)]
+    
+    def check_query_plans(self):
+        """Explain every hot query; see db.indexes.QUERY_PROBES"""
+        return check_query_plans(self.db)
+    
     def get_stats(self):
-        """Get statistics about IOCs"""
+        """
+        Get statistics about IOCs.
+
+        total counts consolidated indicators. On a deployment that predates
+        them, indicators only cover IOCs ingested since the upgrade until
+        consolidate-indicators has run, so until then total falls back to
+        the listing count instead of a partial (or zero) indicator count.
+        """
         try:
-            total_count = self.collection.count_documents({})
-            
-            # Count by type
-            type_pipeline = [
-                {'$group': {'_id': '$type', 'count': {'$sum': 1}}},
-                {'$sort': {'count': -1}}
-            ]
-            by_type = list(self.collection.aggregate(type_pipeline))
-            
-            # Count by source
-            source_pipeline = [
-                {'$group': {'_id': '$source', 'count': {'$sum': 1}}},
-                {'$sort': {'count': -1}}
-            ]
-            by_source = list(self.collection.aggregate(source_pipeline))
-            
+            rollup = self._get_stats_rollup('get_stats')
+            listings = rollup.get('total', 0)
+            if self._indicators_consolidated():
+                indicators = self._reader('indicators', 'get_stats').estimated_document_count()
+            else:
+                indicators = listings
             return {
-                'total': total_count,
-                'by_type': by_type,
-                'by_source': by_source
+                'total': indicators,
+                'unique_indicators': indicators,
+                'listings': listings,
+                'by_type': _rollup_to_list(rollup.get('by_type')),
+                'by_source': _rollup_to_list(rollup.get('by_source'))
             }
         except Exception as e:
             print(f"Error getting stats: {e}")
@@ -126,6 +901,8 @@ class MongoDBManager:
                 {'_id': ObjectId(ioc_id)},
                 {'$addToSet': {'tags': tag}}
             )
+            if result.modified_count:
+                self.bump_generation('tags')
             return result.modified_count > 0
         except Exception as e:
             print(f"Error adding tag: {e}")
@@ -139,15 +916,17 @@ class MongoDBManager:
                 {'_id': ObjectId(ioc_id)},
                 {'$pull': {'tags': tag}}
             )
+            if result.modified_count:
+                self.bump_generation('tags')
             return result.modified_count > 0
         except Exception as e:
             print(f"Error removing tag: {e}")
             return False
     
-    def get_iocs_by_tag(self, tag):
+    def get_iocs_by_tag(self, tag, fields=None):
         """Get all IOCs with a specific tag"""
         try:
-            return list(self.collection.find({'tags': tag}).sort('timestamp', DESCENDING))
+            return list(self._reader('iocs', 'get_iocs_by_tag').find({'tags': tag}, _projection(fields)).sort('timestamp', DESCENDING))
         except Exception as e:
             print(f"Error getting IOCs by tag: {e}")
             return []
@@ -155,58 +934,74 @@ class MongoDBManager:
     def get_trends(self, days=7):
         """Get IOC trends over time"""
         try:
-            from datetime import datetime, timedelta
+            start_day = (datetime.utcnow() - timedelta(days=days)).strftime(TREND_DATE_FORMAT)
+            buckets = self._reader('trend_buckets', 'get_trends').find({'_id': {'$gte': start_day}}).sort('_id', ASCENDING)
             
-            start_date = datetime.utcnow() - timedelta(days=days)
+            # Format results for charting, summing each type across sources
+            trends = {}
+            for bucket in buckets:
+                trends[bucket['_id']] = {
+                    _rollup_value(ioc_type): sum(by_source.values())
+                    for ioc_type, by_source in bucket.get('counts', {}).items()
+                }
             
+            return trends
+        except Exception as e:
+            print(f"Error getting trends: {e}")
+            return {}
+    
+    def rebuild_trend_buckets(self):
+        """
+        Rebuild the per-day trend buckets from the iocs collection.
+        
+        Returns the number of day buckets written, or None on failure.
+        """
+        try:
             pipeline = [
-                {'$match': {'timestamp': {'$gte': start_date}}},
+                {'$match': {'timestamp': {'$type': 'date'}}},
                 {'$group': {
                     '_id': {
-                        'date': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
-                        'type': '$type'
+                        'date': {'$dateToString': {'format': TREND_DATE_FORMAT, 'date': '$timestamp'}},
+                        'type': '$type',
+                        'source': '$source'
                     },
                     'count': {'$sum': 1}
-                }},
-                {'$sort': {'_id.date': 1}}
+                }}
             ]
             
-            results = list(self.collection.aggregate(pipeline))
+            buckets = {}
+            for item in self.collection.aggregate(pipeline, allowDiskUse=True):
+                day = item['_id']['date']
+                bucket = buckets.setdefault(day, {'_id': day, 'total': 0, 'counts': {}})
+                by_source = bucket['counts'].setdefault(_rollup_key(item['_id'].get('type')), {})
+                by_source[_rollup_key(item['_id'].get('source'))] = item['count']
+                bucket['total'] += item['count']
             
-            # Format results for charting
-            trends = {}
-            for item in results:
-                date = item['_id']['date']
-                ioc_type = item['_id']['type']
-                count = item['count']
-                
-                if date not in trends:
-                    trends[date] = {}
-                trends[date][ioc_type] = count
-            
-            return trends
+            if buckets:
+                self.trends_collection.bulk_write([
+                    ReplaceOne({'_id': day}, bucket, upsert=True)
+                    for day, bucket in buckets.items()
+                ], ordered=False)
+            self.trends_collection.delete_many({'_id': {'$nin': list(buckets)}})
+            self.bump_generation('trends')
+            return len(buckets)
         except Exception as e:
-            print(f"Error getting trends: {e}")
-            return {}
+            print(f"Error rebuilding trend buckets: {e}")
+            return None
     
     def get_threat_level_stats(self):
         """Get statistics by threat level"""
         try:
-            pipeline = [
-                {'$match': {'threat_level': {'$exists': True}}},
-                {'$group': {'_id': '$threat_level', 'count': {'$sum': 1}}},
-                {'$sort': {'count': -1}}
-            ]
-            return list(self.collection.aggregate(pipeline))
+            return _rollup_to_list(self._get_stats_rollup('get_threat_level_stats').get('by_threat_level'))
         except Exception as e:
             print(f"Error getting threat level stats: {e}")
             return []
     
     def close(self):
         """Close MongoDB connection"""
-        if self.client:
-            self.client.close()
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+            self._client = None
+            self._pid = None
+            self._connected = False
             print("✅ MongoDB connection closed")
-
-# Singleton instance
-db_manager = MongoDBManager()
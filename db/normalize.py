@@ -0,0 +1,170 @@
+"""
+Canonical IOC normalization for CTI Dashboard
+
+Feeds deliver the same indicator in different shapes (case, defanging,
+trailing slashes, IPv6 spellings). canonicalize() maps every variant to a
+single canonical string which is stored in the `canonical` field and used
+for dedup and exact lookups.
+"""
+import ipaddress
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+# Defanging conventions used by feeds and analysts
+REFANG_REPLACEMENTS = [
+    (re.compile(r'^hxxp', re.IGNORECASE), 'http'),
+    (re.compile(r'^fxp', re.IGNORECASE), 'ftp'),
+    (re.compile(r'\[:\]|\(:\)'), ':'),
+    (re.compile(r'\[/\]'), '/'),
+    (re.compile(r'\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\)', re.IGNORECASE), '.'),
+    (re.compile(r'\[@\]|\[at\]', re.IGNORECASE), '@'),
+]
+
+HASH_PATTERN = re.compile(r'^(?:[a-fA-F0-9]{32}|[a-fA-F0-9]{40}|[a-fA-F0-9]{64}|[a-fA-F0-9]{128})$')
+DOMAIN_PATTERN = re.compile(r'^([a-zA-Z0-9_]([a-zA-Z0-9\-_]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}\.?$')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Feed-specific type names mapped to normalization families
+TYPE_FAMILIES = {
+    'ip': 'ip', 'ipv4': 'ip', 'ipv6': 'ip', 'ip_address': 'ip',
+    'ip:port': 'ip_port',
+    'ip_range': 'cidr', 'cidr': 'cidr',
+    'url': 'url', 'uri': 'url',
+    'domain': 'domain', 'hostname': 'domain',
+    'hash': 'hash', 'md5': 'hash', 'sha1': 'hash', 'sha256': 'hash',
+    'md5_hash': 'hash', 'sha1_hash': 'hash', 'sha256_hash': 'hash',
+    'filehash-md5': 'hash', 'filehash-sha1': 'hash', 'filehash-sha256': 'hash',
+    'email': 'email',
+}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+def refang(value):
+    """Undo common defanging such as hxxp:// and example[.]com"""
+    value = str(value or '').strip()
+    for pattern, replacement in REFANG_REPLACEMENTS:
+        value = pattern.sub(replacement, value)
+    return value
+
+
+def _parse_ip(value):
+    """Parse an IPv4/IPv6 address, returning None if it is not one"""
+    try:
+        return ipaddress.ip_address(value.strip('[]'))
+    except ValueError:
+        return None
+
+
+def classify(value):
+    """
+    Detect the IOC family of a raw value.
+
+    Returns one of 'ip', 'cidr', 'url', 'hash', 'domain', 'email' or None.
+    """
+    value = refang(value)
+    if not value:
+        return None
+    if _parse_ip(value):
+        return 'ip'
+    if '/' in value and '://' not in value:
+        try:
+            ipaddress.ip_network(value, strict=False)
+            return 'cidr'
+        except ValueError:
+            pass
+    if re.match(r'^[a-zA-Z][a-zA-Z0-9+.\-]*://', value):
+        return 'url'
+    if HASH_PATTERN.match(value):
+        return 'hash'
+    if DOMAIN_PATTERN.match(value):
+        return 'domain'
+    if EMAIL_PATTERN.match(value):
+        return 'email'
+    return None
+
+
+def _canonical_host(host):
+    """Lowercase a hostname, dropping the trailing dot and encoding IDNs"""
+    host = host.strip().rstrip('.').lower()
+    ip = _parse_ip(host)
+    if ip:
+        return ip.compressed
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+def _canonical_ip_port(value):
+    """Canonicalize ip:port, including the bracketed IPv6 form"""
+    host, _, port = value.rpartition(':')
+    ip = _parse_ip(host)
+    if not ip or not port.isdigit():
+        return value.lower()
+    if ip.version == 6:
+        return f"[{ip.compressed}]:{int(port)}"
+    return f"{ip.compressed}:{int(port)}"
+
+
+def _canonical_url(value):
+    """Canonicalize scheme, host, default port and trailing slash of a URL"""
+    if '://' not in value:
+        value = f"http://{value}"
+    try:
+        parts = urlsplit(value)
+        scheme = parts.scheme.lower()
+        host = _canonical_host(parts.hostname or '')
+        port = parts.port
+    except ValueError:
+        return value.lower()
+
+    if ':' in host:
+        host = f"[{host}]"
+    netloc = host
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    if parts.username:
+        credentials = parts.username + (f":{parts.password}" if parts.password else '')
+        netloc = f"{credentials}@{netloc}"
+
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def canonicalize(value, ioc_type=None):
+    """
+    Map a raw IOC value to its canonical form.
+
+    ioc_type is the feed-provided type; when it is missing or unknown the
+    family is detected from the value itself.
+    """
+    value = refang(value)
+    if not value:
+        return ''
+
+    family = TYPE_FAMILIES.get(str(ioc_type or '').lower()) or classify(value)
+
+    if family == 'ip':
+        ip = _parse_ip(value)
+        return ip.compressed if ip else value.lower()
+    if family == 'ip_port':
+        return _canonical_ip_port(value)
+    if family == 'cidr':
+        try:
+            return ipaddress.ip_network(value, strict=False).compressed
+        except ValueError:
+            return value.lower()
+    if family == 'url':
+        return _canonical_url(value)
+    if family == 'domain':
+        return _canonical_host(value)
+    if family in ('hash', 'email'):
+        return value.lower()
+    return value
+
+
+def normalize_ioc(ioc):
+    """Set the canonical field on an IOC document and return it"""
+    ioc['canonical'] = canonicalize(ioc.get('value'), ioc.get('type'))
+    return ioc
@@ -0,0 +1,56 @@
+"""
+Keyset (cursor) pagination for CTI Dashboard
+
+IOC listings are ordered by (timestamp desc, _id desc). A cursor encodes
+the sort key of the last IOC on a page, so the next page is an index
+range scan that costs the same no matter how deep the client has paged.
+"""
+import base64
+import json
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import DESCENDING
+
+KEYSET_SORT = [('timestamp', DESCENDING), ('_id', DESCENDING)]
+
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just past doc in KEYSET_SORT order"""
+    timestamp = doc.get('timestamp')
+    payload = {
+        't': timestamp.isoformat() if isinstance(timestamp, datetime) else None,
+        'i': str(doc['_id'])
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor into (timestamp, _id string); raises ValueError if malformed.
+
+    The _id is left as a string for the storage backend to convert.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = datetime.fromisoformat(payload['t']) if payload.get('t') else None
+        return timestamp, str(payload['i'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def keyset_filter(token):
+    """MongoDB filter selecting the IOCs that come after the cursor"""
+    timestamp, last_id = decode_cursor(token)
+    try:
+        last_id = ObjectId(last_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if timestamp is None:
+        # IOCs without a timestamp sort last, ordered by _id
+        return {'timestamp': None, '_id': {'$lt': last_id}}
+    return {'$or': [
+        {'timestamp': {'$lt': timestamp}},
+        {'timestamp': timestamp, '_id': {'$lt': last_id}},
+        {'timestamp': None}
+    ]}
@@ -0,0 +1,98 @@
+"""
+MongoDB connection pool instrumentation for CTI Dashboard
+
+PoolMetrics is registered as a PyMongo ConnectionPoolListener and keeps
+per-process counters: connections open and checked out, checkout wait
+times and checkout failures by reason. Each gunicorn worker has its own
+client and pool, so the numbers describe the worker serving the request;
+multiply by the worker count when sizing against Atlas connection limits.
+"""
+import os
+import threading
+import time
+from pymongo import monitoring
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Thread-safe connection pool counters for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Zero every counter (used after a fork, when the pool is new)"""
+        with self._lock:
+            self.pid = os.getpid()
+            self.pools_cleared = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = {}
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+
+    def snapshot(self):
+        """Current counters as a JSON-friendly dict"""
+        with self._lock:
+            return {
+                'pid': self.pid,
+                'connections_open': self.connections_created - self.connections_closed,
+                'connections_created': self.connections_created,
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': dict(self.checkout_failures),
+                'wait_ms_avg': round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_ms_max': round(self.wait_ms_max, 3),
+                'pools_cleared': self.pools_cleared
+            }
+
+    # Checkout started/finished events arrive on the requesting thread
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = (time.perf_counter() - getattr(self._local, 'started', time.perf_counter())) * 1000
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
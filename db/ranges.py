@@ -0,0 +1,148 @@
+"""
+In-memory CIDR range index for CTI Dashboard
+
+Spamhaus DROP and other feeds publish netblocks as `ip_range` IOCs.
+RangeIndex keeps them as sorted integer intervals (one set per address
+family) so "is this IP inside a listed netblock" is a binary search
+instead of a collection scan.
+"""
+import bisect
+import ipaddress
+import threading
+import time
+
+# Minimum seconds between incremental refreshes from the database
+RANGE_REFRESH_SECONDS = 60
+
+# Full rebuilds pick up deletions that incremental refreshes cannot see
+RANGE_REBUILD_SECONDS = 3600
+
+# Fields kept for each range; these are returned as lookup results
+RANGE_PROJECTION = {'value': 1, 'canonical': 1, 'type': 1, 'source': 1, 'reference': 1, 'timestamp': 1}
+
+
+class IntervalSet:
+    """Sorted, possibly overlapping integer intervals with containment queries"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.payloads = []
+        self.max_ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def merged(self, intervals):
+        """New IntervalSet holding these intervals plus (start, end, payload) tuples"""
+        merged = sorted(
+            list(zip(self.starts, self.ends, self.payloads)) + list(intervals),
+            key=lambda interval: interval[0]
+        )
+        result = IntervalSet()
+        result.starts = [start for start, _, _ in merged]
+        result.ends = [end for _, end, _ in merged]
+        result.payloads = [payload for _, _, payload in merged]
+
+        # max_ends[i] is the largest end among intervals 0..i
+        running = -1
+        for end in result.ends:
+            running = max(running, end)
+            result.max_ends.append(running)
+        return result
+
+    def containing(self, point):
+        """Payloads of every interval containing point"""
+        matches = []
+        i = bisect.bisect_right(self.starts, point) - 1
+        while i >= 0 and self.max_ends[i] >= point:
+            if self.ends[i] >= point:
+                matches.append(self.payloads[i])
+            i -= 1
+        return matches
+
+
+class RangeIndex:
+    """
+    IPv4/IPv6 netblock index built from ip_range IOCs.
+
+    Lookups take no lock: every change builds new IntervalSets and swaps
+    them in with a single assignment, so readers see the old index or
+    the new one, never a partial one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {4: IntervalSet(), 6: IntervalSet()}
+        self._last_id = None
+        self._last_refresh = float('-inf')
+        self._last_rebuild = float('-inf')
+
+    def __len__(self):
+        return sum(len(intervals) for intervals in self._families.values())
+
+    def add_many(self, iocs):
+        """Add ip_range IOC documents, skipping values that are not valid networks"""
+        self._families = self._merged_families(self._families, iocs)
+
+    def _merged_families(self, families, iocs):
+        """Copy of families with the ip_range IOCs added"""
+        intervals = {4: [], 6: []}
+        for ioc in iocs:
+            try:
+                network = ipaddress.ip_network(ioc.get('canonical') or ioc.get('value', ''), strict=False)
+            except ValueError:
+                continue
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), ioc)
+            )
+        families = dict(families)
+        for version, new_intervals in intervals.items():
+            if new_intervals:
+                families[version] = families[version].merged(new_intervals)
+        return families
+
+    def refresh(self, load_since, force=False):
+        """
+        Load ip_range IOCs added since the last refresh.
+
+        load_since(last_id) returns the ip_range IOCs with an _id greater
+        than last_id (every range when last_id is None), sorted by _id.
+
+        Refreshes are throttled to RANGE_REFRESH_SECONDS; every
+        RANGE_REBUILD_SECONDS (or when forced) the index is rebuilt from
+        scratch so expired ranges drop out.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < RANGE_REFRESH_SECONDS:
+            return
+
+        with self._lock:
+            if not force and now - self._last_refresh < RANGE_REFRESH_SECONDS:
+                return
+            rebuild = force or now - self._last_rebuild >= RANGE_REBUILD_SECONDS
+            last_id = None if rebuild else self._last_id
+
+            # Load before touching the index: if this raises, lookups keep
+            # the current ranges and the next call retries
+            iocs = list(load_since(last_id))
+            base = {4: IntervalSet(), 6: IntervalSet()} if rebuild else self._families
+            self._families = self._merged_families(base, iocs)
+            if iocs:
+                last_id = iocs[-1]['_id']
+            self._last_id = last_id
+            if rebuild:
+                self._last_rebuild = now
+            self._last_refresh = now
+
+    def lookup(self, ip):
+        """ip_range IOCs containing a single IP address"""
+        try:
+            address = ipaddress.ip_address(str(ip).strip('[]'))
+        except ValueError:
+            return []
+        return self._families[address.version].containing(int(address))
+
+    def lookup_many(self, ips):
+        """Map each IP address to the ip_range IOCs containing it"""
+        return {ip: self.lookup(ip) for ip in ips}
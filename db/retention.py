@@ -0,0 +1,347 @@
+"""
+IOC retention and cold archive for CTI Dashboard
+
+Most feed entries go stale within days, so IOCs older than their
+retention period are moved out of the hot store:
+
+  1. every (type, source) pair is given a TTL by RetentionPolicy
+  2. expired IOCs are written to gzip-compressed NDJSON segments,
+     partitioned by the month of their timestamp
+  3. each closed segment is recorded in a small JSON segment index
+     (time range, sources, types, count)
+  4. only then are the IOCs deleted from the store, which also takes them
+     out of the stats rollup
+
+ColdArchive.query reads archived IOCs back on demand, skipping any
+segment whose index entry cannot match. The archive has a single writer
+(the scanner or manage.py); readers only see indexed, closed segments.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import json_util
+from dotenv import load_dotenv
+from db.normalize import canonicalize
+from db.search import search_key
+
+load_dotenv()
+
+# Where archive segments and the segment index are written
+ARCHIVE_PATH = os.getenv(
+    'ARCHIVE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'archive')
+)
+
+# Retention for IOCs not covered by a source or type policy
+DEFAULT_RETENTION_DAYS = int(os.getenv('DEFAULT_RETENTION_DAYS', 90))
+
+# Built-in type policies; fast-churning indicators age out first
+DEFAULT_TYPE_RETENTION_DAYS = {
+    'ip': 30,
+    'url': 30
+}
+
+# Upper bound on IOCs archived per run, so a large backlog drains over several runs
+RETENTION_MAX_PER_RUN = int(os.getenv('RETENTION_MAX_PER_RUN', 100000))
+
+# IOCs held in memory and written per archive segment batch
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 10000))
+
+# Segment index file inside ARCHIVE_PATH
+SEGMENT_INDEX_FILE = 'index.json'
+
+# Partition for IOCs without a usable timestamp
+UNDATED_PARTITION = 'undated'
+
+
+class RetentionPolicy:
+    """
+    TTL in days for each (type, source) pair.
+
+    A source policy wins over a type policy, which wins over the default.
+    Policies come from the RETENTION_POLICIES environment variable, a JSON
+    object such as {"default": 90, "sources": {"Spamhaus DROP": 365},
+    "types": {"url": 14}}; a TTL of 0 keeps IOCs forever.
+    """
+
+    def __init__(self, default=DEFAULT_RETENTION_DAYS, sources=None, types=None):
+        self.default = default
+        self.sources = dict(sources or {})
+        self.types = {**DEFAULT_TYPE_RETENTION_DAYS, **(types or {})}
+
+    @classmethod
+    def from_env(cls):
+        """Policy from RETENTION_POLICIES, falling back to the defaults"""
+        raw = os.getenv('RETENTION_POLICIES')
+        if not raw:
+            return cls()
+        try:
+            config = json.loads(raw)
+        except ValueError as e:
+            print(f"⚠️  Ignoring invalid RETENTION_POLICIES: {e}")
+            return cls()
+        return cls(
+            default=int(config.get('default', DEFAULT_RETENTION_DAYS)),
+            sources={k: int(v) for k, v in config.get('sources', {}).items()},
+            types={k: int(v) for k, v in config.get('types', {}).items()}
+        )
+
+    def days_for(self, ioc_type, source):
+        """Retention in days for a (type, source) pair; 0 means keep forever"""
+        if source in self.sources:
+            return self.sources[source]
+        if ioc_type in self.types:
+            return self.types[ioc_type]
+        return self.default
+
+
+def _partition(ioc):
+    """Month partition for an IOC"""
+    timestamp = ioc.get('timestamp')
+    return timestamp.strftime('%Y-%m') if isinstance(timestamp, datetime) else UNDATED_PARTITION
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else None
+
+
+def _as_naive(value):
+    """Archived timestamps decode as UTC-aware; compare them as naive UTC"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None) - value.utcoffset()
+    return value
+
+
+class _SegmentWriter:
+    """One gzip NDJSON segment being written for a partition"""
+
+    def __init__(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name)
+        self.tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        self._file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.sources = set()
+        self.types = set()
+
+    def write(self, ioc):
+        self._file.write(json_util.dumps(ioc, json_options=json_util.RELAXED_JSON_OPTIONS) + '\n')
+        self.count += 1
+        timestamp = ioc.get('timestamp')
+        if isinstance(timestamp, datetime):
+            self.start = timestamp if self.start is None else min(self.start, timestamp)
+            self.end = timestamp if self.end is None else max(self.end, timestamp)
+        self.sources.add(ioc.get('source'))
+        self.types.add(ioc.get('type'))
+
+    def close(self):
+        """Make the segment durable and return its index entry"""
+        self._file.close()
+        with open(self.tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+        return {
+            'count': self.count,
+            'start': _isoformat(self.start),
+            'end': _isoformat(self.end),
+            'sources': sorted(s for s in self.sources if s is not None),
+            'types': sorted(t for t in self.types if t is not None),
+            'created': datetime.utcnow().isoformat()
+        }
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ColdArchive:
+    """Time-partitioned, compressed IOC segments plus their index"""
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, SEGMENT_INDEX_FILE)
+
+    def segments(self):
+        """Index entries for every closed segment, newest partition first"""
+        try:
+            with open(self.index_path, 'r') as f:
+                segments = json.load(f)
+        except FileNotFoundError:
+            return []
+        return sorted(segments, key=lambda s: (s['partition'], s['created']), reverse=True)
+
+    def _add_segments(self, entries):
+        """Append entries to the segment index, replacing the file atomically"""
+        with self._lock:
+            segments = self.segments() + entries
+            tmp_path = f"{self.index_path}.tmp-{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                json.dump(segments, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+
+    def write(self, iocs):
+        """
+        Archive IOCs into one new segment per partition.
+
+        Returns the index entries of the segments written. Nothing is
+        indexed unless every segment was written successfully.
+        """
+        run_id = time.time_ns()
+        writers = {}
+        try:
+            for ioc in iocs:
+                partition = _partition(ioc)
+                writer = writers.get(partition)
+                if writer is None:
+                    writer = writers[partition] = _SegmentWriter(
+                        os.path.join(self.path, partition), f'iocs-{run_id}.ndjson.gz'
+                    )
+                writer.write(ioc)
+
+            entries = []
+            for partition, writer in writers.items():
+                entry = writer.close()
+                entry['partition'] = partition
+                entry['path'] = os.path.relpath(writer.path, self.path)
+                entries.append(entry)
+        except Exception:
+            for writer in writers.values():
+                writer.abort()
+            raise
+
+        if entries:
+            self._add_segments(entries)
+        return entries
+
+    def _may_match(self, segment, since, until, source, ioc_type):
+        """Whether a segment's index entry allows any matching IOC"""
+        if source and source not in segment['sources']:
+            return False
+        if ioc_type and ioc_type not in segment['types']:
+            return False
+        if since and segment['end'] and datetime.fromisoformat(segment['end']) < since:
+            return False
+        if until and segment['start'] and datetime.fromisoformat(segment['start']) >= until:
+            return False
+        return True
+
+    def query(self, query=None, since=None, until=None, source=None, ioc_type=None, limit=100):
+        """
+        Read archived IOCs back, newest partition first.
+
+        query matches the canonical form exactly or the normalized value as
+        a substring; since/until bound the IOC timestamp (naive values are
+        UTC, aware ones are converted). Segments ruled out by the index are
+        never opened.
+        """
+        since, until = _as_naive(since), _as_naive(until)
+        canonical = canonicalize(query) if query else None
+        key = search_key(query) if query else None
+        results = []
+
+        for segment in self.segments():
+            if not self._may_match(segment, since, until, source, ioc_type):
+                continue
+            with gzip.open(os.path.join(self.path, segment['path']), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    ioc = json_util.loads(line)
+                    timestamp = _as_naive(ioc.get('timestamp'))
+                    ioc['timestamp'] = timestamp
+                    if source and ioc.get('source') != source:
+                        continue
+                    if ioc_type and ioc.get('type') != ioc_type:
+                        continue
+                    if since and (timestamp is None or timestamp < since):
+                        continue
+                    if until and (timestamp is None or timestamp >= until):
+                        continue
+                    if query and ioc.get('canonical') != canonical and key not in search_key(ioc.get('value', '')):
+                        continue
+                    results.append(ioc)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+
+def apply_retention(store, archive, policy=None, now=None, max_iocs=RETENTION_MAX_PER_RUN, dry_run=False):
+    """
+    Archive and delete expired IOCs.
+
+    IOCs are handled RETENTION_CHUNK_SIZE at a time: each chunk is written
+    to the archive and indexed before it is deleted, so memory stays
+    bounded and a failure never loses IOCs. Returns a summary with the
+    number of IOCs expired, archived and deleted plus per-(type, source)
+    counts. With dry_run nothing is written or deleted.
+
+    If a chunk is archived but not fully deleted, the run stops (and
+    summary['undeleted'] says how many were left): those IOCs would
+    otherwise be found expired again and archived once more per chunk.
+    """
+    policy = policy or RetentionPolicy.from_env()
+    now = now or datetime.utcnow()
+    summary = {'expired': 0, 'archived': 0, 'deleted': 0, 'undeleted': 0, 'segments': 0, 'by_pair': []}
+    pending = []
+
+    def flush():
+        if pending:
+            segments = archive.write(pending)
+            summary['segments'] += len(segments)
+            summary['archived'] += sum(segment['count'] for segment in segments)
+            deleted = store.delete_iocs(pending)
+            summary['deleted'] += deleted
+            summary['undeleted'] += len(pending) - deleted
+            pending.clear()
+
+    for ioc_type in store.distinct_values('type'):
+        if summary['undeleted']:
+            break
+        for source in store.distinct_values('source'):
+            if summary['undeleted']:
+                break
+            days = policy.days_for(ioc_type, source)
+            if not days:
+                continue
+            filter_query = {'type': ioc_type, 'source': source}
+            before = now - timedelta(days=days)
+            expired = 0
+
+            while summary['expired'] < max_iocs:
+                if dry_run:
+                    room = max_iocs - summary['expired']
+                    found = sum(1 for _ in store.iter_expired(filter_query, before, limit=room))
+                else:
+                    room = min(RETENTION_CHUNK_SIZE - len(pending), max_iocs - summary['expired'])
+                    batch = list(store.iter_expired(filter_query, before, limit=room))
+                    pending.extend(batch)
+                    found = len(batch)
+                expired += found
+                summary['expired'] += found
+                if dry_run or found < room:
+                    break
+                # Chunk is full: archive and delete it, then continue with this pair
+                flush()
+                if summary['undeleted']:
+                    break
+
+            if expired:
+                summary['by_pair'].append({'type': ioc_type, 'source': source, 'days': days, 'expired': expired})
+
+    if not dry_run:
+        flush()
+    return summary
+
+
+# Shared archive instance
+cold_archive = ColdArchive()
@@ -0,0 +1,67 @@
+"""
+Read routing for the MongoDB backend of CTI Dashboard
+
+Writes always go to the primary. Each repository read method is mapped
+to a read preference mode; read-heavy dashboard methods default to
+secondaryPreferred, so an ingest run on the primary does not slow down
+user traffic. Secondaries lagging more than MONGO_MAX_STALENESS_SECONDS
+behind the primary are never read from.
+
+MONGO_READ_ROUTING overrides the mapping per method with a JSON object,
+e.g. {"search_iocs": "primary", "get_iocs_page": "secondaryPreferred"}.
+Routing a generation-cached view to a secondary lets a lagging member's
+results be cached until the next ingest. Against a standalone server every mode reads from that server.
+"""
+import json
+import os
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+
+# Longest replication lag tolerated on secondary reads (MongoDB requires >= 90)
+MONGO_MAX_STALENESS_SECONDS = max(90, int(os.getenv('MONGO_MAX_STALENESS_SECONDS', 90)))
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+# Read methods served by secondaries; any method not listed reads the primary.
+# ingest_generation and the views cached under it (get_stats, and
+# distinct_values behind /api/sources and /api/types) stay on the primary:
+# secondaryPreferred may pick a different secondary for each read, so the
+# generation could come from an up-to-date member and the data from a
+# lagging one, caching stale results under the new generation.
+DEFAULT_READ_ROUTING = {
+    'get_threat_level_stats': 'secondaryPreferred',
+    'get_trends': 'secondaryPreferred',
+    'search_iocs': 'secondaryPreferred',
+    'iter_iocs': 'secondaryPreferred'
+}
+
+
+def read_routing_from_env():
+    """Method -> read preference mode, with MONGO_READ_ROUTING applied"""
+    routing = dict(DEFAULT_READ_ROUTING)
+    raw = os.getenv('MONGO_READ_ROUTING')
+    if not raw:
+        return routing
+    try:
+        overrides = json.loads(raw)
+    except ValueError as e:
+        print(f"⚠️  Ignoring invalid MONGO_READ_ROUTING: {e}")
+        return routing
+    for method, mode in overrides.items():
+        if mode not in READ_PREFERENCES:
+            print(f"⚠️  Ignoring unknown read preference {mode!r} for {method}")
+            continue
+        routing[method] = mode
+    return routing
+
+
+def read_preference(mode):
+    """PyMongo read preference for a mode, bounded by MONGO_MAX_STALENESS_SECONDS"""
+    if mode == 'primary':
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=MONGO_MAX_STALENESS_SECONDS)
@@ -0,0 +1,116 @@
+"""
+Indexed IOC search for CTI Dashboard
+
+Every IOC carries two derived fields written at ingest time:
+  search_key   - the refanged, lowercased value, used for prefix lookups
+  search_grams - the set of character trigrams of search_key, used for
+                 substring lookups through a multikey index
+
+plan_search() picks the cheapest strategies for the shape of a query and
+run_search() executes them in order until the result limit is filled.
+"""
+import re
+from db.normalize import refang, canonicalize, classify
+
+NGRAM_SIZE = 3
+
+# Only the head of very long values (URLs) is indexed for substring search
+MAX_NGRAM_SOURCE_LENGTH = 256
+
+# Trigrams present in most URLs/domains; never used to drive an index scan
+COMMON_NGRAMS = {
+    'htt', 'ttp', 'tps', 'tp:', 'ps:', 'p:/', 's:/', '://', 'www', 'ww.',
+    '.co', 'com', 'om/', '.ne', 'net', '.or', 'org', 'htm', 'tml', 'php'
+}
+
+# Derived search fields kept out of API responses, and the matching projection
+INTERNAL_FIELDS = ('search_grams', 'search_key')
+INTERNAL_FIELDS_PROJECTION = {field: 0 for field in INTERNAL_FIELDS}
+
+
+def search_key(value):
+    """Normalized key used for prefix and substring matching"""
+    return refang(value).lower()
+
+
+def ngrams(text):
+    """Distinct character trigrams of text, in order of first appearance"""
+    text = text[:MAX_NGRAM_SOURCE_LENGTH]
+    seen = {}
+    for i in range(len(text) - NGRAM_SIZE + 1):
+        seen.setdefault(text[i:i + NGRAM_SIZE], None)
+    return list(seen)
+
+
+def search_fields(value):
+    """Derived search fields stored alongside an IOC"""
+    key = search_key(value)
+    return {'search_key': key, 'search_grams': ngrams(key)}
+
+
+def _is_complete_indicator(query):
+    """Whether the query looks like a whole IOC rather than a fragment"""
+    return classify(query) in ('ip', 'cidr', 'url', 'hash')
+
+
+def _prefix_filter(query):
+    """Index range covering every search_key starting with query"""
+    upper = query[:-1] + chr(ord(query[-1]) + 1)
+    return {'search_key': {'$gte': query, '$lt': upper}}
+
+
+def _substring_filter(query):
+    """Trigram filter for substring matches, rarest-looking gram first"""
+    grams = ngrams(query)
+    grams.sort(key=lambda gram: (gram in COMMON_NGRAMS, -sum(c.isdigit() for c in gram)))
+    return {
+        'search_grams': {'$all': grams},
+        'search_key': {'$regex': re.escape(query)}
+    }
+
+
+def plan_search(query):
+    """
+    Choose search strategies for a query, cheapest first.
+
+    Returns a list of (strategy, filter) tuples:
+      exact     - single probe of the hashed canonical index
+      prefix    - anchored range scan on search_key
+      substring - multikey trigram scan verified against search_key
+    """
+    canonical = canonicalize(query)
+    query = search_key(query)
+    if not query:
+        return []
+
+    plan = [('exact', {'canonical': canonical})]
+    if _is_complete_indicator(query):
+        # Whole indicators only widen to substring matches (e.g. inside URLs)
+        if len(query) >= NGRAM_SIZE:
+            plan.append(('substring', _substring_filter(query)))
+        return plan
+
+    plan.append(('prefix', _prefix_filter(query)))
+    if len(query) >= NGRAM_SIZE:
+        plan.append(('substring', _substring_filter(query)))
+    return plan
+
+
+def run_search(collection, query, limit=50, projection=None):
+    """Execute the search plan for query, returning up to limit IOCs"""
+    projection = projection or INTERNAL_FIELDS_PROJECTION
+    results = []
+    seen_ids = set()
+
+    for strategy, filter_query in plan_search(query):
+        remaining = limit - len(results)
+        if remaining <= 0:
+            break
+        if seen_ids:
+            filter_query = {**filter_query, '_id': {'$nin': list(seen_ids)}}
+
+        for doc in collection.find(filter_query, projection).limit(remaining):
+            seen_ids.add(doc['_id'])
+            results.append(doc)
+
+    return results
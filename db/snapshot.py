@@ -0,0 +1,183 @@
+"""
+Memory-mapped IOC snapshot for CTI Dashboard
+
+The scanner publishes every canonical IOC key after each ingest as a
+compact, versioned binary file. Web workers mmap it read-only, so all
+gunicorn workers share one copy through the page cache, and lookups keep
+working while MongoDB is unreachable.
+
+File layout (little-endian):
+  header   magic(8s) version(Q) count(I) blob_length(I) sources_length(I),
+           padded to 8 bytes
+  sources  JSON list of source names, padded to 8 bytes
+  offsets  (count + 1) x uint32 offsets into the key blob
+  masks    count x uint64 bitmasks of sources listing each key
+  blob     UTF-8 canonical keys, sorted bytewise
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+SNAPSHOT_MAGIC = b'CTISNAP1'
+HEADER = struct.Struct('<8sQIII')
+MAX_SOURCES = 64
+
+# Default location shared by the scanner (writer) and web workers (readers)
+SNAPSHOT_PATH = os.getenv(
+    'SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'iocs.snap')
+)
+
+# How often readers check for a newly published snapshot
+SNAPSHOT_CHECK_SECONDS = 5
+
+
+def _padded(length):
+    """Round length up to the next multiple of 8"""
+    return (length + 7) & ~7
+
+
+def write_snapshot(path, entries, version=None):
+    """
+    Atomically publish a snapshot.
+
+    entries maps canonical key -> iterable of source names. The file is
+    written next to path and renamed over it, so readers see either the
+    old or the new version, never a partial file. Returns the version.
+    """
+    version = version or time.time_ns()
+    sources = sorted({source for names in entries.values() for source in names})
+    if len(sources) > MAX_SOURCES:
+        raise ValueError(f"Snapshot supports at most {MAX_SOURCES} sources, got {len(sources)}")
+    source_bits = {source: 1 << i for i, source in enumerate(sources)}
+
+    keys = sorted((key.encode('utf-8'), names) for key, names in entries.items() if key)
+    offsets = [0]
+    masks = []
+    for encoded, names in keys:
+        offsets.append(offsets[-1] + len(encoded))
+        mask = 0
+        for source in names:
+            mask |= source_bits[source]
+        masks.append(mask)
+
+    sources_json = json.dumps(sources).encode('utf-8')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        header = HEADER.pack(SNAPSHOT_MAGIC, version, len(keys), offsets[-1], len(sources_json))
+        f.write(header.ljust(_padded(HEADER.size), b'\0'))
+        f.write(sources_json.ljust(_padded(len(sources_json)), b'\0'))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets).ljust(_padded(4 * len(offsets)), b'\0'))
+        f.write(struct.pack(f'<{len(masks)}Q', *masks))
+        for encoded, _ in keys:
+            f.write(encoded)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return version
+
+
+class Snapshot:
+    """A single mapped snapshot version"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.count, blob_length, sources_length = HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an IOC snapshot")
+
+        position = _padded(HEADER.size)
+        self.sources = json.loads(self._map[position:position + sources_length])
+        position += _padded(sources_length)
+
+        view = memoryview(self._map)
+        self._offsets = view[position:position + 4 * (self.count + 1)].cast('I')
+        position += _padded(4 * (self.count + 1))
+        self._masks = view[position:position + 8 * self.count].cast('Q')
+        position += 8 * self.count
+        self._blob_start = position
+
+    def _key(self, i):
+        start = self._blob_start + self._offsets[i]
+        return self._map[start:self._blob_start + self._offsets[i + 1]]
+
+    def _sources(self, mask):
+        return [source for i, source in enumerate(self.sources) if mask & (1 << i)]
+
+    def lookup(self, key):
+        """Source names listing key, or an empty list"""
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == target:
+            return self._sources(self._masks[low])
+        return []
+
+
+class SnapshotReader:
+    """Serves lookups from the latest published snapshot, swapping versions atomically"""
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self._snapshot = None
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+
+    def _current(self):
+        """Return the mapped snapshot, remapping if a newer file was published"""
+        now = time.monotonic()
+        if now - self._last_check < SNAPSHOT_CHECK_SECONDS:
+            return self._snapshot
+
+        with self._lock:
+            self._last_check = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return self._snapshot
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            if self._snapshot is None or self._snapshot.identity != identity:
+                try:
+                    # In-flight lookups keep the old mapping alive until they finish
+                    self._snapshot = Snapshot(self.path)
+                except (OSError, ValueError) as e:
+                    print(f"Error loading IOC snapshot: {e}")
+        return self._snapshot
+
+    @property
+    def version(self):
+        snapshot = self._current()
+        return snapshot.version if snapshot else None
+
+    def available(self):
+        """Whether a snapshot has been published and mapped"""
+        return self._current() is not None
+
+    def lookup(self, key):
+        """Source names listing a canonical key"""
+        snapshot = self._current()
+        return snapshot.lookup(key) if snapshot else []
+
+    def lookup_many(self, keys):
+        """Map each canonical key to the source names listing it"""
+        snapshot = self._current()
+        if snapshot is None:
+            return {key: [] for key in keys}
+        return {key: snapshot.lookup(key) for key in keys}
+
+
+# Shared reader instance
+ioc_snapshot = SnapshotReader()
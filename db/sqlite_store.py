@@ -0,0 +1,835 @@
+"""
+Embedded SQLite storage backend for CTI Dashboard
+
+Implements the IOCStore interface on a local SQLite database in WAL mode,
+for single-node deployments, edge sensors and test benches that should
+not depend on a MongoDB server. Listing, lookup and search queries are
+served by real indexes:
+
+  iocs(canonical, source)          unique - dedup and exact lookups
+  iocs(value)
+  iocs(type, timestamp, id)        keyset pagination per filter
+  iocs(source, timestamp, id)
+  iocs(timestamp, id)
+  iocs(type, source, last_seen)    retention scans
+  iocs(search_key)                 prefix search
+  ioc_tags(tag, ioc_id)            tag filters
+  iocs_fts                         FTS5 trigram index for substring search
+
+Fields without a column of their own are kept in a JSON `doc` column.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from db.base import IOCStore
+from db.indicators import consolidate
+from db.search import plan_search, search_key, INTERNAL_FIELDS
+from db.normalize import normalize_ioc, canonicalize, classify
+from db.snapshot import ioc_snapshot
+from db.pagination import decode_cursor, encode_cursor
+
+load_dotenv()
+
+# Default database file, next to the snapshot under data/
+SQLITE_PATH = os.getenv(
+    'SQLITE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'cti_dashboard.db')
+)
+
+# Rows written per transaction during bulk ingest
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+
+# Bound parameters per IN (...) query, below SQLite's variable limit
+LOOKUP_BATCH_SIZE = 500
+
+# Milliseconds a writer waits for another process's write lock
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+# Change events kept for /api/stream clients catching up after a reconnect
+EVENTS_RETAINED = int(os.getenv('EVENTS_RETAINED', 1000))
+
+# How often iter_events polls for new events
+EVENTS_POLL_SECONDS = 1
+
+# Fixed-width timestamp text, so string order is time order
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# IOC fields stored in their own columns; everything else goes in doc
+COLUMN_FIELDS = ('value', 'canonical', 'search_key', 'type', 'source', 'threat_level', 'timestamp', 'last_seen')
+
+# Columns holding datetimes as TIMESTAMP_FORMAT text
+TIMESTAMP_COLUMNS = ('timestamp', 'last_seen')
+
+# Fields that may appear in a listing/count filter
+FILTER_COLUMNS = {'type', 'source', 'threat_level', 'canonical', 'value'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS iocs (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL,
+    canonical TEXT NOT NULL,
+    search_key TEXT NOT NULL,
+    type TEXT,
+    source TEXT NOT NULL,
+    threat_level TEXT,
+    timestamp TEXT,
+    last_seen TEXT,
+    doc TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (canonical, source)
+);
+CREATE INDEX IF NOT EXISTS idx_iocs_value ON iocs (value);
+CREATE INDEX IF NOT EXISTS idx_iocs_timestamp ON iocs (timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_iocs_type_timestamp ON iocs (type, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_iocs_source_timestamp ON iocs (source, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_iocs_type_source_timestamp ON iocs (type, source, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_iocs_threat_level ON iocs (threat_level) WHERE threat_level IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_iocs_search_key ON iocs (search_key);
+CREATE TABLE IF NOT EXISTS ioc_tags (
+    ioc_id INTEGER NOT NULL REFERENCES iocs (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (ioc_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_ioc_tags_tag ON ioc_tags (tag, ioc_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    generation INTEGER PRIMARY KEY,
+    event TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    verdict TEXT NOT NULL,
+    cached_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_verdicts_expires_at ON verdicts (expires_at);
+"""
+
+# Created after connect() has added last_seen to databases from before it existed
+LAST_SEEN_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_iocs_type_source_last_seen ON iocs (type, source, last_seen);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS iocs_fts USING fts5(
+    search_key, content='iocs', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS iocs_fts_insert AFTER INSERT ON iocs BEGIN
+    INSERT INTO iocs_fts (rowid, search_key) VALUES (new.id, new.search_key);
+END;
+CREATE TRIGGER IF NOT EXISTS iocs_fts_delete AFTER DELETE ON iocs BEGIN
+    INSERT INTO iocs_fts (iocs_fts, rowid, search_key) VALUES ('delete', old.id, old.search_key);
+END;
+"""
+
+# Hot query of each repository method: (name, sql, params)
+QUERY_PROBES = [
+    ('get_iocs_page', 'SELECT * FROM iocs WHERE 1 ORDER BY timestamp DESC, id DESC LIMIT 1', ()),
+    ('get_iocs_page(type)', 'SELECT * FROM iocs WHERE type = ? ORDER BY timestamp DESC, id DESC LIMIT 1', ('ip',)),
+    ('get_iocs_page(source)', 'SELECT * FROM iocs WHERE source = ? ORDER BY timestamp DESC, id DESC LIMIT 1',
+     ('ThreatFox',)),
+    ('get_iocs_page(type, source)',
+     'SELECT * FROM iocs WHERE type = ? AND source = ? ORDER BY timestamp DESC, id DESC LIMIT 1', ('ip', 'ThreatFox')),
+    ('get_iocs_by_tag', 'SELECT iocs.* FROM ioc_tags JOIN iocs ON iocs.id = ioc_tags.ioc_id '
+     'WHERE ioc_tags.tag = ? ORDER BY iocs.timestamp DESC, iocs.id DESC', ('botnet',)),
+    ('count_iocs(type, source)', 'SELECT COUNT(*) FROM iocs WHERE type = ? AND source = ?', ('ip', 'ThreatFox')),
+    ('search_iocs(exact)', 'SELECT * FROM iocs WHERE canonical = ?', ('evil.com',)),
+    ('search_iocs(prefix)', 'SELECT * FROM iocs WHERE search_key >= ? AND search_key < ?', ('evil', 'evim')),
+    ('find_ip_ranges', "SELECT * FROM iocs WHERE type = 'ip_range' AND id > ? ORDER BY id", (0,)),
+    ('get_threat_level_stats', 'SELECT threat_level AS _id, COUNT(*) AS count FROM iocs '
+     'WHERE threat_level IS NOT NULL GROUP BY threat_level ORDER BY count DESC', ()),
+    ('bulk_lookup', 'SELECT * FROM iocs WHERE canonical IN (?, ?)', ('evil.com', '1.2.3.4')),
+    ('iter_expired', 'SELECT * FROM iocs WHERE type = ? AND source = ? AND last_seen < ? ORDER BY last_seen, id',
+     ('ip', 'ThreatFox', '2000-01-01'))
+]
+
+
+def _format_timestamp(value):
+    """Column text for a datetime (stored as naive UTC), else None"""
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return {'$date': _format_timestamp(obj)}
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.strptime(obj['$date'], TIMESTAMP_FORMAT)
+    return obj
+
+
+def _encode_doc(extra):
+    return json.dumps(extra, default=_json_default, separators=(',', ':'))
+
+
+def _decode_doc(text):
+    return json.loads(text, object_hook=_json_object_hook) if text else {}
+
+
+def _project(doc, fields):
+    """Keep _id and the requested fields; None drops only internal fields"""
+    if not fields:
+        return {key: value for key, value in doc.items() if key not in INTERNAL_FIELDS}
+    return {key: value for key, value in doc.items() if key == '_id' or key in fields}
+
+
+def _row_id(ioc_id):
+    """IOC id from an API path or cursor; raises ValueError if malformed"""
+    return int(ioc_id)
+
+
+class SQLiteStore(IOCStore):
+    """IOC storage in an embedded SQLite database"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path=SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self.has_fts = False
+        self._connected = False
+        self._local = threading.local()
+
+    def _conn(self):
+        """Connection for the current thread, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def connect(self):
+        """Open the database file and create the schema"""
+        try:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = self._conn()
+            conn.executescript(SCHEMA)
+            self._add_last_seen(conn)
+            conn.executescript(LAST_SEEN_SCHEMA)
+            try:
+                conn.executescript(FTS_SCHEMA)
+            except sqlite3.OperationalError as e:
+                # SQLite < 3.34 has no trigram tokenizer; substring search scans search_key
+                print(f"⚠️  FTS5 trigram index unavailable, substring search will scan: {e}")
+            self.has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'iocs_fts'"
+            ).fetchone() is not None
+            self._connected = True
+            print(f"✅ Opened SQLite database {self.path}")
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Failed to open SQLite database: {e}")
+            return False
+
+    def _add_last_seen(self, conn):
+        """Add last_seen to an older iocs table, starting it at each IOC's timestamp"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(iocs)')}
+        if 'last_seen' in columns:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('ALTER TABLE iocs ADD COLUMN last_seen TEXT')
+            conn.execute('UPDATE iocs SET last_seen = timestamp')
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+    def is_connected(self):
+        return self._connected
+
+    def ping(self):
+        self._conn().execute('SELECT 1')
+
+    def reset_after_fork(self):
+        """Drop connections opened by the parent; _conn reopens them per thread"""
+        self._local = threading.local()
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            print("✅ SQLite database closed")
+
+    # Documents
+
+    def _row_values(self, ioc, seen_at):
+        """Column values for an IOC document first listed at seen_at"""
+        if 'canonical' not in ioc:
+            normalize_ioc(ioc)
+        extra = {key: value for key, value in ioc.items()
+                 if key not in COLUMN_FIELDS and key not in ('_id', 'search_grams')}
+        timestamp = _format_timestamp(ioc.get('timestamp'))
+        if timestamp is None and ioc.get('timestamp') is not None:
+            extra['timestamp'] = ioc['timestamp']
+        threat_level = ioc.get('threat_level')
+        return (
+            ioc['value'], ioc['canonical'], search_key(ioc['value']), ioc.get('type'), ioc['source'],
+            None if threat_level is None else str(threat_level), timestamp, _format_timestamp(seen_at),
+            _encode_doc(extra)
+        )
+
+    def _to_doc(self, row, fields=None):
+        """IOC document for a row, limited to fields"""
+        doc = {'_id': row['id']}
+        for field in COLUMN_FIELDS:
+            if row[field] is not None:
+                doc[field] = row[field]
+        doc.update(_decode_doc(row['doc']))
+        for field in TIMESTAMP_COLUMNS:
+            if row[field] is not None:
+                doc[field] = datetime.strptime(row[field], TIMESTAMP_FORMAT)
+        return _project(doc, fields)
+
+    def _where(self, filter_query):
+        """SQL condition and parameters for a type/source/tags filter"""
+        clauses = []
+        params = []
+        for field, value in (filter_query or {}).items():
+            if field == 'tags':
+                clauses.append('EXISTS (SELECT 1 FROM ioc_tags WHERE ioc_id = iocs.id AND tag = ?)')
+            elif field in FILTER_COLUMNS:
+                clauses.append(f'{field} = ?')
+            else:
+                raise ValueError(f"Unsupported filter field: {field}")
+            params.append(value)
+        return ' AND '.join(clauses) or '1', params
+
+    # Ingest
+
+    def insert_ioc(self, ioc_data):
+        """Insert a single IOC"""
+        try:
+            return self.bulk_upsert_iocs([ioc_data])['inserted'] == 1
+        except Exception as e:
+            print(f"Error inserting IOC: {e}")
+            return False
+
+    def bulk_upsert_iocs(self, ioc_list, batch_size=None):
+        """
+        Insert IOCs in one transaction per batch, keyed on (canonical, source).
+
+        Returns the same summary as the MongoDB backend; existing IOCs are
+        matched and only their last_seen is updated.
+        """
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        summary = {'inserted': 0, 'matched': 0, 'failed': 0, 'batches': []}
+        inserted = []
+        created = 0
+        now = datetime.utcnow()
+        seen_at = _format_timestamp(now)
+        conn = self._conn()
+
+        for start in range(0, len(ioc_list), batch_size):
+            batch = ioc_list[start:start + batch_size]
+            counts = {'inserted': 0, 'matched': 0, 'failed': 0}
+            tag_rows = []
+            seen_rows = []
+            batch_inserted = []
+            batch_created = 0
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for ioc in batch:
+                    if not ioc.get('value') or not ioc.get('source'):
+                        counts['failed'] += 1
+                        continue
+                    row = conn.execute(
+                        'INSERT INTO iocs (value, canonical, search_key, type, source, threat_level, timestamp, '
+                        'last_seen, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (canonical, source) DO NOTHING RETURNING id',
+                        self._row_values(ioc, now)
+                    ).fetchone()
+                    if row is None:
+                        counts['matched'] += 1
+                        seen_rows.append((seen_at, ioc['canonical'], ioc['source']))
+                        continue
+                    counts['inserted'] += 1
+                    batch_inserted.append(ioc)
+                    # First source listing this indicator
+                    batch_created += conn.execute(
+                        'SELECT NOT EXISTS (SELECT 1 FROM iocs WHERE canonical = ? AND id != ?)',
+                        (ioc['canonical'], row[0])
+                    ).fetchone()[0]
+                    tag_rows.extend((row[0], tag) for tag in set(ioc.get('tags') or []))
+                if tag_rows:
+                    conn.executemany('INSERT OR IGNORE INTO ioc_tags (ioc_id, tag) VALUES (?, ?)', tag_rows)
+                if seen_rows:
+                    conn.executemany('UPDATE iocs SET last_seen = ? WHERE canonical = ? AND source = ?', seen_rows)
+                conn.execute('COMMIT')
+                inserted.extend(batch_inserted)
+                created += batch_created
+            except Exception as e:
+                print(f"Error in bulk upsert batch: {e}")
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                counts = {'inserted': 0, 'matched': 0, 'failed': len(batch)}
+
+            summary['batches'].append(counts)
+            for key, value in counts.items():
+                summary[key] += value
+
+        if summary['inserted'] or summary['matched']:
+            self._publish_change(self._next_generation(), inserted, created, reason='sightings')
+        return summary
+
+    # Ingest generation
+
+    def _load_generation(self):
+        rows = dict(self._conn().execute(
+            "SELECT key, value FROM meta WHERE key IN ('ingest_generation', 'ingest_generation_at')"
+        ).fetchall())
+        modified_at = rows.get('ingest_generation_at')
+        if modified_at is not None:
+            modified_at = datetime(1970, 1, 1) + timedelta(milliseconds=modified_at)
+        return rows.get('ingest_generation', 0), modified_at
+
+    def _increment_generation(self):
+        conn = self._conn()
+        modified_at = datetime.utcnow()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            generation = conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('ingest_generation', 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value"
+            ).fetchone()[0]
+            # Milliseconds since the epoch, matching MongoDB's date precision
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('ingest_generation_at', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (int((modified_at - datetime(1970, 1, 1)).total_seconds() * 1000),)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return generation, modified_at.replace(microsecond=modified_at.microsecond // 1000 * 1000)
+
+    # Change events
+
+    def publish_event(self, event):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO events (generation, event) VALUES (?, ?)',
+                     (event['generation'], _encode_doc(event)))
+        conn.execute('DELETE FROM events WHERE generation <= ?', (event['generation'] - EVENTS_RETAINED,))
+
+    def iter_events(self, after=0, timeout=30):
+        """Poll the events table; see IOCStore.iter_events"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rows = self._conn().execute(
+                'SELECT generation, event FROM events WHERE generation > ? ORDER BY generation', (after,)
+            ).fetchall()
+            for row in rows:
+                after = row['generation']
+                yield _decode_doc(row['event'])
+            if not rows:
+                yield None
+                time.sleep(EVENTS_POLL_SECONDS)
+
+    # Listing
+
+    def _select(self, where='1', params=(), order='timestamp DESC, id DESC', limit=None, offset=0):
+        sql = f'SELECT * FROM iocs WHERE {where} ORDER BY {order}'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+            if offset:
+                sql += f' OFFSET {int(offset)}'
+        return self._conn().execute(sql, list(params))
+
+    def get_all_iocs(self, limit=100, fields=None):
+        """Retrieve all IOCs with limit"""
+        try:
+            return [self._to_doc(row, fields) for row in self._select(limit=limit)]
+        except Exception as e:
+            print(f"Error retrieving IOCs: {e}")
+            return []
+
+    def get_iocs_page(self, filter_query=None, limit=100, cursor=None, skip=0, fields=None):
+        """
+        Get one page of IOCs ordered by (timestamp, id) descending.
+
+        Same contract as the MongoDB backend: a cursor from a previous
+        page's next_cursor turns the page into an index range scan, and a
+        malformed cursor raises ValueError.
+        """
+        limit = max(1, limit)
+        where, params = self._where(filter_query)
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor)
+            last_id = _row_id(last_id)
+            if timestamp is None:
+                where += ' AND timestamp IS NULL AND id < ?'
+                params += [last_id]
+            else:
+                where += ' AND ((timestamp, id) < (?, ?) OR timestamp IS NULL)'
+                params += [_format_timestamp(timestamp), last_id]
+
+        rows = self._select(where, params, limit=limit + 1, offset=0 if cursor else max(0, skip)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(self._to_doc(rows[-1]))
+        return [self._to_doc(row, fields) for row in rows], next_cursor
+
+    def iter_iocs(self, filter_query=None, limit=0, fields=None):
+        """Lazily iterate IOCs, newest first, fetching INGEST_BATCH_SIZE rows at a time"""
+        where, params = self._where(filter_query)
+        cursor = self._select(where, params, limit=limit)
+        while True:
+            rows = cursor.fetchmany(INGEST_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield self._to_doc(row, fields)
+
+    def count_iocs(self, filter_query=None):
+        """Count IOCs matching a filter through the covering indexes"""
+        try:
+            where, params = self._where(filter_query)
+            return self._conn().execute(f'SELECT COUNT(*) FROM iocs WHERE {where}', params).fetchone()[0]
+        except Exception as e:
+            print(f"Error counting IOCs: {e}")
+            return 0
+
+    def distinct_values(self, field):
+        """Distinct values of an IOC column"""
+        if field not in FILTER_COLUMNS:
+            raise ValueError(f"Unsupported field: {field}")
+        rows = self._conn().execute(f'SELECT DISTINCT {field} FROM iocs WHERE {field} IS NOT NULL')
+        return [row[0] for row in rows]
+
+    # Lookup and search
+
+    def _strategy_sql(self, strategy, filter_query, key):
+        """SQL condition for a plan_search strategy on the normalized query key"""
+        if strategy == 'exact':
+            return 'canonical = ?', [filter_query['canonical']]
+        if strategy == 'prefix':
+            bounds = filter_query['search_key']
+            return 'search_key >= ? AND search_key < ?', [bounds['$gte'], bounds['$lt']]
+        if self.has_fts:
+            phrase = '"' + key.replace('"', '""') + '"'
+            return 'id IN (SELECT rowid FROM iocs_fts WHERE iocs_fts MATCH ?)', [phrase]
+        return 'instr(search_key, ?) > 0', [key]
+
+    def search_iocs(self, query, limit=50, fields=None):
+        """Search IOCs by value with the same exact/prefix/substring plan as MongoDB"""
+        try:
+            results = []
+            seen_ids = set()
+            key = search_key(query)
+            for strategy, filter_query in plan_search(query):
+                remaining = limit - len(results)
+                if remaining <= 0:
+                    break
+                where, params = self._strategy_sql(strategy, filter_query, key)
+                if seen_ids:
+                    where += f" AND id NOT IN ({','.join('?' * len(seen_ids))})"
+                    params += list(seen_ids)
+                rows = self._conn().execute(f'SELECT * FROM iocs WHERE {where} LIMIT {int(remaining)}', params)
+                for row in rows:
+                    seen_ids.add(row['id'])
+                    results.append(self._to_doc(row, fields))
+
+            if classify(query) == 'ip':
+                # Include listed netblocks containing the IP
+                for doc in self.find_ip_ranges(query):
+                    if doc['_id'] not in seen_ids:
+                        results.append(_project(doc, fields))
+            return results
+        except Exception as e:
+            print(f"Error searching IOCs: {e}")
+            return []
+
+    def find_indicator(self, value, ioc_type=None):
+        """
+        Consolidated indicator for value, built from its per-source rows.
+
+        The rows come from one probe of the (canonical, source) index, so
+        there is no separate indicators table to keep in step.
+        """
+        canonical = canonicalize(value, ioc_type)
+        try:
+            rows = self._conn().execute('SELECT * FROM iocs WHERE canonical = ?', (canonical,)).fetchall()
+            return consolidate(canonical, [self._to_doc(row) for row in rows]) if rows else None
+        except Exception as e:
+            print(f"Error looking up indicator, using snapshot: {e}")
+            return self._snapshot_indicator(canonical, ioc_snapshot.lookup(canonical))
+
+    def bulk_lookup(self, canonicals, batch_size=None):
+        """Resolve many canonical keys with batched IN queries"""
+        batch_size = min(batch_size or LOOKUP_BATCH_SIZE, LOOKUP_BATCH_SIZE)
+        canonicals = list(dict.fromkeys(canonicals))
+        matches = {canonical: [] for canonical in canonicals}
+        fields = ('value', 'canonical', 'type', 'source', 'confidence', 'timestamp')
+        try:
+            for start in range(0, len(canonicals), batch_size):
+                batch = canonicals[start:start + batch_size]
+                rows = self._conn().execute(
+                    f"SELECT * FROM iocs WHERE canonical IN ({','.join('?' * len(batch))})", batch
+                )
+                for row in rows:
+                    matches[row['canonical']].append(self._to_doc(row, fields))
+        except Exception as e:
+            print(f"Error in bulk lookup, using snapshot: {e}")
+            for canonical, sources in ioc_snapshot.lookup_many(canonicals).items():
+                matches[canonical] = self._snapshot_documents(canonical, sources)
+        return matches
+
+    def get_verdict(self, key):
+        try:
+            row = self._conn().execute(
+                'SELECT verdict, cached_at, expires_at FROM verdicts WHERE key = ? AND expires_at > ?',
+                (key, _format_timestamp(datetime.utcnow()))
+            ).fetchone()
+        except Exception as e:
+            print(f"Error reading cached verdict: {e}")
+            return None
+        if row is None:
+            return None
+        return {
+            'verdict': _decode_doc(row['verdict']),
+            'cached_at': datetime.strptime(row['cached_at'], TIMESTAMP_FORMAT),
+            'expires_at': datetime.strptime(row['expires_at'], TIMESTAMP_FORMAT)
+        }
+
+    def save_verdict(self, key, verdict, expires_at):
+        now = _format_timestamp(datetime.utcnow())
+        try:
+            conn = self._conn()
+            conn.execute('INSERT OR REPLACE INTO verdicts (key, verdict, cached_at, expires_at) VALUES (?, ?, ?, ?)',
+                         (key, _encode_doc(verdict), now, _format_timestamp(expires_at)))
+            # No TTL monitor here: drop expired verdicts as new ones arrive
+            conn.execute('DELETE FROM verdicts WHERE expires_at <= ?', (now,))
+        except Exception as e:
+            print(f"Error caching verdict: {e}")
+
+    def _load_ip_ranges(self, last_id):
+        """ip_range IOCs added after last_id, in id order"""
+        rows = self._conn().execute(
+            "SELECT * FROM iocs WHERE type = 'ip_range' AND id > ? ORDER BY id",
+            (-1 if last_id is None else last_id,)
+        )
+        return [self._to_doc(row) for row in rows]
+
+    def iter_canonical_sources(self):
+        """Yield (canonical, source) for every IOC"""
+        yield from self._conn().execute('SELECT canonical, source FROM iocs')
+
+    # Retention
+
+    def iter_expired(self, filter_query, before, limit=0):
+        """IOCs matching filter_query that no feed has listed since before, least recently seen first"""
+        where, params = self._where(filter_query)
+        cursor = self._select(f'{where} AND last_seen < ?', params + [_format_timestamp(before)],
+                              order='last_seen, id', limit=limit)
+        while True:
+            rows = cursor.fetchmany(INGEST_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield self._to_doc(row)
+
+    def delete_iocs(self, iocs, batch_size=None):
+        """Delete IOC documents by _id (tags and search entries follow); returns the number deleted"""
+        batch_size = min(batch_size or LOOKUP_BATCH_SIZE, LOOKUP_BATCH_SIZE)
+        conn = self._conn()
+        deleted = 0
+        removed = []
+        retired = 0
+        for start in range(0, len(iocs), batch_size):
+            batch = iocs[start:start + batch_size]
+            ids = [ioc['_id'] for ioc in batch]
+            try:
+                deleted += conn.execute(f"DELETE FROM iocs WHERE id IN ({','.join('?' * len(ids))})", ids).rowcount
+                removed.extend(batch)
+                # Indicators whose last source was just deleted
+                canonicals = list({ioc['canonical'] for ioc in batch if ioc.get('canonical')})
+                remaining = conn.execute(
+                    f"SELECT COUNT(DISTINCT canonical) FROM iocs WHERE canonical IN ({','.join('?' * len(canonicals))})",
+                    canonicals
+                ).fetchone()[0] if canonicals else 0
+                retired += len(canonicals) - remaining
+            except Exception as e:
+                print(f"Error deleting IOCs: {e}")
+        if deleted:
+            self._publish_change(self._next_generation(), removed, retired, sign=-1)
+        return deleted
+
+    # Statistics
+
+    def _group_counts(self, field, where='1', params=()):
+        rows = self._conn().execute(
+            f'SELECT {field} AS _id, COUNT(*) AS count FROM iocs WHERE {where} GROUP BY {field} ORDER BY count DESC',
+            params
+        )
+        return [{'_id': row['_id'], 'count': row['count']} for row in rows]
+
+    def check_query_plans(self):
+        """EXPLAIN QUERY PLAN for every hot query; a bare table SCAN is a full scan"""
+        conn = self._conn()
+        probes = list(QUERY_PROBES)
+        if self.has_fts:
+            probes.append(('search_iocs(substring)',
+                           'SELECT * FROM iocs WHERE id IN (SELECT rowid FROM iocs_fts WHERE iocs_fts MATCH ?)',
+                           ('"evil"',)))
+        else:
+            probes.append(('search_iocs(substring)', 'SELECT * FROM iocs WHERE instr(search_key, ?) > 0', ('evil',)))
+
+        results = []
+        for name, sql, params in probes:
+            stages = [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+            results.append({
+                'name': name,
+                'collection': 'iocs',
+                'stages': stages,
+                'collscan': any(stage.startswith('SCAN ') and ' USING ' not in stage
+                                and 'VIRTUAL TABLE' not in stage for stage in stages)
+            })
+        return results
+
+    def get_stats(self):
+        """Get statistics about IOCs"""
+        try:
+            indicators = self._conn().execute('SELECT COUNT(DISTINCT canonical) FROM iocs').fetchone()[0]
+            return {
+                'total': indicators,
+                'unique_indicators': indicators,
+                'listings': self.count_iocs(),
+                'by_type': self._group_counts('type'),
+                'by_source': self._group_counts('source')
+            }
+        except Exception as e:
+            print(f"Error getting stats: {e}")
+            return {'total': 0, 'by_type': [], 'by_source': []}
+
+    def get_threat_level_stats(self):
+        """Get statistics by threat level"""
+        try:
+            return self._group_counts('threat_level', 'threat_level IS NOT NULL')
+        except Exception as e:
+            print(f"Error getting threat level stats: {e}")
+            return []
+
+    def get_trends(self, days=7):
+        """Get IOC trends over time"""
+        try:
+            start = _format_timestamp(datetime.utcnow() - timedelta(days=days))[:10]
+            rows = self._conn().execute(
+                'SELECT substr(timestamp, 1, 10) AS day, type, COUNT(*) AS count FROM iocs '
+                'WHERE timestamp >= ? GROUP BY day, type ORDER BY day',
+                (start,)
+            )
+            trends = {}
+            for row in rows:
+                trends.setdefault(row['day'], {})[row['type']] = row['count']
+            return trends
+        except Exception as e:
+            print(f"Error getting trends: {e}")
+            return {}
+
+    def reconcile_stats(self):
+        """
+        Statistics are aggregated from the indexes on read, so there is no
+        rollup to rebuild; returns the current totals in rollup shape.
+        """
+        try:
+            stats = self.get_stats()
+            return {
+                'total': stats['listings'],
+                'by_type': {item['_id']: item['count'] for item in stats['by_type']},
+                'by_source': {item['_id']: item['count'] for item in stats['by_source']}
+            }
+        except Exception as e:
+            print(f"Error reconciling stats: {e}")
+            return None
+
+    def rebuild_trend_buckets(self):
+        """Trends are aggregated on read; returns the number of days with IOCs"""
+        try:
+            return self._conn().execute(
+                'SELECT COUNT(DISTINCT substr(timestamp, 1, 10)) FROM iocs WHERE timestamp IS NOT NULL'
+            ).fetchone()[0]
+        except Exception as e:
+            print(f"Error rebuilding trend buckets: {e}")
+            return None
+
+    # Tags
+
+    def _set_tags(self, ioc_id, tag, add):
+        """Add or remove a tag in both ioc_tags and the stored document"""
+        conn = self._conn()
+        ioc_id = _row_id(ioc_id)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if add:
+                changed = conn.execute('INSERT OR IGNORE INTO ioc_tags (ioc_id, tag) VALUES (?, ?)', (ioc_id, tag)).rowcount
+            else:
+                changed = conn.execute('DELETE FROM ioc_tags WHERE ioc_id = ? AND tag = ?', (ioc_id, tag)).rowcount
+            if changed:
+                row = conn.execute('SELECT doc FROM iocs WHERE id = ?', (ioc_id,)).fetchone()
+                extra = _decode_doc(row['doc'])
+                tags = [t for t in extra.get('tags', []) if t != tag]
+                if add:
+                    tags.append(tag)
+                extra['tags'] = tags
+                conn.execute('UPDATE iocs SET doc = ? WHERE id = ?', (_encode_doc(extra), ioc_id))
+            conn.execute('COMMIT')
+            if changed:
+                self.bump_generation('tags')
+            return changed > 0
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def add_tag_to_ioc(self, ioc_id, tag):
+        """Add a tag to an IOC"""
+        try:
+            return self._set_tags(ioc_id, tag, add=True)
+        except Exception as e:
+            print(f"Error adding tag: {e}")
+            return False
+
+    def remove_tag_from_ioc(self, ioc_id, tag):
+        """Remove a tag from an IOC"""
+        try:
+            return self._set_tags(ioc_id, tag, add=False)
+        except Exception as e:
+            print(f"Error removing tag: {e}")
+            return False
+
+    def get_iocs_by_tag(self, tag, fields=None):
+        """Get all IOCs with a specific tag"""
+        try:
+            rows = self._conn().execute(
+                'SELECT iocs.* FROM ioc_tags JOIN iocs ON iocs.id = ioc_tags.ioc_id '
+                'WHERE ioc_tags.tag = ? ORDER BY iocs.timestamp DESC, iocs.id DESC',
+                (tag,)
+            )
+            return [self._to_doc(row, fields) for row in rows]
+        except Exception as e:
+            print(f"Error getting IOCs by tag: {e}")
+            return []
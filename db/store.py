@@ -0,0 +1,29 @@
+"""
+Storage backend selection for CTI Dashboard
+
+STORAGE_BACKEND picks the IOCStore implementation behind the shared
+`db_manager`:
+  mongo   - MongoDB server at MONGO_URI (default)
+  sqlite  - embedded SQLite database at SQLITE_PATH
+"""
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongo').lower()
+
+
+def create_store(backend=STORAGE_BACKEND):
+    """Instantiate the storage backend named by backend"""
+    if backend == 'mongo':
+        from db.mongo import MongoDBManager
+        return MongoDBManager()
+    if backend == 'sqlite':
+        from db.sqlite_store import SQLiteStore
+        return SQLiteStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected 'mongo' or 'sqlite')")
+
+
+# Singleton instance
+db_manager = create_store()
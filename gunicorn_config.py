@@ -8,7 +8,12 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
-worker_class = 'sync'
+# gthread: each worker serves GUNICORN_THREADS requests at once, so slow
+# outbound calls (VirusTotal lookups, /api/stream) do not block the dashboard.
+# Keep threads above VT_MAX_CONCURRENT so lookups never take every thread.
+# gevent (pip install gevent) is also supported; sync serves one at a time.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
 worker_connections = 1000
 timeout = 120
 keepalive = 5
@@ -37,6 +42,14 @@ tmp_upload_dir = None
 # Preload application
 preload_app = True
 
+
+def post_fork(server, worker):
+    """Give each worker its own database client; clients are not fork-safe"""
+    from db.store import db_manager
+    db_manager.reset_after_fork()
+    if not db_manager.connect():
+        server.log.warning(f"Worker {worker.pid}: database connection failed, will retry on demand")
+
 # Restart workers
 max_requests = 1000
 max_requests_jitter = 50
@@ -6,7 +6,8 @@ from datetime import datetime
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from db.mongo import db_manager
+from db.store import db_manager
+from db.normalize import normalize_ioc
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -46,7 +47,7 @@ def fetch_abuseipdb_iocs():
                     'country': item.get('countryCode', 'Unknown'),
                     'timestamp': datetime.utcnow()
                 }
-                iocs.append(ioc)
+                iocs.append(normalize_ioc(ioc))
             
             return iocs
         elif response.status_code == 401:
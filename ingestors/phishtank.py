@@ -6,7 +6,8 @@ from datetime import datetime
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from db.mongo import db_manager
+from db.store import db_manager
+from db.normalize import normalize_ioc
 
 def fetch_phishtank_iocs():
     """Fetch phishing URLs from PhishTank"""
@@ -30,7 +31,7 @@ def fetch_phishtank_iocs():
                     'target': item.get('target', 'Unknown'),
                     'timestamp': datetime.utcnow()
                 }
-                iocs.append(ioc)
+                iocs.append(normalize_ioc(ioc))
             
             return iocs
         else:
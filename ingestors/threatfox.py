@@ -6,7 +6,8 @@ from datetime import datetime
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from db.mongo import db_manager
+from db.store import db_manager
+from db.normalize import normalize_ioc
 
 def fetch_threatfox_iocs():
     """Fetch IOCs from ThreatFox API"""
@@ -37,7 +38,7 @@ def fetch_threatfox_iocs():
                         'confidence': item.get('confidence_level', 0),
                         'timestamp': datetime.utcnow()
                     }
-                    iocs.append(ioc)
+                    iocs.append(normalize_ioc(ioc))
                 
                 return iocs
             else:
@@ -0,0 +1,105 @@
+"""
+Verdict cache for VirusTotal lookups
+
+The free VirusTotal quota is a handful of requests a minute, so verdicts
+are cached by indicator type and canonical value. Each process keeps an
+LRU of recent verdicts in front of the IOC store (a `verdicts` collection
+with a TTL index on MongoDB, a `verdicts` table on SQLite), which every
+worker shares and which survives restarts.
+
+How long a verdict is kept depends on the verdict: settled answers
+(Clean, Critical) longest, the ones in between for a day, and 404s and
+failed requests only briefly, so quota is not spent re-asking about an
+unknown indicator yet a new one is still picked up soon.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Days a verdict is cached, by threat level
+VERDICT_TTL_DAYS = {
+    'Clean': 7,
+    'Low': 1,
+    'Medium': 1,
+    'High': 1,
+    'Critical': 7
+}
+
+# Seconds to cache "not found" answers and failed lookups
+VT_NOT_FOUND_TTL = int(os.getenv('VT_NOT_FOUND_TTL', 3600))
+VT_ERROR_TTL = int(os.getenv('VT_ERROR_TTL', 300))
+
+# Verdicts kept in each process's LRU
+VT_CACHE_SIZE = int(os.getenv('VT_CACHE_SIZE', 1024))
+
+
+def verdict_ttl(verdict, status):
+    """Seconds to cache a verdict returned with an HTTP status (None if the request failed)"""
+    if status == 404:
+        return VT_NOT_FOUND_TTL
+    if 'error' in verdict:
+        return VT_ERROR_TTL
+    return VERDICT_TTL_DAYS.get(verdict.get('threat_level'), 1) * 86400
+
+
+class VerdictCache:
+    """Per-process LRU in front of the store's verdict cache"""
+
+    def __init__(self, store=None, size=VT_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _shared(self):
+        """The store, when it is available"""
+        if self.store is not None and self.store.is_connected():
+            return self.store
+        return None
+
+    def get(self, ioc_type, canonical):
+        """Cached verdict with a cache-status field, or None"""
+        key = f'{ioc_type}:{canonical}'
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires_at'] <= now:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+        if entry:
+            return _with_status(entry, 'hit', 'memory')
+
+        store = self._shared()
+        entry = store.get_verdict(key) if store else None
+        if not entry:
+            return None
+        self._remember(key, entry)
+        return _with_status(entry, 'hit', 'store')
+
+    def put(self, ioc_type, canonical, verdict, ttl):
+        """Cache a fresh verdict; returns it with a cache-status field"""
+        key = f'{ioc_type}:{canonical}'
+        now = datetime.utcnow()
+        entry = {'verdict': verdict, 'cached_at': now, 'expires_at': now + timedelta(seconds=ttl)}
+        self._remember(key, entry)
+        store = self._shared()
+        if store:
+            store.save_verdict(key, verdict, entry['expires_at'])
+        return _with_status(entry, 'miss')
+
+
+def _with_status(entry, status, layer=None):
+    cache = {'status': status, 'cached_at': entry['cached_at'], 'expires_at': entry['expires_at']}
+    if layer:
+        cache['layer'] = layer
+    return {**entry['verdict'], 'cache': cache}
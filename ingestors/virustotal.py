@@ -1,133 +1,147 @@
 """VirusTotal API Integration for Threat Lookup"""
+import base64
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import requests
 from dotenv import load_dotenv
+from db.normalize import canonicalize
+from db.store import db_manager
+from ingestors.verdict_cache import VerdictCache, verdict_ttl
 
 load_dotenv()
 
+# Seconds before an unanswered VirusTotal request is abandoned
+VT_TIMEOUT = float(os.getenv('VT_TIMEOUT', 10))
+
+# VirusTotal requests in flight per process; lookups beyond it fail fast
+# instead of queueing behind slow API calls
+VT_MAX_CONCURRENT = int(os.getenv('VT_MAX_CONCURRENT', 4))
+
+# API collection for each indicator type
+ENDPOINTS = {
+    'ip': 'ip_addresses',
+    'domain': 'domains',
+    'url': 'urls',
+    'hash': 'files'
+}
+
 class VirusTotalChecker:
     """VirusTotal API client for threat verification"""
     
     def __init__(self):
         self.api_key = os.getenv('VIRUSTOTAL_API_KEY', '')
-        self.base_url = 'https://www.virustotal.com/api/v3'
+        self.base_url = os.getenv('VIRUSTOTAL_BASE_URL', 'https://www.virustotal.com/api/v3')
         self.headers = {'x-apikey': self.api_key} if self.api_key else {}
+        self._session = requests.Session()
+        self._slots = threading.BoundedSemaphore(VT_MAX_CONCURRENT)
+        self._executor = ThreadPoolExecutor(max_workers=VT_MAX_CONCURRENT, thread_name_prefix='virustotal')
+        self.cache = VerdictCache(db_manager)
     
-    def check_ip(self, ip_address):
-        """Check IP address reputation"""
-        if not self.api_key:
-            return {'error': 'VirusTotal API key not configured'}
+    def check(self, ioc_type, value):
+        """Check an indicator of any supported type; {} for other types"""
+        checks = {
+            'ip': self.check_ip,
+            'domain': self.check_domain,
+            'url': self.check_url,
+            'hash': self.check_hash
+        }
+        return checks[ioc_type](value) if ioc_type in checks else {}
+    
+    def submit(self, ioc_type, value):
+        """
+        Start a check in the background and return a Future of its result,
+        so callers can do local work while VirusTotal answers. When
+        VT_MAX_CONCURRENT checks are already in flight the Future is
+        completed at once with an error rather than queued; cached
+        verdicts are returned at once either way.
+        """
+        future = Future()
+        if not self.api_key or ioc_type not in ENDPOINTS:
+            future.set_result(self.check(ioc_type, value))
+            return future
+        # Cached verdicts need no slot
+        cached = self.cache.get(ioc_type, canonicalize(value, ioc_type))
+        if cached:
+            future.set_result(cached)
+            return future
+        if not self._slots.acquire(blocking=False):
+            future.set_result({'error': 'VirusTotal lookup limit reached, try again shortly', 'busy': True})
+            return future
         
+        def run():
+            try:
+                return self.check(ioc_type, value)
+            finally:
+                self._slots.release()
+        return self._executor.submit(run)
+    
+    def result(self, future):
+        """Result of a submitted check, or an error if VirusTotal is too slow"""
         try:
-            url = f'{self.base_url}/ip_addresses/{ip_address}'
-            response = requests.get(url, headers=self.headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                stats = data.get('data', {}).get('attributes', {}).get('last_analysis_stats', {})
-                
-                return {
-                    'ip': ip_address,
-                    'malicious': stats.get('malicious', 0),
-                    'suspicious': stats.get('suspicious', 0),
-                    'harmless': stats.get('harmless', 0),
-                    'undetected': stats.get('undetected', 0),
-                    'threat_level': self._calculate_threat_level(stats),
-                    'source': 'VirusTotal'
-                }
-            else:
-                return {'error': f'API returned status {response.status_code}'}
-                
+            return future.result(timeout=VT_TIMEOUT)
+        except FutureTimeoutError:
+            return {'error': 'VirusTotal lookup timed out'}
         except Exception as e:
             return {'error': str(e)}
     
+    def check_ip(self, ip_address):
+        """Check IP address reputation"""
+        return self._check('ip', ip_address)
+    
     def check_domain(self, domain):
         """Check domain reputation"""
-        if not self.api_key:
-            return {'error': 'VirusTotal API key not configured'}
-        
-        try:
-            url = f'{self.base_url}/domains/{domain}'
-            response = requests.get(url, headers=self.headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                stats = data.get('data', {}).get('attributes', {}).get('last_analysis_stats', {})
-                
-                return {
-                    'domain': domain,
-                    'malicious': stats.get('malicious', 0),
-                    'suspicious': stats.get('suspicious', 0),
-                    'harmless': stats.get('harmless', 0),
-                    'undetected': stats.get('undetected', 0),
-                    'threat_level': self._calculate_threat_level(stats),
-                    'source': 'VirusTotal'
-                }
-            else:
-                return {'error': f'API returned status {response.status_code}'}
-                
-        except Exception as e:
-            return {'error': str(e)}
+        return self._check('domain', domain)
     
     def check_url(self, url):
         """Check URL reputation"""
-        if not self.api_key:
-            return {'error': 'VirusTotal API key not configured'}
-        
-        try:
-            import base64
-            # URL needs to be base64 encoded without padding
-            url_id = base64.urlsafe_b64encode(url.encode()).decode().strip("=")
-            
-            api_url = f'{self.base_url}/urls/{url_id}'
-            response = requests.get(api_url, headers=self.headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                stats = data.get('data', {}).get('attributes', {}).get('last_analysis_stats', {})
-                
-                return {
-                    'url': url,
-                    'malicious': stats.get('malicious', 0),
-                    'suspicious': stats.get('suspicious', 0),
-                    'harmless': stats.get('harmless', 0),
-                    'undetected': stats.get('undetected', 0),
-                    'threat_level': self._calculate_threat_level(stats),
-                    'source': 'VirusTotal'
-                }
-            else:
-                return {'error': f'API returned status {response.status_code}'}
-                
-        except Exception as e:
-            return {'error': str(e)}
+        return self._check('url', url)
     
     def check_hash(self, file_hash):
         """Check file hash reputation"""
+        return self._check('hash', file_hash)
+    
+    def _check(self, ioc_type, value):
+        """Cached verdict for an indicator, querying the API on a miss"""
         if not self.api_key:
             return {'error': 'VirusTotal API key not configured'}
         
+        canonical = canonicalize(value, ioc_type)
+        cached = self.cache.get(ioc_type, canonical)
+        if cached:
+            return cached
+        verdict, status = self._query(ioc_type, canonical)
+        return self.cache.put(ioc_type, canonical, verdict, verdict_ttl(verdict, status))
+    
+    def _query(self, ioc_type, value):
+        """(verdict, HTTP status) from the API; status is None if the request failed"""
         try:
-            url = f'{self.base_url}/files/{file_hash}'
-            response = requests.get(url, headers=self.headers, timeout=10)
+            if ioc_type == 'url':
+                # URL needs to be base64 encoded without padding
+                object_id = base64.urlsafe_b64encode(value.encode()).decode().strip("=")
+            else:
+                object_id = value
+            url = f'{self.base_url}/{ENDPOINTS[ioc_type]}/{object_id}'
+            response = self._session.get(url, headers=self.headers, timeout=VT_TIMEOUT)
             
             if response.status_code == 200:
                 data = response.json()
                 stats = data.get('data', {}).get('attributes', {}).get('last_analysis_stats', {})
                 
                 return {
-                    'hash': file_hash,
+                    ioc_type: value,
                     'malicious': stats.get('malicious', 0),
                     'suspicious': stats.get('suspicious', 0),
                     'harmless': stats.get('harmless', 0),
                     'undetected': stats.get('undetected', 0),
                     'threat_level': self._calculate_threat_level(stats),
                     'source': 'VirusTotal'
-                }
+                }, response.status_code
             else:
-                return {'error': f'API returned status {response.status_code}'}
+                return {'error': f'API returned status {response.status_code}'}, response.status_code
                 
         except Exception as e:
-            return {'error': str(e)}
+            return {'error': str(e)}, None
     
     def _calculate_threat_level(self, stats):
         """Calculate threat level based on detection stats"""
@@ -0,0 +1,156 @@
+"""
+Maintenance commands for CTI Dashboard
+Usage: python manage.py <command>
+"""
+import argparse
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.store import db_manager
+from db.retention import apply_retention, cold_archive
+
+
+def reconcile_stats(args):
+    """Rebuild the stats rollup from the iocs collection"""
+    rollup = db_manager.reconcile_stats()
+    if rollup is None:
+        print("❌ Stats reconciliation failed")
+        return 1
+    print(f"✅ Stats rollup rebuilt - Total: {rollup['total']}")
+    return 0
+
+
+def backfill_trends(args):
+    """Rebuild the daily trend buckets from the iocs collection"""
+    written = db_manager.rebuild_trend_buckets()
+    if written is None:
+        print("❌ Trend bucket backfill failed")
+        return 1
+    print(f"✅ Rebuilt {written} daily trend buckets")
+    return 0
+
+
+def backfill_search(args):
+    """Populate search fields on IOCs ingested before the search indexes"""
+    updated = db_manager.backfill_search_fields()
+    if updated is None:
+        print("❌ Search field backfill failed")
+        return 1
+    print(f"✅ Added search fields to {updated} IOCs")
+    return 0
+
+
+def backfill_canonical(args):
+    """Populate the canonical field on IOCs ingested before normalization"""
+    result = db_manager.backfill_canonical()
+    if result is None:
+        print("❌ Canonical backfill failed")
+        return 1
+    updated, duplicates = result
+    print(f"✅ Canonicalized {updated} IOCs")
+    if duplicates:
+        print(f"⚠️  {duplicates} IOCs duplicate an existing canonical IOC from the same source")
+    return 0
+
+
+def consolidate_indicators(args):
+    """Rebuild consolidated per-indicator documents from the per-feed IOCs"""
+    result = db_manager.consolidate_indicators()
+    if result is None:
+        print("❌ Indicator consolidation failed")
+        return 1
+    indicators, skipped = result
+    print(f"✅ Consolidated {indicators} indicators")
+    if skipped:
+        print(f"⚠️  Skipped {skipped} IOCs without a canonical value - run backfill-canonical first")
+    return 0
+
+
+def publish_snapshot(args):
+    """Publish the memory-mapped IOC snapshot read by web workers"""
+    result = db_manager.publish_snapshot()
+    if result is None:
+        print("❌ Snapshot publish failed")
+        return 1
+    version, count = result
+    print(f"✅ Published snapshot {version} with {count} IOC keys")
+    return 0
+
+
+def apply_retention_command(args):
+    """Archive and delete IOCs older than their retention policy"""
+    try:
+        summary = apply_retention(db_manager, cold_archive)
+    except Exception as e:
+        print(f"❌ Retention failed: {e}")
+        return 1
+    for pair in summary['by_pair']:
+        print(f"   {pair['source']} / {pair['type']} (> {pair['days']} days): {pair['expired']}")
+    print(f"✅ Archived {summary['archived']} IOCs in {summary['segments']} segments, "
+          f"deleted {summary['deleted']}")
+    if summary['undeleted']:
+        print(f"❌ Stopped: {summary['undeleted']} archived IOCs could not be deleted")
+        return 1
+    return 0
+
+
+def migrate_indexes(args):
+    """Apply pending versioned index migrations"""
+    version, errors = db_manager.migrate_indexes()
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        return 1
+    print(f"✅ Indexes at version {version}")
+    return 0
+
+
+def check_indexes(args):
+    """Explain every hot query; fails if any falls back to a collection scan"""
+    results = db_manager.check_query_plans()
+    failed = [result for result in results if result['collscan']]
+    for result in results:
+        marker = '❌' if result['collscan'] else '✅'
+        print(f"{marker} {result['name']}: {' > '.join(result['stages'])}")
+    if failed:
+        print(f"❌ {len(failed)} of {len(results)} hot queries scan the whole collection - run migrate-indexes")
+        return 1
+    print(f"✅ All {len(results)} hot queries use an index")
+    return 0
+
+
+COMMANDS = {
+    'reconcile-stats': reconcile_stats,
+    'backfill-trends': backfill_trends,
+    'backfill-search': backfill_search,
+    'backfill-canonical': backfill_canonical,
+    'consolidate-indicators': consolidate_indicators,
+    'publish-snapshot': publish_snapshot,
+    'apply-retention': apply_retention_command,
+    'migrate-indexes': migrate_indexes,
+    'check-indexes': check_indexes,
+}
+
+
+def main():
+    """Parse arguments and run the selected command"""
+    parser = argparse.ArgumentParser(description='CTI Dashboard maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, command in COMMANDS.items():
+        subparsers.add_parser(name, help=command.__doc__)
+    args = parser.parse_args()
+    
+    if not db_manager.connect():
+        print("❌ Failed to connect to database")
+        return 1
+    
+    try:
+        return COMMANDS[args.command](args)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
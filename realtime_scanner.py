@@ -12,7 +12,8 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from ingestors import threatfox, phishtank, spamhaus, otx, abuseipdb
-from db.mongo import db_manager
+from db.store import db_manager
+from db.retention import apply_retention, cold_archive
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +21,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How often the stats rollup is rebuilt from the iocs collection
+STATS_RECONCILE_HOURS = int(os.getenv('STATS_RECONCILE_HOURS', 6))
+
+# How often expired IOCs are archived and removed
+RETENTION_HOURS = int(os.getenv('RETENTION_HOURS', 24))
+
 def fetch_all_iocs():
     """Fetch IOCs from all sources"""
     logger.info("="*70)
@@ -27,7 +34,7 @@ def fetch_all_iocs():
     logger.info("="*70)
     
     # Connect to database
-    if not db_manager.client:
+    if not db_manager.is_connected():
         db_manager.connect()
     
     total_new = 0
@@ -82,6 +89,11 @@ def fetch_all_iocs():
     except Exception as e:
         logger.error(f"❌ AbuseIPDB error: {e}")
     
+    # Publish the shared lookup snapshot for web workers
+    snapshot = db_manager.publish_snapshot()
+    if snapshot:
+        logger.info(f"🗂️  Published IOC snapshot {snapshot[0]} ({snapshot[1]} keys)")
+    
     # Get total IOCs
     stats = db_manager.get_stats()
     total_iocs = stats.get('total', 0)
@@ -91,6 +103,25 @@ def fetch_all_iocs():
     logger.info(f"⏰ Next scan in 30 minutes")
     logger.info("="*70)
 
+def reconcile_stats():
+    """Correct any drift in the incrementally maintained stats rollup"""
+    logger.info("🧮 Reconciling stats rollup...")
+    if db_manager.reconcile_stats() is not None:
+        logger.info("✅ Stats rollup reconciled")
+    else:
+        logger.error("❌ Stats rollup reconciliation failed")
+
+def run_retention():
+    """Move IOCs past their retention period to the cold archive"""
+    logger.info("🗄️  Applying IOC retention...")
+    try:
+        summary = apply_retention(db_manager, cold_archive)
+        logger.info(f"✅ Archived {summary['archived']} IOCs, deleted {summary['deleted']}")
+        if summary['undeleted']:
+            logger.error(f"❌ Retention stopped: {summary['undeleted']} archived IOCs could not be deleted")
+    except Exception as e:
+        logger.error(f"❌ Retention failed: {e}")
+
 def run_scheduler():
     """Run the scheduler"""
     logger.info("🚀 Real-Time IOC Scanner Starting...")
@@ -102,6 +133,8 @@ def run_scheduler():
     
     # Schedule to run every 30 minutes
     schedule.every(30).minutes.do(fetch_all_iocs)
+    schedule.every(STATS_RECONCILE_HOURS).hours.do(reconcile_stats)
+    schedule.every(RETENTION_HOURS).hours.do(run_retention)
     
     # Keep running
     while True:
@@ -18,7 +18,7 @@ set FLASK_ENV=production
 
 REM Check MongoDB connection
 echo Checking MongoDB connection...
-python -c "from db.mongo import db_manager; exit(0 if db_manager.connect() else 1)"
+python -c "from db.store import db_manager; exit(0 if db_manager.connect() else 1)"
 if errorlevel 1 (
     echo MongoDB connection failed
     exit /b 1
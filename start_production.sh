@@ -21,7 +21,7 @@ export FLASK_ENV=production
 
 # Check MongoDB connection
 echo "🔍 Checking MongoDB connection..."
-python -c "from db.mongo import db_manager; exit(0 if db_manager.connect() else 1)"
+python -c "from db.store import db_manager; exit(0 if db_manager.connect() else 1)"
 if [ $? -ne 0 ]; then
     echo "❌ MongoDB connection failed"
     exit 1
@@ -0,0 +1,13 @@
+"""Single-pass encoder matches the parse_json + jsonify bytes"""
+import json
+from datetime import datetime
+from bson import json_util
+from bson.objectid import ObjectId
+from web.encoding import dumps
+
+
+def test_dumps_matches_sorted_jsonify_output():
+    doc = {'value': 'evil.com', '_id': ObjectId(), 'type': 'domain',
+           'timestamp': datetime(2024, 5, 1, 12, 30, 0, 250000), 'tags': ['b', 'a']}
+    jsonified = json.dumps(json.loads(json_util.dumps([doc])), separators=(',', ':'), sort_keys=True)
+    assert dumps([doc]) == jsonified
@@ -0,0 +1,62 @@
+"""Change events: one per ingest generation"""
+import pytest
+from db.sqlite_store import SQLiteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cti.db'))
+    assert store.connect()
+    return store
+
+
+def events(store, after=0):
+    return [event for event in store.iter_events(after=after, timeout=0.2) if event is not None]
+
+
+def test_every_generation_has_an_event(store):
+    ioc = {'value': 'evil.com', 'type': 'domain', 'source': 'ThreatFox'}
+    start = store.ingest_generation()
+    store.bulk_upsert_iocs([ioc])
+    # Re-listed only: sightings change, no IOCs are added
+    store.bulk_upsert_iocs([ioc])
+    stored = store.get_all_iocs(limit=1)[0]
+    store.add_tag_to_ioc(stored['_id'], 'phishing')
+    store.delete_iocs([stored])
+
+    published = events(store, after=start)
+    assert [event['generation'] for event in published] == list(range(start + 1, store.ingest_generation() + 1))
+    assert [event['type'] for event in published] == ['iocs', 'changed', 'changed', 'removed']
+    assert [event.get('reason') for event in published[1:3]] == ['sightings', 'tags']
+
+
+def test_changed_event_has_empty_delta(store):
+    generation = store.bump_generation('stats')
+    event, = events(store, after=generation - 1)
+    assert event['generation'] == generation
+    assert event['reason'] == 'stats'
+    assert event['count'] == 0
+    assert event['delta'] == {'total': 0, 'listings': 0, 'by_type': {}, 'by_source': {}}
+    assert 'iocs' not in event
+
+
+def test_streams_above_the_worker_limit_get_503(store, monkeypatch):
+    import threading
+    from flask import Flask
+    from web import stream
+
+    monkeypatch.setattr(stream, '_stream_slots', threading.BoundedSemaphore(1))
+    app = Flask(__name__)
+    app.add_url_rule('/api/stream', 'stream', lambda: stream.event_stream_response(store))
+    client = app.test_client()
+
+    first = client.get('/api/stream')
+    assert first.status_code == 200
+    refused = client.get('/api/stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == str(stream.STREAM_RETRY_MS // 1000)
+
+    first.close()
+    second = client.get('/api/stream')
+    assert second.status_code == 200
+    second.close()
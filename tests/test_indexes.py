@@ -0,0 +1,52 @@
+"""Versioned index migrations (db/indexes.py) on mongomock"""
+import pytest
+from db.indexes import LATEST_VERSION, apply_migrations, applied_version, failed_indexes
+
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient()['cti_test']
+
+
+def index_keys(collection):
+    return [tuple(key for key, _ in info['key']) for info in collection.index_information().values()]
+
+
+def test_failed_index_does_not_stop_later_migrations(db):
+    # Duplicates make the unique (canonical, source) index of migration 1 fail
+    db['iocs'].insert_many([
+        {'value': 'evil.com', 'canonical': 'evil.com', 'source': 'ThreatFox'},
+        {'value': 'EVIL.com', 'canonical': 'evil.com', 'source': 'ThreatFox'}
+    ])
+    version, errors = apply_migrations(db)
+
+    assert version == LATEST_VERSION
+    assert applied_version(db) == LATEST_VERSION
+    assert len(errors) == 1
+    assert [failure['version'] for failure in failed_indexes(db)] == [1]
+    assert ('tags', 'timestamp', '_id') in index_keys(db['iocs'])
+    assert ('expires_at',) in index_keys(db['verdicts'])
+
+
+def test_retry_clears_fixed_failures(db):
+    db['iocs'].insert_many([
+        {'value': 'evil.com', 'canonical': 'evil.com', 'source': 'ThreatFox'},
+        {'value': 'EVIL.com', 'canonical': 'evil.com', 'source': 'ThreatFox'}
+    ])
+    apply_migrations(db)
+    db['iocs'].delete_one({'value': 'EVIL.com'})
+
+    # Without retry_failed nothing is pending
+    assert apply_migrations(db) == (LATEST_VERSION, [])
+    assert failed_indexes(db)
+
+    assert apply_migrations(db, retry_failed=True) == (LATEST_VERSION, [])
+    assert failed_indexes(db) == []
+    assert ('canonical', 'source') in index_keys(db['iocs'])
+
+
+def test_no_value_source_unique_index(db):
+    db['iocs'].create_index([('value', 1), ('source', 1)], unique=True, name='value_source_unique')
+    apply_migrations(db)
+    assert 'value_source_unique' not in db['iocs'].index_information()
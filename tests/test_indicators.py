@@ -0,0 +1,108 @@
+"""
+Consolidated indicators (db/indicators.py) in the MongoDB backend
+
+upsert_pipeline() and remove_source_pipeline() are update pipelines,
+which mongomock cannot run: those tests need a real mongod. Set
+MONGO_TEST_URI (e.g. mongodb://localhost:27017/); each run uses and then
+drops its own cti_test_<uuid> database.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+MONGO_TEST_URI = os.getenv('MONGO_TEST_URI') or os.getenv('MONGO_TEST_REPLICA_SET_URI')
+
+
+@pytest.fixture
+def store(monkeypatch):
+    if not MONGO_TEST_URI:
+        pytest.skip('MONGO_TEST_URI not set')
+    monkeypatch.setenv('MONGO_URI', MONGO_TEST_URI)
+    import db.mongo as mongo
+    store = mongo.MongoDBManager(db_name=f'cti_test_{uuid.uuid4().hex}')
+    assert store.connect()
+    if store._index_thread:
+        store._index_thread.join()
+    yield store
+    store.client.drop_database(store.db_name)
+    store.close()
+
+
+def feed_ioc(source, timestamp):
+    return {'value': 'evil.com', 'type': 'domain', 'source': source, 'timestamp': timestamp, 'confidence': 80}
+
+
+def test_sightings_merge_per_source(store):
+    first = datetime(2025, 1, 1)
+    store.bulk_upsert_iocs([feed_ioc('ThreatFox', first)])
+    store.bulk_upsert_iocs([feed_ioc('OTX', first + timedelta(days=1))])
+    # ThreatFox lists it again later
+    store.bulk_upsert_iocs([feed_ioc('ThreatFox', first + timedelta(days=2))])
+
+    indicator = store.find_indicator('evil.com')
+    assert '_previous' not in indicator
+    assert sorted(indicator['sources']) == ['OTX', 'ThreatFox']
+    assert indicator['sighting_count'] == 2
+    assert indicator['first_seen'] == first
+    assert indicator['last_seen'] == first + timedelta(days=2)
+    threatfox, = [entry for entry in indicator['sightings'] if entry['source'] == 'ThreatFox']
+    assert threatfox['first_seen'] == first
+    assert threatfox['last_seen'] == first + timedelta(days=2)
+
+    stats = store.get_stats()
+    assert stats['total'] == 1
+    assert stats['listings'] == 2
+
+
+def test_deleting_last_source_removes_indicator(store):
+    store.bulk_upsert_iocs([feed_ioc('ThreatFox', datetime(2025, 1, 1)), feed_ioc('OTX', datetime(2025, 1, 2))])
+    iocs = {ioc['source']: ioc for ioc in store.collection.find({'canonical': 'evil.com'})}
+
+    store.delete_iocs([iocs['ThreatFox']])
+    indicator = store.find_indicator('evil.com')
+    assert indicator['sources'] == ['OTX']
+    assert indicator['first_seen'] == datetime(2025, 1, 2)
+
+    store.delete_iocs([iocs['OTX']])
+    assert store.find_indicator('evil.com') is None
+    assert store.get_stats()['total'] == 0
+
+
+# Stats before consolidation (no update pipelines involved)
+
+@pytest.fixture
+def mock_store(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import db.mongo as mongo
+    monkeypatch.setattr(mongo.MongoDBManager, '_ensure_events_collection', lambda self: None)
+    monkeypatch.setattr(mongo.MongoDBManager, '_record_sightings', lambda self, iocs: len(iocs))
+    client = mongomock.MongoClient()
+    store = mongo.MongoDBManager()
+    store._create_client = lambda: client
+    return store
+
+
+def test_total_falls_back_to_listings_until_consolidated(mock_store):
+    # A deployment that predates indicators: listings but no indicator documents
+    mock_store.client[mock_store.db_name]['iocs'].insert_many([
+        {'value': 'evil.com', 'canonical': 'evil.com', 'type': 'domain', 'source': 'ThreatFox'},
+        {'value': 'evil.com', 'canonical': 'evil.com', 'type': 'domain', 'source': 'OTX'}
+    ])
+    assert mock_store.connect()
+    mock_store._index_thread.join()
+    # Ingest after the upgrade has created an indicator for one of them
+    mock_store.indicators_collection.insert_one({'_id': 'evil.com', 'canonical': 'evil.com'})
+    stats = mock_store.get_stats()
+    assert stats['total'] == stats['listings'] == 2
+
+    assert mock_store.consolidate_indicators() == (1, 0)
+    stats = mock_store.get_stats()
+    assert (stats['total'], stats['listings']) == (1, 2)
+
+
+def test_new_deployment_counts_indicators(mock_store):
+    assert mock_store.connect()
+    mock_store._index_thread.join()
+    assert mock_store._indicators_consolidated()
@@ -0,0 +1,44 @@
+"""Retention expires on last_seen and stops when deletes fail"""
+from datetime import datetime, timedelta
+import pytest
+import db.retention as retention
+from db.retention import ColdArchive, apply_retention
+from db.sqlite_store import SQLiteStore, TIMESTAMP_FORMAT
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cti.db'))
+    assert store.connect()
+    return store
+
+
+def age(store, days):
+    """Move every IOC's last_seen back by days"""
+    seen = (datetime.utcnow() - timedelta(days=days)).strftime(TIMESTAMP_FORMAT)
+    store._conn().execute('UPDATE iocs SET last_seen = ?', (seen,))
+
+
+def test_relisted_iocs_are_kept(store, tmp_path):
+    first_listed = datetime.utcnow() - timedelta(days=100)
+    iocs = [{'value': ip, 'type': 'ip', 'source': 'AbuseIPDB', 'timestamp': first_listed}
+            for ip in ('1.2.3.4', '5.6.7.8')]
+    store.bulk_upsert_iocs(iocs)
+    age(store, 40)
+    # The feed still lists 1.2.3.4
+    store.bulk_upsert_iocs(iocs[:1])
+
+    summary = apply_retention(store, ColdArchive(str(tmp_path / 'archive')))
+    assert summary['deleted'] == 1
+    assert [ioc['value'] for ioc in store.get_all_iocs()] == ['1.2.3.4']
+
+
+def test_failed_delete_stops_the_run(store, tmp_path, monkeypatch):
+    store.bulk_upsert_iocs([{'value': f'10.0.0.{i}', 'type': 'ip', 'source': 'AbuseIPDB'} for i in range(5)])
+    age(store, 40)
+    monkeypatch.setattr(retention, 'RETENTION_CHUNK_SIZE', 2)
+    monkeypatch.setattr(store, 'delete_iocs', lambda iocs, batch_size=None: 0)
+
+    summary = apply_retention(store, ColdArchive(str(tmp_path / 'archive')))
+    assert summary['archived'] == 2
+    assert summary['undeleted'] == 2
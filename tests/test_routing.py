@@ -0,0 +1,197 @@
+"""
+Read routing for the MongoDB backend (db/routing.py)
+
+Handle-level tests run against mongomock. The replica set tests need a
+real replica set: set MONGO_TEST_REPLICA_SET_URI, e.g.
+mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+"""
+import importlib
+import json
+import os
+import time
+import uuid
+
+import pytest
+from pymongo.read_preferences import Primary, SecondaryPreferred, Secondary
+
+import db.routing as routing
+from db.routing import DEFAULT_READ_ROUTING, read_routing_from_env, read_preference
+
+REPLICA_SET_URI = os.getenv('MONGO_TEST_REPLICA_SET_URI')
+
+
+def expected_preference(mode):
+    if mode == 'primary':
+        return Primary()
+    return routing.READ_PREFERENCES[mode](max_staleness=routing.MONGO_MAX_STALENESS_SECONDS)
+
+
+# Configuration
+
+def test_default_routing(monkeypatch):
+    monkeypatch.delenv('MONGO_READ_ROUTING', raising=False)
+    assert read_routing_from_env() == DEFAULT_READ_ROUTING
+
+
+def test_overrides_replace_and_add_methods(monkeypatch):
+    monkeypatch.setenv('MONGO_READ_ROUTING', json.dumps({
+        'search_iocs': 'primary',
+        'get_iocs_page': 'secondaryPreferred',
+        'find_indicator': 'nearest'
+    }))
+    routes = read_routing_from_env()
+    assert routes['search_iocs'] == 'primary'
+    assert routes['get_iocs_page'] == 'secondaryPreferred'
+    assert routes['find_indicator'] == 'nearest'
+    assert routes['get_trends'] == DEFAULT_READ_ROUTING['get_trends']
+
+
+def test_unknown_mode_is_ignored(monkeypatch):
+    monkeypatch.setenv('MONGO_READ_ROUTING', json.dumps({'get_trends': 'fastest', 'search_iocs': 'primary'}))
+    routes = read_routing_from_env()
+    assert routes['get_trends'] == DEFAULT_READ_ROUTING['get_trends']
+    assert routes['search_iocs'] == 'primary'
+
+
+def test_invalid_json_keeps_defaults(monkeypatch):
+    monkeypatch.setenv('MONGO_READ_ROUTING', '{not json')
+    assert read_routing_from_env() == DEFAULT_READ_ROUTING
+
+
+@pytest.fixture
+def reload_routing(monkeypatch):
+    """Reload db.routing under a patched environment, and restore it afterwards"""
+    def reload(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        return importlib.reload(routing)
+    yield reload
+    monkeypatch.undo()
+    importlib.reload(routing)
+
+
+@pytest.mark.parametrize('configured, effective', [('10', 90), ('0', 90), ('90', 90), ('300', 300)])
+def test_staleness_floor(reload_routing, configured, effective):
+    module = reload_routing(MONGO_MAX_STALENESS_SECONDS=configured)
+    assert module.MONGO_MAX_STALENESS_SECONDS == effective
+    assert module.read_preference('secondaryPreferred').max_staleness == effective
+
+
+def test_read_preference_modes():
+    assert read_preference('primary') == Primary()
+    assert read_preference('secondaryPreferred') == SecondaryPreferred(max_staleness=routing.MONGO_MAX_STALENESS_SECONDS)
+    assert read_preference('secondary') == Secondary(max_staleness=routing.MONGO_MAX_STALENESS_SECONDS)
+
+
+# Repository handles
+
+def exercise_reads(store):
+    """Call every repository read method that goes through _reader"""
+    store.get_all_iocs(limit=5)
+    store.get_iocs_page(limit=5)
+    store.count_iocs({'type': 'domain'})
+    list(store.iter_iocs(limit=5))
+    store.distinct_values('source')
+    store.search_iocs('evil')
+    store.find_indicator('evil.com')
+    store.bulk_lookup(['evil.com'])
+    store.get_stats()
+    store.get_threat_level_stats()
+    store.get_trends(days=7)
+    store._generation = None
+    store.ingest_generation()
+
+
+def record_readers(store):
+    """Wrap store._reader to record (method, handle) for every read"""
+    calls = []
+    reader = store._reader
+
+    def recording(name, method):
+        handle = reader(name, method)
+        calls.append((method, handle))
+        return handle
+    store._reader = recording
+    return calls
+
+
+def assert_routed(store, calls):
+    assert {method for method, _ in calls} >= set(DEFAULT_READ_ROUTING)
+    for method, handle in calls:
+        mode = store.read_routing.get(method, 'primary')
+        assert handle.read_preference == expected_preference(mode), method
+
+
+@pytest.fixture
+def mock_store(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import db.mongo as mongo
+    # mongomock has no capped collections
+    monkeypatch.setattr(mongo.MongoDBManager, '_ensure_events_collection', lambda self: None)
+    store = mongo.MongoDBManager()
+    store._create_client = mongomock.MongoClient
+    assert store.connect()
+    if store._index_thread:
+        store._index_thread.join()
+    return store
+
+
+def test_routed_methods_use_their_read_preference(mock_store):
+    calls = record_readers(mock_store)
+    exercise_reads(mock_store)
+    assert_routed(mock_store, calls)
+
+
+def test_override_changes_handle(mock_store):
+    mock_store.read_routing = {**DEFAULT_READ_ROUTING, 'get_trends': 'primary', 'get_iocs_page': 'secondary'}
+    assert mock_store._reader('trend_buckets', 'get_trends').read_preference == Primary()
+    assert mock_store._reader('iocs', 'get_iocs_page').read_preference == expected_preference('secondary')
+
+
+def test_generation_cached_views_use_primary(mock_store):
+    # The generation and the views cached under it must come from the same member
+    for method in ('ingest_generation', 'get_stats', 'distinct_values'):
+        assert mock_store.read_routing.get(method, 'primary') == 'primary', method
+
+
+def test_writes_use_primary(mock_store):
+    assert mock_store.collection.read_preference == Primary()
+    assert mock_store._reader('iocs', 'insert_ioc').read_preference == Primary()
+
+
+# Replica set
+
+@pytest.fixture
+def replica_set_store(monkeypatch):
+    if not REPLICA_SET_URI:
+        pytest.skip('MONGO_TEST_REPLICA_SET_URI not set')
+    monkeypatch.setenv('MONGO_URI', REPLICA_SET_URI)
+    import db.mongo as mongo
+    # A throwaway database, so pointing the suite at a real cluster never touches live data
+    store = mongo.MongoDBManager(db_name=f'cti_test_{uuid.uuid4().hex}')
+    assert store.connect()
+    if store._index_thread:
+        store._index_thread.join()
+    yield store
+    store.client.drop_database(store.db_name)
+    store.close()
+
+
+def test_replica_set_routing(replica_set_store):
+    store = replica_set_store
+    assert store.client.topology_description.topology_type_name == 'ReplicaSetWithPrimary'
+    store.bulk_upsert_iocs([{'value': 'evil.com', 'type': 'domain', 'source': 'ThreatFox'}])
+    calls = record_readers(store)
+    exercise_reads(store)
+    assert_routed(store, calls)
+
+
+def test_replica_set_secondary_reads_replicate(replica_set_store):
+    store = replica_set_store
+    store.bulk_upsert_iocs([{'value': 'evil.com', 'type': 'domain', 'source': 'ThreatFox'}])
+    secondary = store.collection.with_options(read_preference=Secondary(max_staleness=routing.MONGO_MAX_STALENESS_SECONDS))
+    # Secondaries apply the write within the staleness bound
+    deadline = time.monotonic() + 10
+    while secondary.count_documents({'canonical': 'evil.com'}) == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.2)
@@ -0,0 +1,90 @@
+"""SharedCache refresh locks under Flask-Caching views"""
+import os
+import threading
+import time
+import pytest
+from flask import Flask, jsonify
+from web.shared_cache import SharedCache, SingleFlightCache
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(CACHE_TYPE='web.shared_cache.SharedCache', CACHE_DIR=str(tmp_path),
+                      CACHE_WAIT_TIMEOUT=5)
+    app.cache_ext = SingleFlightCache(app)
+    return app
+
+
+def lock_files(app):
+    return [name for name in os.listdir(app.config['CACHE_DIR']) if name.endswith('.lock')]
+
+
+def cached_view(app, responses):
+    @app.route('/view')
+    @app.cache_ext.cached(timeout=60, key_prefix='view', response_filter=lambda rv: not isinstance(rv, tuple))
+    def view():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        body, status = response
+        return (jsonify(body), status) if status != 200 else jsonify(body)
+
+
+def test_filtered_response_releases_lock(app):
+    cached_view(app, [({'error': 'down'}, 500), ({'ok': True}, 200)])
+    client = app.test_client()
+    assert client.get('/view').status_code == 500
+    assert lock_files(app) == []
+    start = time.monotonic()
+    assert client.get('/view').status_code == 200
+    assert time.monotonic() - start < 1
+
+
+def test_exception_releases_lock(app):
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    cached_view(app, [RuntimeError('boom'), ({'ok': True}, 200)])
+    client = app.test_client()
+    assert client.get('/view').status_code == 500
+    assert lock_files(app) == []
+    assert client.get('/view').status_code == 200
+
+
+def test_successful_response_is_cached(app):
+    cached_view(app, [({'ok': True}, 200)])
+    client = app.test_client()
+    assert client.get('/view').get_json() == {'ok': True}
+    assert client.get('/view').get_json() == {'ok': True}
+    assert lock_files(app) == []
+
+
+def test_waiter_stops_when_refresh_gives_up(tmp_path):
+    cache = SharedCache(cache_dir=str(tmp_path), wait_timeout=5)
+    assert cache.get('key') is None
+    result = {}
+
+    def waiter():
+        start = time.monotonic()
+        result['value'] = cache.get('key')
+        result['elapsed'] = time.monotonic() - start
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.1)
+    cache.release_claims()
+    thread.join()
+    assert result['value'] is None
+    assert result['elapsed'] < 1
+
+
+def test_set_without_claim_keeps_other_lock(tmp_path):
+    cache = SharedCache(cache_dir=str(tmp_path))
+    assert cache.get('key') is None
+
+    def other_thread_sets():
+        cache.set('key', 'value')
+    thread = threading.Thread(target=other_thread_sets)
+    thread.start()
+    thread.join()
+    assert os.path.exists(cache._path('key', 'lock'))
+    cache.release_claims()
+    assert not os.path.exists(cache._path('key', 'lock'))
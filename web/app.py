@@ -1,31 +1,27 @@
 """
 Flask Web Application for CTI Dashboard
 """
-from flask import Flask, render_template, jsonify, request, Response
+from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 import sys
 import os
-import csv
-import io
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from db.mongo import db_manager
+from db.store import db_manager
+from db.normalize import refang, classify, canonicalize
 from ingestors.virustotal import vt_checker
-from bson import json_util
-import json
+from web.bulk_lookup import bulk_lookup_response
+from web.export import export_response
+from web.encoding import json_response, streamed_json_response, STREAM_CHUNK_SIZE
+from web.projection import listing_options, to_columnar
+from web.conditional import conditional
+from web.stream import event_stream_response
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Connect to database on startup
-if not db_manager.connect():
-    print("⚠️  Warning: MongoDB connection failed, retrying...")
-    import time
-    time.sleep(2)
-    db_manager.connect()
-
-def parse_json(data):
-    """Helper to convert MongoDB documents to JSON"""
-    return json.loads(json_util.dumps(data))
+# No connection at import: with preload_app the gunicorn master imports
+# this module before forking, and each worker connects in post_fork
+# (gunicorn_config.py) or lazily on its first request
 
 @app.route('/')
 def index():
@@ -37,11 +33,12 @@ def index():
     return response
 
 @app.route('/api/stats')
+@conditional
 def get_stats():
     """Get IOC statistics"""
     try:
         # Verify connection
-        if db_manager.collection is None:
+        if not db_manager.is_connected():
             print("ERROR: Database collection is None!")
             db_manager.connect()
         
@@ -55,12 +52,23 @@ def get_stats():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/iocs')
+@conditional
 def get_iocs():
     """Get latest IOCs"""
     try:
         limit = request.args.get('limit', 100, type=int)
-        iocs = db_manager.get_all_iocs(limit=limit)
-        return jsonify(parse_json(iocs))
+        try:
+            fields, columnar = listing_options(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if columnar:
+            return json_response(to_columnar(db_manager.get_all_iocs(limit=limit, fields=fields), fields))
+        if limit > STREAM_CHUNK_SIZE:
+            # Large pages are streamed instead of built in memory
+            return streamed_json_response(db_manager.iter_iocs(limit=limit, fields=fields))
+        iocs = db_manager.get_all_iocs(limit=limit, fields=fields)
+        return json_response(iocs)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -72,17 +80,28 @@ def search_iocs():
         if not query:
             return jsonify({'error': 'Query parameter "q" is required'}), 400
         
-        results = db_manager.search_iocs(query)
-        return jsonify(parse_json(results))
+        try:
+            fields, columnar = listing_options(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        results = db_manager.search_iocs(query, fields=fields)
+        return json_response(to_columnar(results, fields) if columnar else results)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stream')
+def stream_events():
+    """Server-Sent Events stream of new IOCs and stat deltas"""
+    return event_stream_response(db_manager)
+
 @app.route('/api/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'database': 'connected' if db_manager.client else 'disconnected'
+        'database': 'connected' if db_manager.is_connected() else 'disconnected',
+        'backend': db_manager.backend
     })
 
 @app.errorhandler(404)
@@ -100,73 +119,64 @@ def lookup_threat():
     """Lookup threat in VirusTotal and local database"""
     try:
         data = request.get_json()
-        query = data.get('query', '').strip()
+        query = refang(data.get('query', ''))
         lookup_type = data.get('type', 'auto')  # ip, domain, url, hash, or auto
         
         if not query:
             return jsonify({'error': 'Query parameter is required'}), 400
         
-        # Check local database first
-        local_results = db_manager.search_iocs(query)
+        ioc_type = classify(query) if lookup_type == 'auto' else lookup_type
+        canonical = canonicalize(query, ioc_type)
         
-        # Check VirusTotal
-        vt_result = {}
-        if lookup_type == 'ip' or (lookup_type == 'auto' and _is_ip(query)):
-            vt_result = vt_checker.check_ip(query)
-        elif lookup_type == 'domain' or (lookup_type == 'auto' and _is_domain(query)):
-            vt_result = vt_checker.check_domain(query)
-        elif lookup_type == 'url' or (lookup_type == 'auto' and _is_url(query)):
-            vt_result = vt_checker.check_url(query)
-        elif lookup_type == 'hash' or (lookup_type == 'auto' and _is_hash(query)):
-            vt_result = vt_checker.check_hash(query)
+        # Start the VirusTotal check so it runs while the local database is searched
+        vt_future = vt_checker.submit(ioc_type, canonical)
         
-        return jsonify({
+        # Local database: the consolidated indicator (a sighting per source)
+        # and listed netblocks, then indexed search
+        indicator = db_manager.find_indicator(query, ioc_type)
+        local_results = [indicator] if indicator else []
+        if ioc_type == 'ip':
+            local_results += db_manager.find_ip_ranges(canonical)
+        if not local_results:
+            local_results = db_manager.search_iocs(query)
+        
+        vt_result = vt_checker.result(vt_future)
+        
+        return json_response({
             'query': query,
-            'local_matches': parse_json(local_results),
+            'local_matches': local_results,
             'virustotal': vt_result,
             'total_local_matches': len(local_results)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/lookup/bulk', methods=['POST'])
+def bulk_lookup():
+    """Lookup many indicators (JSON array or newline-delimited) in the local database"""
+    try:
+        return bulk_lookup_response()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/export')
 def export_iocs():
-    """Export IOCs in CSV or JSON format"""
+    """Export IOCs in CSV, JSON or NDJSON format"""
     try:
         format_type = request.args.get('format', 'json').lower()
         limit = request.args.get('limit', 1000, type=int)
         tag = request.args.get('tag', None)
         
-        # Get IOCs
-        if tag:
-            iocs = db_manager.get_iocs_by_tag(tag)
-        else:
-            iocs = db_manager.get_all_iocs(limit=limit)
+        # Stream IOCs straight from a projected cursor
+        csv_fields = ['value', 'type', 'source', 'timestamp', 'tags']
+        filter_query = {'tags': tag} if tag else {}
+        iocs = db_manager.iter_iocs(
+            filter_query,
+            limit=0 if tag else limit,
+            fields=csv_fields if format_type == 'csv' else None
+        )
         
-        if format_type == 'csv':
-            # Generate CSV
-            output = io.StringIO()
-            if iocs:
-                fieldnames = ['value', 'type', 'source', 'timestamp', 'tags']
-                writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
-                writer.writeheader()
-                
-                for ioc in iocs:
-                    # Convert ObjectId and datetime to string
-                    ioc['_id'] = str(ioc.get('_id', ''))
-                    ioc['timestamp'] = str(ioc.get('timestamp', ''))
-                    ioc['tags'] = ','.join(ioc.get('tags', []))
-                    writer.writerow(ioc)
-            
-            response = Response(output.getvalue(), mimetype='text/csv')
-            response.headers['Content-Disposition'] = 'attachment; filename=iocs_export.csv'
-            return response
-        else:
-            # Return JSON
-            response = Response(json_util.dumps(iocs), mimetype='application/json')
-            response.headers['Content-Disposition'] = 'attachment; filename=iocs_export.json'
-            return response
-            
+        return export_response(iocs, format_type if format_type in ('csv', 'ndjson') else 'json', csv_fields)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -191,6 +201,7 @@ def manage_tags(ioc_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/trends')
+@conditional
 def get_trends():
     """Get IOC trends over time"""
     try:
@@ -205,32 +216,10 @@ def get_threat_levels():
     """Get statistics by threat level"""
     try:
         stats = db_manager.get_threat_level_stats()
-        return jsonify(parse_json(stats))
+        return json_response(stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def _is_ip(value):
-    """Check if value is an IP address"""
-    import re
-    ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-    return bool(re.match(ip_pattern, value))
-
-def _is_domain(value):
-    """Check if value is a domain"""
-    import re
-    domain_pattern = r'^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
-    return bool(re.match(domain_pattern, value))
-
-def _is_url(value):
-    """Check if value is a URL"""
-    return value.startswith(('http://', 'https://'))
-
-def _is_hash(value):
-    """Check if value is a file hash (MD5, SHA1, SHA256)"""
-    import re
-    hash_pattern = r'^[a-fA-F0-9]{32}$|^[a-fA-F0-9]{40}$|^[a-fA-F0-9]{64}$'
-    return bool(re.match(hash_pattern, value))
-
 if __name__ == '__main__':
     import os
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -238,4 +227,6 @@ if __name__ == '__main__':
     print(f"🚀 Starting CTI Dashboard on http://127.0.0.1:{port}")
     print(f"📊 Dashboard: http://127.0.0.1:{port}")
     print(f"🔍 Search API: http://127.0.0.1:{port}/api/search?q=<query>")
+    if not db_manager.connect():
+        print("⚠️  Warning: database connection failed; requests will retry lazily")
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
@@ -3,21 +3,24 @@ Flask Demo Application for CTI Dashboard (No MongoDB Required)
 Uses JSON file for data storage
 """
 from flask import Flask, render_template, jsonify, request
-import json
 import os
-from collections import Counter
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from web.encoding import json_response
+from web.demo_store import DemoDataset
 
 app = Flask(__name__)
 
 # Path to demo data
 DEMO_DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_data.json')
 
+# Parsed and indexed once, reloaded when the file changes
+demo_dataset = DemoDataset(DEMO_DATA_FILE)
+
 def load_demo_data():
-    """Load data from JSON file"""
-    if os.path.exists(DEMO_DATA_FILE):
-        with open(DEMO_DATA_FILE, 'r') as f:
-            return json.load(f)
-    return []
+    """Current demo dataset"""
+    return demo_dataset.current()
 
 @app.route('/')
 def index():
@@ -28,23 +31,8 @@ def index():
 def get_stats():
     """Get IOC statistics"""
     try:
-        iocs = load_demo_data()
-        
-        # Count by type
-        types = Counter(ioc.get('type', 'unknown') for ioc in iocs)
-        by_type = [{'_id': k, 'count': v} for k, v in types.items()]
-        by_type.sort(key=lambda x: x['count'], reverse=True)
-        
-        # Count by source
-        sources = Counter(ioc.get('source', 'Unknown') for ioc in iocs)
-        by_source = [{'_id': k, 'count': v} for k, v in sources.items()]
-        by_source.sort(key=lambda x: x['count'], reverse=True)
-        
-        return jsonify({
-            'total': len(iocs),
-            'by_type': by_type,
-            'by_source': by_source
-        })
+        # Counts are built when the dataset loads
+        return jsonify(load_demo_data().stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -53,12 +41,8 @@ def get_iocs():
     """Get latest IOCs"""
     try:
         limit = request.args.get('limit', 100, type=int)
-        iocs = load_demo_data()
-        
-        # Sort by timestamp (most recent first)
-        iocs.sort(key=lambda x: x.get('timestamp', {}).get('$date', ''), reverse=True)
-        
-        return jsonify(iocs[:limit])
+        # Most recent first, sorted when the dataset loads
+        return json_response(load_demo_data().newest_first[:limit])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -70,10 +54,7 @@ def search_iocs():
         if not query:
             return jsonify({'error': 'Query parameter "q" is required'}), 400
         
-        iocs = load_demo_data()
-        results = [ioc for ioc in iocs if query in ioc.get('value', '').lower()]
-        
-        return jsonify(results)
+        return json_response(load_demo_data().search(query))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -84,7 +65,7 @@ def health_check():
         'status': 'healthy',
         'database': 'demo_mode',
         'data_file': 'demo_data.json',
-        'records': len(load_demo_data())
+        'records': len(load_demo_data().iocs)
     })
 
 @app.errorhandler(404)
@@ -110,7 +91,7 @@ if __name__ == '__main__':
         subprocess.run(['python', 'add_demo_data_simple.py'])
         print()
     
-    data_count = len(load_demo_data())
+    data_count = len(load_demo_data().iocs)
     print(f"✅ Loaded {data_count} demo threats")
     print()
     print("🌐 Dashboard URL: http://127.0.0.1:5000")
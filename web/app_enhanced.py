@@ -2,26 +2,29 @@
 Enhanced Flask Web Application for CTI Dashboard
 Production-ready with advanced features
 """
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_caching import Cache
 from flasgger import Swagger
 import sys
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
-import json
-import csv
-import io
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from db.mongo import db_manager
-from bson import json_util
+from db.store import db_manager
+from db.retention import cold_archive
+from web.bulk_lookup import bulk_lookup_response
+from web.export import export_response
+from web.encoding import json_response
+from web.projection import listing_options, to_columnar
+from web.conditional import conditional
+from web.stream import event_stream_response
+from web.shared_cache import SingleFlightCache
 from config import get_config
 
 # Initialize Flask app
@@ -40,8 +43,19 @@ limiter = Limiter(
     default_limits=[config.RATELIMIT_DEFAULT] if config.RATELIMIT_ENABLED else []
 )
 
-# Caching
-cache = Cache(app)
+# Caching; SingleFlightCache releases SharedCache refresh locks when a view is not cached
+cache = SingleFlightCache(app)
+
+
+def generation_key(name):
+    """Cache key for a view that changes only when an ingest lands"""
+    return lambda: f"{name}/gen{db_manager.ingest_generation()}"
+
+
+def successful(rv):
+    """Only cache successful responses; error views return (body, status) tuples"""
+    return not isinstance(rv, tuple)
+
 
 # API Documentation
 if config.ENABLE_API_DOCS:
@@ -80,16 +94,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Connect to database on startup
-if not db_manager.connect():
-    logger.warning("MongoDB connection failed, retrying...")
-    import time
-    time.sleep(2)
-    db_manager.connect()
-
-def parse_json(data):
-    """Helper to convert MongoDB documents to JSON"""
-    return json.loads(json_util.dumps(data))
+# No database connection at import: with preload_app the import runs in the
+# gunicorn master, and each worker connects in its post_fork hook instead
 
 
 @app.route('/')
@@ -99,7 +105,9 @@ def index():
 
 
 @app.route('/api/stats')
-@cache.cached(timeout=60)
+@conditional
+@cache.cached(timeout=config.GENERATION_CACHE_TIMEOUT, key_prefix=generation_key('stats'),
+              response_filter=successful)
 @limiter.limit("60 per minute")
 def get_stats():
     """
@@ -120,7 +128,7 @@ def get_stats():
               type: array
     """
     try:
-        if db_manager.collection is None:
+        if not db_manager.is_connected():
             db_manager.connect()
         
         stats = db_manager.get_stats()
@@ -132,6 +140,7 @@ def get_stats():
 
 
 @app.route('/api/iocs')
+@conditional
 @limiter.limit("100 per minute")
 def get_iocs():
     """
@@ -145,11 +154,15 @@ def get_iocs():
         type: integer
         default: 100
         description: Number of IOCs to return
+      - name: cursor
+        in: query
+        type: string
+        description: Opaque cursor from the previous page's next_cursor
       - name: skip
         in: query
         type: integer
         default: 0
-        description: Number of IOCs to skip
+        description: Number of IOCs to skip (ignored when a cursor is given)
       - name: type
         in: query
         type: string
@@ -158,15 +171,34 @@ def get_iocs():
         in: query
         type: string
         description: Filter by source
+      - name: include_total
+        in: query
+        type: boolean
+        default: true
+        description: Include the (cached) total matching the filter
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated fields to return (e.g. value,type,source)
+      - name: format
+        in: query
+        type: string
+        enum: [objects, columnar]
+        default: objects
+        description: columnar returns parallel per-field arrays
     responses:
       200:
         description: List of IOCs
+      400:
+        description: Invalid cursor, fields or format
     """
     try:
-        limit = min(request.args.get('limit', config.DEFAULT_PAGE_SIZE, type=int), config.MAX_PAGE_SIZE)
-        skip = request.args.get('skip', 0, type=int)
+        limit = max(1, min(request.args.get('limit', config.DEFAULT_PAGE_SIZE, type=int), config.MAX_PAGE_SIZE))
+        skip = max(0, request.args.get('skip', 0, type=int))
+        cursor = request.args.get('cursor', None)
         ioc_type = request.args.get('type', None)
         source = request.args.get('source', None)
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
         
         # Build filter
         filter_query = {}
@@ -176,21 +208,25 @@ def get_iocs():
             filter_query['source'] = source
         
         # Get IOCs
-        iocs = list(db_manager.collection.find(filter_query)
-                   .sort('timestamp', -1)
-                   .skip(skip)
-                   .limit(limit))
-        
-        total = db_manager.collection.count_documents(filter_query)
+        try:
+            fields, columnar = listing_options(request.args)
+            iocs, next_cursor = db_manager.get_iocs_page(
+                filter_query, limit=limit, cursor=cursor, skip=skip, fields=fields
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         logger.info(f"Retrieved {len(iocs)} IOCs (filter: {filter_query})")
         
-        return jsonify({
-            'iocs': parse_json(iocs),
-            'total': total,
+        response = {
+            'iocs': to_columnar(iocs, fields) if columnar else iocs,
             'limit': limit,
-            'skip': skip
-        })
+            'skip': skip,
+            'next_cursor': next_cursor
+        }
+        if include_total:
+            response['total'] = db_manager.count_iocs(filter_query)
+        return json_response(response)
     except Exception as e:
         logger.error(f"Error in get_iocs: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -215,11 +251,21 @@ def search_iocs():
         type: integer
         default: 50
         description: Maximum results
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated fields to return (e.g. value,type,source)
+      - name: format
+        in: query
+        type: string
+        enum: [objects, columnar]
+        default: objects
+        description: columnar returns parallel per-field arrays
     responses:
       200:
         description: Search results
       400:
-        description: Missing query parameter
+        description: Missing query parameter, invalid fields or format
     """
     try:
         query = request.args.get('q', '')
@@ -227,15 +273,110 @@ def search_iocs():
             return jsonify({'error': 'Query parameter "q" is required'}), 400
         
         limit = min(request.args.get('limit', 50, type=int), 100)
-        results = db_manager.search_iocs(query)[:limit]
+        try:
+            fields, columnar = listing_options(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        results = db_manager.search_iocs(query, limit=limit, fields=fields)
         
         logger.info(f"Search query: '{query}' - Found {len(results)} results")
-        return jsonify(parse_json(results))
+        return json_response(to_columnar(results, fields) if columnar else results)
     except Exception as e:
         logger.error(f"Error in search_iocs: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/archive/search')
+@limiter.limit("20 per minute")
+def search_archive():
+    """
+    Search IOCs moved to the cold archive by the retention job
+    ---
+    tags:
+      - Search
+    parameters:
+      - name: q
+        in: query
+        type: string
+        description: Exact indicator or value substring
+      - name: source
+        in: query
+        type: string
+      - name: type
+        in: query
+        type: string
+      - name: since
+        in: query
+        type: string
+        description: ISO 8601 lower bound on the IOC timestamp
+      - name: until
+        in: query
+        type: string
+        description: ISO 8601 upper bound (exclusive) on the IOC timestamp
+      - name: limit
+        in: query
+        type: integer
+        default: 100
+    responses:
+      200:
+        description: Archived IOCs, newest partition first
+      400:
+        description: No criteria or malformed dates
+    """
+    try:
+        query = request.args.get('q')
+        source = request.args.get('source')
+        ioc_type = request.args.get('type')
+        try:
+            since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+            until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+        except ValueError:
+            return jsonify({'error': 'since and until must be ISO 8601 dates'}), 400
+        if not (query or source or ioc_type or since or until):
+            return jsonify({'error': 'Provide q, source, type, since or until'}), 400
+        
+        limit = min(request.args.get('limit', 100, type=int), config.MAX_PAGE_SIZE)
+        results = cold_archive.query(query, since=since, until=until, source=source, ioc_type=ioc_type, limit=limit)
+        logger.info(f"Archive search: '{query}' - Found {len(results)} results")
+        return json_response(results)
+    except Exception as e:
+        logger.error(f"Error in search_archive: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/lookup/bulk', methods=['POST'])
+@limiter.limit("10 per minute")
+def bulk_lookup():
+    """
+    Lookup many indicators against the local database
+    ---
+    tags:
+      - Search
+    consumes:
+      - application/json
+      - text/plain
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: JSON array of indicators, or one indicator per line
+    responses:
+      200:
+        description: NDJSON stream with one verdict per indicator
+      400:
+        description: Missing or malformed indicators
+      413:
+        description: Too many indicators
+    """
+    try:
+        response = bulk_lookup_response()
+        logger.info("Bulk lookup started")
+        return response
+    except Exception as e:
+        logger.error(f"Error in bulk_lookup: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/export/<format>')
 @limiter.limit("5 per hour")
 def export_iocs(format):
@@ -249,7 +390,7 @@ def export_iocs(format):
         in: path
         type: string
         required: true
-        enum: [csv, json]
+        enum: [csv, json, ndjson]
         description: Export format
       - name: type
         in: query
@@ -266,7 +407,7 @@ def export_iocs(format):
         description: Maximum records
     responses:
       200:
-        description: Exported file
+        description: Exported file, streamed
       400:
         description: Invalid format
     """
@@ -281,47 +422,17 @@ def export_iocs(format):
         if request.args.get('source'):
             filter_query['source'] = request.args.get('source')
         
-        # Get IOCs
+        # Stream IOCs straight from a projected cursor
         limit = min(request.args.get('limit', 1000, type=int), config.MAX_EXPORT_RECORDS)
-        iocs = list(db_manager.collection.find(filter_query).limit(limit))
-        
-        if format == 'json':
-            output = io.BytesIO()
-            output.write(json.dumps(parse_json(iocs), indent=2).encode('utf-8'))
-            output.seek(0)
-            
-            return send_file(
-                output,
-                mimetype='application/json',
-                as_attachment=True,
-                download_name=f'iocs_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-            )
+        csv_fields = ['value', 'type', 'source', 'timestamp']
+        iocs = db_manager.iter_iocs(filter_query, limit=limit, fields=csv_fields if format == 'csv' else None)
         
-        elif format == 'csv':
-            output = io.StringIO()
-            if iocs:
-                writer = csv.DictWriter(output, fieldnames=['value', 'type', 'source', 'timestamp'])
-                writer.writeheader()
-                for ioc in iocs:
-                    writer.writerow({
-                        'value': ioc.get('value', ''),
-                        'type': ioc.get('type', ''),
-                        'source': ioc.get('source', ''),
-                        'timestamp': ioc.get('timestamp', '')
-                    })
-            
-            output.seek(0)
-            return send_file(
-                io.BytesIO(output.getvalue().encode('utf-8')),
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name=f'iocs_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            )
+        response = export_response(iocs, format, csv_fields)
+        if response is None:
+            return jsonify({'error': 'Invalid format. Use csv, json or ndjson'}), 400
         
-        else:
-            return jsonify({'error': 'Invalid format. Use csv or json'}), 400
-        
-        logger.info(f"Export completed: {format} - {len(iocs)} records")
+        logger.info(f"Export started: {format} - up to {limit} records")
+        return response
     
     except Exception as e:
         logger.error(f"Error in export_iocs: {e}", exc_info=True)
@@ -329,7 +440,9 @@ def export_iocs(format):
 
 
 @app.route('/api/sources')
-@cache.cached(timeout=300)
+@conditional
+@cache.cached(timeout=config.GENERATION_CACHE_TIMEOUT, key_prefix=generation_key('sources'),
+              response_filter=successful)
 def get_sources():
     """
     Get list of all IOC sources
@@ -341,7 +454,7 @@ def get_sources():
         description: List of sources
     """
     try:
-        sources = db_manager.collection.distinct('source')
+        sources = db_manager.distinct_values('source')
         return jsonify({'sources': sources})
     except Exception as e:
         logger.error(f"Error in get_sources: {e}", exc_info=True)
@@ -349,7 +462,9 @@ def get_sources():
 
 
 @app.route('/api/types')
-@cache.cached(timeout=300)
+@conditional
+@cache.cached(timeout=config.GENERATION_CACHE_TIMEOUT, key_prefix=generation_key('types'),
+              response_filter=successful)
 def get_types():
     """
     Get list of all IOC types
@@ -361,13 +476,40 @@ def get_types():
         description: List of IOC types
     """
     try:
-        types = db_manager.collection.distinct('type')
+        types = db_manager.distinct_values('type')
         return jsonify({'types': types})
     except Exception as e:
         logger.error(f"Error in get_types: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/stream')
+@limiter.limit("30 per minute")
+def stream_events():
+    """
+    Server-Sent Events stream of new IOCs and stat deltas
+    ---
+    tags:
+      - Statistics
+    produces:
+      - text/event-stream
+    parameters:
+      - name: last_event_id
+        in: query
+        type: integer
+        required: false
+        description: Resume after this generation (the Last-Event-ID header takes precedence)
+    responses:
+      200:
+        description: A hello event with the current generation, then iocs, removed and changed events carrying stat deltas
+      503:
+        description: This worker already serves STREAM_MAX_PER_WORKER streams; retry after Retry-After seconds
+    """
+    if not db_manager.is_connected():
+        db_manager.connect()
+    return event_stream_response(db_manager)
+
+
 @app.route('/api/health')
 def health_check():
     """
@@ -382,8 +524,8 @@ def health_check():
     try:
         # Check database connection
         db_status = 'connected'
-        if db_manager.client:
-            db_manager.client.admin.command('ping')
+        if db_manager.is_connected():
+            db_manager.ping()
         else:
             db_status = 'disconnected'
         
@@ -391,6 +533,7 @@ def health_check():
             'status': 'healthy',
             'version': config.VERSION,
             'database': db_status,
+            'backend': db_manager.backend,
             'timestamp': datetime.utcnow().isoformat()
         })
     except Exception as e:
@@ -401,6 +544,41 @@ def health_check():
         }), 503
 
 
+@app.route('/api/health/pool')
+def pool_health():
+    """
+    Database connection pool usage for the worker serving this request
+    ---
+    tags:
+      - Health
+    responses:
+      200:
+        description: Pool settings plus checked-out connections, checkout wait times and failures
+    """
+    return jsonify({
+        'backend': db_manager.backend,
+        'pool': db_manager.pool_stats()
+    })
+
+
+@app.route('/api/health/cache')
+def cache_health():
+    """
+    Response cache counters, shared by every worker on the host
+    ---
+    tags:
+      - Health
+    responses:
+      200:
+        description: Hits, stale hits, waited hits, misses, sets and evictions
+    """
+    stats = getattr(cache.cache, 'stats', None)
+    return jsonify({
+        'type': config.CACHE_TYPE,
+        'cache': stats() if stats else None
+    })
+
+
 @app.route('/api/config')
 def get_config_info():
     """
@@ -455,6 +633,9 @@ if __name__ == '__main__':
     if config.ENABLE_API_DOCS:
         logger.info(f"📚 API Docs: http://{config.HOST}:{config.PORT}/api/docs")
     
+    if not db_manager.connect():
+        logger.warning("Database connection failed; requests will retry lazily")
+    
     app.run(
         debug=config.DEBUG,
         host=config.HOST,
@@ -0,0 +1,86 @@
+"""
+Bulk indicator lookup shared by the CTI Dashboard web apps
+"""
+from flask import request, jsonify, Response, stream_with_context
+from config import get_config
+from db.store import db_manager
+from db.normalize import refang, classify, canonicalize
+from web.encoding import dumps
+
+# Indicators resolved per database round trip
+LOOKUP_CHUNK_SIZE = 1000
+
+MAX_BULK_LOOKUP = get_config().MAX_BULK_LOOKUP
+
+
+def parse_indicators():
+    """
+    Read indicators from the current request.
+
+    Accepts a JSON array, a JSON object with an "indicators" array, or a
+    newline-delimited text body. Blank lines and duplicates are dropped.
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get('indicators')
+        if not isinstance(payload, list):
+            raise ValueError('Expected a JSON array of indicators')
+        raw = [str(item) for item in payload]
+    else:
+        raw = request.get_data(as_text=True).splitlines()
+
+    indicators = [line.strip() for line in raw if line.strip()]
+    return list(dict.fromkeys(indicators))
+
+
+def _verdict(indicator, ioc_type, canonical, matches, ranges):
+    """Build the per-indicator verdict record"""
+    sources = sorted({doc.get('source') for doc in matches + ranges if doc.get('source')})
+    return {
+        'indicator': indicator,
+        'canonical': canonical,
+        'type': ioc_type,
+        'verdict': 'malicious' if sources else 'not_found',
+        'sources': sources,
+        'matches': len(matches),
+        'ranges': [doc.get('canonical') or doc.get('value') for doc in ranges]
+    }
+
+
+def iter_verdicts(indicators):
+    """Yield one NDJSON verdict line per indicator, resolving them in chunks"""
+    for start in range(0, len(indicators), LOOKUP_CHUNK_SIZE):
+        chunk = []
+        for indicator in indicators[start:start + LOOKUP_CHUNK_SIZE]:
+            ioc_type = classify(indicator)
+            chunk.append((indicator, ioc_type, canonicalize(refang(indicator), ioc_type)))
+
+        matches = db_manager.bulk_lookup([canonical for _, _, canonical in chunk if canonical])
+        ips = [canonical for _, ioc_type, canonical in chunk if ioc_type == 'ip']
+        ranges = db_manager.find_ip_ranges_many(ips) if ips else {}
+
+        for indicator, ioc_type, canonical in chunk:
+            if not canonical:
+                record = {'indicator': indicator, 'verdict': 'invalid'}
+            else:
+                record = _verdict(
+                    indicator, ioc_type, canonical,
+                    matches.get(canonical, []), ranges.get(canonical, [])
+                )
+            yield dumps(record) + '\n'
+
+
+def bulk_lookup_response():
+    """Validate the request and stream NDJSON verdicts for every indicator"""
+    try:
+        indicators = parse_indicators()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not indicators:
+        return jsonify({'error': 'At least one indicator is required'}), 400
+    if len(indicators) > MAX_BULK_LOOKUP:
+        return jsonify({'error': f'At most {MAX_BULK_LOOKUP} indicators per request'}), 413
+
+    return Response(stream_with_context(iter_verdicts(indicators)), mimetype='application/x-ndjson')
@@ -0,0 +1,60 @@
+"""
+Conditional GET support for CTI Dashboard read endpoints
+
+Read endpoints only change when the ingest generation does (see
+IOCStore.ingest_version), so their ETag is derived from the generation
+plus the request path, query string and UTC day (windows such as
+"last 7 days" move at midnight), and Last-Modified from the later of the
+generation's last write and midnight. A matching If-None-Match (or, without
+one, If-Modified-Since) gets a 304 before the view runs. The generation
+is cached in-process, so most revalidations never touch the database.
+"""
+import functools
+import hashlib
+from datetime import datetime, timezone
+from flask import request, make_response
+from db.store import db_manager
+
+
+def request_etag(generation, day):
+    """Strong ETag for the current request at an ingest generation"""
+    params = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f'{day:%Y-%m-%d} {request.path}?{params}'.encode('utf-8')).hexdigest()[:16]
+    return f'g{generation}-{digest}'
+
+
+def _set_validators(response, etag, modified_at):
+    response.set_etag(etag)
+    if modified_at is not None:
+        response.last_modified = modified_at.replace(tzinfo=timezone.utc)
+    # Revalidate every time: the data changes at ingest, not on a schedule
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified(etag, modified_at):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and modified_at is not None:
+        # HTTP dates have whole-second precision
+        return modified_at.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
+
+
+def conditional(view):
+    """Add ETag/Last-Modified to a GET view and answer revalidations with 304"""
+    @functools.wraps(view)
+    def decorated(*args, **kwargs):
+        generation, modified_at = db_manager.ingest_version()
+        day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        etag = request_etag(generation, day)
+        if modified_at is not None:
+            modified_at = max(modified_at, day)
+        if _not_modified(etag, modified_at):
+            return _set_validators(make_response('', 304), etag, modified_at)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            _set_validators(response, etag, modified_at)
+        return response
+    return decorated
@@ -0,0 +1,97 @@
+"""
+In-memory demo dataset for the CTI Dashboard demo app
+
+demo_data.json is parsed once and kept with everything the demo
+endpoints need prebuilt: per-type/per-source counts, a newest-first view
+and a trigram index for substring search. The file is re-read only when
+its mtime or size changes.
+"""
+import json
+import os
+import threading
+from collections import Counter
+
+NGRAM_SIZE = 3
+
+
+def _trigrams(text):
+    """Distinct character trigrams of text"""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def _timestamp_key(ioc):
+    """Sort key for demo IOCs, whose timestamps are Extended JSON dates"""
+    timestamp = ioc.get('timestamp')
+    return timestamp.get('$date', '') if isinstance(timestamp, dict) else str(timestamp or '')
+
+
+def _count_list(counter):
+    """Counter as the aggregation-style list the dashboard expects"""
+    items = [{'_id': k, 'count': v} for k, v in counter.items()]
+    items.sort(key=lambda x: x['count'], reverse=True)
+    return items
+
+
+class DemoData:
+    """One parsed version of the demo IOCs with prebuilt stats, sort order and search index"""
+
+    def __init__(self, iocs):
+        self.iocs = iocs
+        self.keys = [str(ioc.get('value', '')).lower() for ioc in iocs]
+        self.newest_first = sorted(iocs, key=_timestamp_key, reverse=True)
+        self.stats = {
+            'total': len(iocs),
+            'by_type': _count_list(Counter(ioc.get('type', 'unknown') for ioc in iocs)),
+            'by_source': _count_list(Counter(ioc.get('source', 'Unknown') for ioc in iocs))
+        }
+        # trigram -> positions in self.iocs
+        self.grams = {}
+        for position, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                self.grams.setdefault(gram, []).append(position)
+
+    def search(self, query):
+        """IOCs whose lowercased value contains query, in file order"""
+        query = query.lower()
+        if len(query) < NGRAM_SIZE:
+            return [ioc for ioc, key in zip(self.iocs, self.keys) if query in key]
+
+        # Intersect posting lists smallest first, then verify the full substring
+        postings = sorted((self.grams.get(gram, []) for gram in _trigrams(query)), key=len)
+        candidates = set(postings[0])
+        for positions in postings[1:]:
+            candidates.intersection_update(positions)
+            if not candidates:
+                break
+        return [self.iocs[i] for i in sorted(candidates) if query in self.keys[i]]
+
+
+class DemoDataset:
+    """demo_data.json kept in memory, reloaded when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._identity = None
+        self._data = DemoData([])
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The loaded DemoData, re-reading the file if its mtime or size changed"""
+        try:
+            stat = os.stat(self.path)
+            identity = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            identity = None
+        if identity == self._identity:
+            return self._data
+
+        with self._lock:
+            if identity != self._identity:
+                iocs = []
+                if identity is not None:
+                    with open(self.path, 'r') as f:
+                        iocs = json.load(f)
+                # Requests holding the previous DemoData finish against it
+                self._data = DemoData(iocs)
+                self._identity = identity
+        return self._data
@@ -0,0 +1,78 @@
+"""
+Streaming IOC export shared by the CTI Dashboard web apps
+
+Exports are generators over a projected MongoDB cursor, emitted in
+chunks, so memory stays constant regardless of export size.
+"""
+import csv
+import io
+from datetime import datetime
+from flask import Response, stream_with_context
+from web.encoding import dumps, iter_json_array
+
+# Records encoded per yielded chunk
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def _csv_value(value):
+    """Flatten a document value for a CSV cell"""
+    if isinstance(value, list):
+        return ','.join(str(item) for item in value)
+    if value is None:
+        return ''
+    return str(value)
+
+
+def iter_csv(docs, fieldnames):
+    """Yield a CSV export in chunks of EXPORT_CHUNK_SIZE rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fieldnames)
+
+    for i, doc in enumerate(docs, 1):
+        writer.writerow([_csv_value(doc.get(field)) for field in fieldnames])
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def iter_ndjson(docs):
+    """Yield a newline-delimited JSON export in chunks of EXPORT_CHUNK_SIZE records"""
+    chunk = []
+    for doc in docs:
+        chunk.append(dumps(doc) + '\n')
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export_response(docs, export_format, csv_fields):
+    """
+    Stream docs as an attachment in csv, json or ndjson format.
+
+    Returns None for an unsupported format.
+    """
+    if export_format == 'csv':
+        body = iter_csv(docs, csv_fields)
+    elif export_format == 'json':
+        body = iter_json_array(docs)
+    elif export_format == 'ndjson':
+        body = iter_ndjson(docs)
+    else:
+        return None
+
+    filename = f'iocs_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+    response = Response(stream_with_context(body), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
@@ -0,0 +1,55 @@
+"""
+Field projection and compact (columnar) responses for IOC listings
+"""
+
+# Fields clients may request through ?fields=
+PROJECTABLE_FIELDS = {
+    '_id', 'value', 'canonical', 'type', 'source', 'timestamp', 'tags',
+    'confidence', 'threat_level', 'country', 'malware', 'pulse',
+    'reference', 'target', 'verified'
+}
+
+# Fields used by the dashboard table; the default for compact responses
+TABLE_FIELDS = ['_id', 'value', 'type', 'source', 'timestamp']
+
+
+def parse_fields(fields_arg):
+    """
+    Parse a comma-separated ?fields= value.
+
+    Returns a list of field names, or None when no projection was asked
+    for. Raises ValueError for unknown fields.
+    """
+    if not fields_arg:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in fields_arg.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in PROJECTABLE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+
+def to_columnar(docs, fields):
+    """Convert an array of documents into parallel per-field arrays"""
+    return {
+        'fields': fields,
+        'count': len(docs),
+        'columns': {field: [doc.get(field) for doc in docs] for field in fields}
+    }
+
+
+def listing_options(args):
+    """
+    Read fields/format query arguments shared by the listing endpoints.
+
+    Returns (fields, columnar). Compact responses default to the table
+    columns when no fields are given. Raises ValueError on bad input.
+    """
+    fields = parse_fields(args.get('fields'))
+    response_format = args.get('format', 'objects').lower()
+    if response_format not in ('objects', 'columnar'):
+        raise ValueError('format must be objects or columnar')
+    columnar = response_format == 'columnar'
+    if columnar and not fields:
+        fields = list(TABLE_FIELDS)
+    return fields, columnar
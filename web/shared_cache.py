@@ -0,0 +1,340 @@
+"""
+Shared cross-worker response cache for CTI Dashboard
+
+SimpleCache is private to each gunicorn worker, so every expiry made all
+2N+1 workers recompute the same response at once. SharedCache is a
+Flask-Caching backend that keeps entries as files in one local directory
+(no external service), so every worker on the host reads the same entries
+and the page cache keeps them in memory.
+
+Recomputation is single-flight. A get() that finds a key expired or
+missing claims the key's refresh lock, returns a miss, and that worker's
+view then recomputes and set()s the value. While the lock is held, other
+workers serve the expired value, or wait briefly for the first value if
+there is none. A view that raises or returns a response the filter
+rejects never calls set(), so SingleFlightCache (the Flask-Caching
+extension to use with this backend) releases any lock still claimed when
+the view returns, and waiters stop waiting as soon as the lock is gone. Hit, stale-hit, miss and eviction counters live in a small
+mmap'd file shared by all workers.
+
+Enable with CACHE_TYPE=web.shared_cache.SharedCache (the default).
+"""
+import functools
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from flask_caching import Cache
+from flask_caching.backends.base import BaseCache
+
+try:
+    import fcntl
+except ImportError:
+    # No POSIX locks (Windows): counters are only exact for single-process servers
+    fcntl = None
+
+# Default directory for entries; must be local to the host
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'cache')
+
+# Entry file header: expires_at (0 = never), stored_at
+ENTRY_HEADER = struct.Struct('<dd')
+
+COUNTERS = ('hits', 'stale_hits', 'waited_hits', 'misses', 'sets', 'evictions', 'lock_breaks')
+COUNTERS_FILE = 'counters.bin'
+
+# Interval at which a worker waiting on another worker's refresh re-checks the entry
+WAIT_POLL_SECONDS = 0.02
+
+
+class SharedCache(BaseCache):
+    """
+    File-backed cache shared by every worker process on the host.
+
+    stale_seconds: how long after expiry an entry may still be served while
+    another worker refreshes it. lock_timeout: age after which a refresh
+    lock is presumed abandoned. wait_timeout: how long a worker with no
+    value to serve waits for another worker's refresh before computing
+    the value itself.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, threshold=500, default_timeout=300,
+                 stale_seconds=300, lock_timeout=30, wait_timeout=5, **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.stale_seconds = stale_seconds
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        os.makedirs(cache_dir, exist_ok=True)
+        self._counter_lock = threading.Lock()
+        self._counters = None
+        self._counters_pid = None
+        # Refresh locks claimed by the current thread and not yet released
+        self._claims = threading.local()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            cache_dir=config.get('CACHE_DIR') or CACHE_DIR,
+            threshold=config.get('CACHE_THRESHOLD', 500),
+            stale_seconds=config.get('CACHE_STALE_SECONDS', 300),
+            lock_timeout=config.get('CACHE_LOCK_TIMEOUT', 30),
+            wait_timeout=config.get('CACHE_WAIT_TIMEOUT', 5)
+        )
+        return cls(*args, **kwargs)
+
+    # Files
+
+    def _path(self, key, suffix):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.{suffix}')
+
+    def _read(self, key):
+        """(expires_at, value) for a key, or None if absent or unreadable"""
+        try:
+            with open(self._path(key, 'entry'), 'rb') as f:
+                data = f.read()
+            expires_at, _ = ENTRY_HEADER.unpack_from(data)
+            return expires_at, pickle.loads(data[ENTRY_HEADER.size:])
+        except (OSError, EOFError, struct.error, pickle.UnpicklingError):
+            return None
+
+    def _fresh(self, expires_at, now):
+        return expires_at == 0 or expires_at > now
+
+    # Refresh locks
+
+    def _try_lock(self, key):
+        """Claim the refresh lock for key; False if another worker holds it"""
+        path = self._path(key, 'lock')
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(path) <= self.lock_timeout:
+                    return False
+                # The holder died or its view raised before set()
+                os.remove(path)
+                self._count('lock_breaks')
+            except FileNotFoundError:
+                pass
+        return False
+
+    def _unlock(self, key):
+        try:
+            os.remove(self._path(key, 'lock'))
+        except FileNotFoundError:
+            pass
+
+    def _claimed(self):
+        if not hasattr(self._claims, 'keys'):
+            self._claims.keys = set()
+        return self._claims.keys
+
+    def release_claims(self):
+        """Release the refresh locks this thread claimed but never set() a value for"""
+        claimed = self._claimed()
+        while claimed:
+            self._unlock(claimed.pop())
+
+    # Counters
+
+    def _counter_map(self):
+        """The shared counters file, mapped once per process"""
+        if self._counters_pid != os.getpid():
+            path = os.path.join(self.cache_dir, COUNTERS_FILE)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = len(COUNTERS) * 8
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._counters = (fd, mmap.mmap(fd, size))
+            self._counters_pid = os.getpid()
+        return self._counters
+
+    def _count(self, name):
+        offset = COUNTERS.index(name) * 8
+        try:
+            with self._counter_lock:
+                fd, counters = self._counter_map()
+                # POSIX record locks are per process; the thread lock covers threads
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    value, = struct.unpack_from('<Q', counters, offset)
+                    struct.pack_into('<Q', counters, offset, value + 1)
+                finally:
+                    if fcntl:
+                        fcntl.lockf(fd, fcntl.LOCK_UN)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Counters shared by all workers, plus the current entry count"""
+        with self._counter_lock:
+            _, counters = self._counter_map()
+            values = struct.unpack_from(f'<{len(COUNTERS)}Q', counters)
+        result = dict(zip(COUNTERS, values))
+        served = result['hits'] + result['stale_hits'] + result['waited_hits']
+        lookups = served + result['misses']
+        result['hit_ratio'] = round(served / lookups, 4) if lookups else 0.0
+        result['entries'] = sum(1 for name in os.listdir(self.cache_dir) if name.endswith('.entry'))
+        result['threshold'] = self.threshold
+        return result
+
+    # Cache API
+
+    def get(self, key):
+        now = time.time()
+        entry = self._read(key)
+        if entry and self._fresh(entry[0], now):
+            self._count('hits')
+            return entry[1]
+        if entry and entry[0] + self.stale_seconds <= now:
+            entry = None
+
+        if self._try_lock(key):
+            # This worker recomputes; set() or release_claims() releases the lock
+            self._claimed().add(key)
+            self._count('misses')
+            return None
+        if entry:
+            self._count('stale_hits')
+            return entry[1]
+
+        # Nothing to serve yet: wait for the worker that is computing it
+        deadline = now + self.wait_timeout
+        while time.time() < deadline:
+            time.sleep(WAIT_POLL_SECONDS)
+            entry = self._read(key)
+            if entry and self._fresh(entry[0], time.time()):
+                self._count('waited_hits')
+                return entry[1]
+            if not os.path.exists(self._path(key, 'lock')):
+                # The refresh gave up without a value: compute it here
+                break
+        self._count('misses')
+        return None
+
+    def set(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        now = time.time()
+        expires_at = now + timeout if timeout > 0 else 0
+        path = self._path(key, 'entry')
+        tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(ENTRY_HEADER.pack(expires_at, now))
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        finally:
+            # Only the claiming thread releases; a waiter that gave up and
+            # computed the value itself must not drop a newer refresh's lock
+            if key in self._claimed():
+                self._claimed().discard(key)
+                self._unlock(key)
+        self._count('sets')
+        self._prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        entry = self._read(key)
+        return bool(entry) and self._fresh(entry[0], time.time())
+
+    def delete(self, key):
+        self._claimed().discard(key)
+        self._unlock(key)
+        try:
+            os.remove(self._path(key, 'entry'))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.entry', '.lock')):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+        return True
+
+    def _prune(self):
+        """Evict entries past their stale window, then the oldest over threshold"""
+        if not self.threshold:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.entry'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    pass
+        if len(entries) <= self.threshold:
+            return
+
+        now = time.time()
+        keep = []
+        for mtime, path in entries:
+            try:
+                with open(path, 'rb') as f:
+                    expires_at, _ = ENTRY_HEADER.unpack(f.read(ENTRY_HEADER.size))
+            except (OSError, struct.error):
+                continue
+            if expires_at and expires_at + self.stale_seconds <= now:
+                self._evict(path)
+            else:
+                keep.append((mtime, path))
+        keep.sort()
+        for _, path in keep[:max(0, len(keep) - self.threshold)]:
+            self._evict(path)
+
+    def _evict(self, path):
+        try:
+            os.remove(path)
+            self._count('evictions')
+        except FileNotFoundError:
+            pass
+
+
+class SingleFlightCache(Cache):
+    """
+    Flask-Caching extension whose cached views always release their refresh lock.
+
+    Flask-Caching only calls set() when the view succeeds and the response
+    filter accepts the result; errors, filtered responses and exceptions
+    (a rate limit, say) would leave the lock held until lock_timeout and
+    make every other worker wait out wait_timeout.
+    """
+
+    def cached(self, *args, **kwargs):
+        decorator = super().cached(*args, **kwargs)
+
+        def wrap(f):
+            cached_view = decorator(f)
+
+            @functools.wraps(cached_view)
+            def view(*view_args, **view_kwargs):
+                try:
+                    return cached_view(*view_args, **view_kwargs)
+                finally:
+                    release = getattr(self.cache, 'release_claims', None)
+                    if release:
+                        release()
+            return view
+        return wrap
@@ -0,0 +1,101 @@
+"""
+Server-Sent Events stream of IOC changes for CTI Dashboard
+
+Every generation bump publishes an event keyed by the new ingest
+generation (see IOCStore._publish_change): new IOCs plus stat deltas, the
+deltas of removed IOCs, or an empty-delta 'changed' event for tags,
+re-listed IOCs and rebuilt rollups. /api/stream relays them to the
+dashboard so it updates without polling.
+
+The event id is the generation, so a reconnecting EventSource resumes
+from Last-Event-ID. A connection is closed after STREAM_MAX_SECONDS
+(clients reconnect automatically) so a sync gunicorn worker is never held
+past its timeout; threaded or async workers can raise the limit.
+
+Under gthread every open stream holds one worker thread, so each worker
+serves at most STREAM_MAX_PER_WORKER streams and answers 503 with
+Retry-After above that; the dashboard then falls back to polling. Keep it
+below GUNICORN_THREADS, or raise it under gevent, where a stream costs a
+greenlet rather than a thread.
+"""
+import os
+import threading
+import time
+from flask import Response, jsonify, request, stream_with_context
+from web.encoding import dumps
+
+# Seconds a stream stays open before the client is asked to reconnect
+STREAM_MAX_SECONDS = int(os.getenv('STREAM_MAX_SECONDS', 55))
+
+# Reconnect delay sent to clients
+STREAM_RETRY_MS = 5000
+
+# Idle seconds between keep-alive comments, so proxies do not drop the connection
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Open streams per worker process; the rest of its threads stay free for API requests
+STREAM_MAX_PER_WORKER = int(os.getenv('STREAM_MAX_PER_WORKER', 4))
+
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_PER_WORKER)
+
+
+def _resume_from(store):
+    """Generation to stream after: Last-Event-ID, ?last_event_id, or the current one"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return max(0, int(last_event_id))
+    except (TypeError, ValueError):
+        return store.ingest_generation()
+
+
+def _format_event(event):
+    return f"id: {event['generation']}\nevent: {event['type']}\ndata: {dumps(event)}\n\n"
+
+
+def _release_once(semaphore):
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            semaphore.release()
+    return release
+
+
+def event_stream_response(store):
+    """text/event-stream response relaying store change events; 503 when this worker is at its stream limit"""
+    if not _stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open streams, retry later or poll /api/stats'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(STREAM_RETRY_MS // 1000)
+        return response
+    release = _release_once(_stream_slots)
+    try:
+        after = _resume_from(store)
+    except Exception:
+        release()
+        raise
+
+    def generate():
+        yield f"retry: {STREAM_RETRY_MS}\n"
+        yield f"event: hello\ndata: {dumps({'generation': after})}\n\n"
+        last_sent = time.monotonic()
+        try:
+            for event in store.iter_events(after=after, timeout=STREAM_MAX_SECONDS):
+                if event is not None:
+                    yield _format_event(event)
+                elif time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                    yield ": keep-alive\n\n"
+                else:
+                    continue
+                last_sent = time.monotonic()
+        except Exception as e:
+            print(f"Error streaming events: {e}")
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # The slot is freed when the server closes the response, even if it never started streaming
+    response.call_on_close(release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response